@@ -1,116 +1,150 @@
+import os
+import io
+import time
+import logging
+import cProfile
+import pstats
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, Response
 from config import Config
+from dataset import Dataset, DatasetStore, file_signature
+from loader import read_csv_with_fallback, clean_data, load_csv_streaming
+from quality import normalize_name
+from cube import to_day_number
+from snapshot import read_snapshot_parts, write_snapshot, snapshot_lock, SnapshotPublisher
+from query_cache import QueryCache
+from timeseries import GRANULARITIES, GROUPINGS, cube_rollup, day_bounds, row_rollup
+from geo import LEVELS, level_for_span, tile_bbox
+from responses import choose_encoding, compress, dumps, make_etag
+from distinct import shop_keys
+from executor import QueryExecutor, QueryTimeout
+from leaderboard import ORDERS, RANK_METRICS, rank_entries
+from store import AnalyticsSource, AnalyticsStore, StoreDataset
+from export import EXPORT_FORMATS, csv_stream, export_chunks, export_columns, xlsx_stream
+from sources import SOURCE_COLUMN, data_signature, is_multi_source, load_sources
+import metrics
+from metrics import CACHE_EVENTS, LOAD_SECONDS, REQUEST_SECONDS
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# Per-request detail is logged at DEBUG; at the default level those calls return before formatting anything
+logging.basicConfig(level=app.config['LOG_LEVEL'], format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+log = logging.getLogger(__name__)
+
 def load_data():
+    """Load the cleaned BDM data as a DataFrame"""
+    return load_data_with_cube()[0]
+
+def load_data_with_cube():
+    """Load the cleaned BDM data, plus its daily cube when it was aggregated while streaming"""
+    return load_dataset_parts()[:2]
+
+def load_dataset_parts():
+    """Load (frame, cube, row index, geo index[, source cubes]); prebuilt parts are None when they still need
+    building, and there are source cubes only when DATA_FILE names several files"""
+    signature = data_signature(app.config['DATA_FILE'])
+    parts = _load_sources() if is_multi_source(app.config['DATA_FILE']) else _load_dataset_parts()
+    if analytics_store is not None and signature is not None and not parts[0].attrs.get('dummy'):
+        # Keep the analytics store in step with what was just loaded (upserts make repeats harmless)
+        try:
+            if analytics_store.ingested_signature() != signature:
+                analytics_store.ingest_frame(parts[0], app.config['DATA_FILE'], signature,
+                                             chunk_rows=app.config['DATA_CHUNK_ROWS'])
+        except Exception:
+            log.exception("Error ingesting data into the analytics store")
+    return parts
+
+def _load_dataset_parts():
     try:
         # Use the path from config instead of hardcoding it
         file_path = app.config['DATA_FILE']
-        print(f"Attempting to load data from {file_path}")
-        
-        # Try to read the CSV file with different encodings
-        encodings = ['utf-8', 'latin-1', 'cp1252', 'ISO-8859-1']
-        df = None
-        
-        for encoding in encodings:
-            try:
-                print(f"Trying to read CSV with {encoding} encoding...")
-                df = pd.read_csv(file_path, encoding=encoding, low_memory=False)
-                print(f"Successfully read CSV with {encoding} encoding")
-                break
-            except UnicodeDecodeError:
-                print(f"Failed to read with {encoding} encoding")
-                continue
-            except Exception as e:
-                print(f"Error reading CSV with {encoding} encoding: {str(e)}")
-                continue
-        
-        if df is None:
-            print("Failed to read CSV with any encoding, creating dummy data")
-            return create_dummy_data()
-        
-        print(f"CSV file loaded successfully with shape: {df.shape}")
-        total_rows = len(df)
-        print(f"Column names: {df.columns.tolist()}")
-        
-        # Verify required columns exist
-        required_columns = ['Timestamp', 'BDM Name', 'Shop Name', 'State', 'Keys Sold', 'Key Amount']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            print(f"WARNING: Missing required columns: {missing_columns}")
-            # If missing required columns, try to be flexible with column names by checking for similar ones
-            for missing_col in missing_columns.copy():
-                for col in df.columns:
-                    if missing_col.lower() in col.lower():
-                        print(f"Found alternative column '{col}' for '{missing_col}'")
-                        df[missing_col] = df[col]
-                        missing_columns.remove(missing_col)
-                        break
-        
-        if missing_columns:
-            print(f"Still missing columns after attempting to find alternatives: {missing_columns}")
-            print("Creating dummy data since required columns are missing")
-            return create_dummy_data()
-        
-        # Convert Timestamp to datetime (use automatic format detection with dayfirst=True)
-        df['Timestamp'] = pd.to_datetime(df['Timestamp'], errors='coerce', dayfirst=True)
-        
-        # Report on null values
-        null_timestamp_count = df['Timestamp'].isna().sum()
-        print(f"Null timestamps: {null_timestamp_count} of {len(df)}")
-        
-        # IMPORTANT: Do NOT drop rows with null timestamps
-        # Instead, fill null timestamps with a default date to preserve all data
-        if null_timestamp_count > 0:
-            print(f"Filling {null_timestamp_count} null timestamps with a default date")
-            df['Timestamp'].fillna(pd.Timestamp('2025-01-01'), inplace=True)
-        
-        # Convert numeric columns properly
-        df['Keys Sold'] = pd.to_numeric(df['Keys Sold'], errors='coerce').fillna(0).astype(int)
-        df['Key Amount'] = pd.to_numeric(df['Key Amount'], errors='coerce').fillna(0).astype(float)
-        
-        # Ensure text columns have valid values
-        df['BDM Name'] = df['BDM Name'].fillna('Unknown')
-        df['Shop Name'] = df['Shop Name'].fillna('Unknown')
-        df['State'] = df['State'].fillna('Unknown')
-        
-        # Create date-related columns
-        df['Month'] = df['Timestamp'].dt.month_name()
-        df['Week'] = df['Timestamp'].dt.isocalendar().week
-        df['Year'] = df['Timestamp'].dt.year
-        df['Date'] = df['Timestamp'].dt.date
-        
-        # Print summary statistics
-        print(f"Unique BDMs: {df['BDM Name'].nunique()}")
-        print(f"Unique Shops: {df['Shop Name'].nunique()}")
-        print(f"Unique States: {df['State'].nunique()}")
-        print(f"Total Keys Sold: {df['Keys Sold'].sum()}")
-        print(f"Total Sales Amount: {df['Key Amount'].sum()}")
-        
-        # Print summary and verify we maintained all rows
-        print(f"Data loaded successfully: {len(df)} rows with {df['BDM Name'].nunique()} unique BDMs")
-        if len(df) != total_rows:
-            print(f"WARNING: Row count changed from {total_rows} to {len(df)}!")
-        else:
-            print(f"Confirmed all {total_rows} rows were preserved")
-        
-        return df
-        
-    except Exception as e:
-        print(f"Error loading data: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return create_dummy_data()
+        if not app.config['DATA_SNAPSHOT']:
+            return _parse_data_file(file_path) + (None, None)
+        
+        # One process parses and writes the snapshot; other workers wait here and then map it
+        with snapshot_lock(file_path):
+            started = time.perf_counter()
+            # Reuse the columnar snapshot of a previous parse if the file has not changed since
+            parts = read_snapshot_parts(file_path)
+            if parts is not None:
+                LOAD_SECONDS.observe(time.perf_counter() - started, 'snapshot')
+                return parts
+            signature = file_signature(file_path)
+            df, cube = _parse_data_file(file_path)
+            
+            # Only snapshot if the file did not change while we were parsing it
+            if df.attrs.get('dummy') or file_signature(file_path) != signature:
+                return df, cube, None, None
+            dataset = Dataset(df, version=None, signature=signature, cube=cube)
+            if not write_snapshot(dataset.frame, file_path, signature, cube=dataset.cube,
+                                  row_index=dataset.index, geo_index=dataset.geo):
+                return dataset.frame, dataset.cube, dataset.index, dataset.geo
+        
+        # Serve the mapped copy so every worker shares the same pages
+        return read_snapshot_parts(file_path) or (dataset.frame, dataset.cube, dataset.index, dataset.geo)
+        
+    except Exception:
+        log.exception("Error loading data")
+        return create_dummy_data(), None, None, None
+
+def _load_sources():
+    """Merge every file of a multi-file DATA_FILE, parsing the changed ones in parallel"""
+    try:
+        loaded = load_sources(app.config['DATA_FILE'], chunk_rows=app.config['DATA_CHUNK_ROWS'],
+                              processes=app.config['DATA_LOAD_PROCESSES'], snapshot=app.config['DATA_SNAPSHOT'])
+        if loaded is not None:
+            frame, cube, sources = loaded
+            log.info("Merged %d source files into shape %s", len(sources), frame.shape)
+            return frame, cube, None, None, sources
+        log.warning("No readable CSV files match %s, creating dummy data", app.config['DATA_FILE'])
+    except Exception:
+        log.exception("Error loading data")
+    return create_dummy_data(), None, None, None
+
+def _parse_data_file(file_path):
+    """Stream and clean the CSV into (frame, cube), or dummy data if it cannot be read"""
+    started = time.perf_counter()
+    log.info("Attempting to load data from %s", file_path)
+    
+    # Read in bounded chunks so peak memory follows the chunk size, not the file size
+    loaded = load_csv_streaming(file_path, chunk_rows=app.config['DATA_CHUNK_ROWS'])
+    
+    if loaded is None:
+        log.warning("Failed to read CSV with the required columns, creating dummy data")
+        return create_dummy_data(), None
+    
+    df, cube = loaded
+    LOAD_SECONDS.observe(time.perf_counter() - started, 'csv')
+    log.info("CSV file loaded successfully with shape %s", df.shape)
+    return df, cube
+
+def load_appended_data(data, seen=None):
+    """Parse and clean CSV bytes (header line plus newly appended rows) the same way load_data does
+
+    seen holds the rows already loaded (see quality.SeenSubmissions); repeats of them are dropped.
+    """
+    df = read_csv_with_fallback(data)
+    if df is None:
+        return None
+    log.debug("Parsed %d appended rows", len(df))
+    return clean_data(df, seen=seen)
+
+def append_data(data, seen=None):
+    """load_appended_data for the in-memory dataset, also upserting the rows into the analytics store"""
+    delta = load_appended_data(data, seen)
+    if delta is not None and analytics_store is not None:
+        try:
+            analytics_store.append(delta)
+        except Exception:
+            log.exception("Error upserting appended rows into the analytics store")
+    return delta
 
 def create_dummy_data():
     """Create dummy data if the real data cannot be loaded"""
-    print("Creating dummy data for demonstration purposes")
+    log.warning("Creating dummy data for demonstration purposes")
     # Create a date range for the last 30 days
     end_date = datetime.now()
     start_date = end_date - timedelta(days=30)
@@ -141,162 +175,277 @@ def create_dummy_data():
     df['Month'] = df['Timestamp'].dt.month_name()
     df['Week'] = df['Timestamp'].dt.isocalendar().week
     df['Year'] = df['Timestamp'].dt.year
-    df['Date'] = df['Timestamp'].dt.date
+    df['Date'] = df['Timestamp'].dt.normalize()
     
-    print(f"Created dummy data with {len(df)} rows")
+    log.info("Created dummy data with %d rows", len(df))
+    # Marks the frame as not coming from the data file, so it is never appended to
+    df.attrs['dummy'] = True
     return df
 
-def get_bdm_performance(df, time_filter=None, month=None, year=None, state=None, start_date=None, end_date=None):
-    """Calculate BDM performance metrics based on filters"""
-    try:
-        # Apply filters
-        filtered_df = df.copy()
-        original_count = len(filtered_df)
-        print(f"Starting filtering with {original_count} records")
-        
-        # Check if DataFrame is empty
-        if filtered_df.empty:
-            print("Warning: Empty DataFrame provided for filtering")
-            return []
-        
-        # Debug info - print dimensions and sample data
-        print(f"Original data dimensions: {filtered_df.shape}, unique BDMs: {filtered_df['BDM Name'].nunique()}")
-        print(f"Original data contains null timestamps: {filtered_df['Timestamp'].isna().sum()} rows")
-        
-        # Display a sample of timestamps to identify patterns
-        timestamp_sample = filtered_df['Timestamp'].dropna().sample(min(5, len(filtered_df))).tolist()
-        print(f"Sample timestamps: {timestamp_sample}")
-        
-        # Check for "Show All" condition
-        is_show_all = ((time_filter == 'monthly' and not month and not year) or 
-                       (time_filter == 'daily' and not start_date) or 
-                       (time_filter == 'weekly' and (not start_date or not end_date))) and state == 'All'
-        
-        if is_show_all:
-            print("Show all data request detected - skipping all time filters")
-            # Skip time filters but still apply state filter if needed
-        else:
-            # Apply time filter (daily, weekly, monthly)
-            if time_filter == 'daily':
-                if start_date:
-                    try:
-                        # Parse the start date from MM/DD/YYYY format
-                        selected_date = datetime.strptime(start_date, '%m/%d/%Y').date()
-                        filtered_df = filtered_df[filtered_df['Date'] == selected_date]
-                        print(f"Daily filter applied for selected date {selected_date}: {len(filtered_df)} records remaining")
-                    except (ValueError, TypeError) as e:
-                        print(f"Error parsing start date: {str(e)}")
-                        # Default to showing all data if parsing fails
-                        print("Showing all data since date parsing failed")
-                else:
-                    # If no start date is provided, default to showing all data
-                    print("No specific date selected for daily filter, showing all data")
-            elif time_filter == 'weekly':
-                if start_date and end_date:
-                    try:
-                        # Parse the date range from MM/DD/YYYY format
-                        start = datetime.strptime(start_date, '%m/%d/%Y').date()
-                        end = datetime.strptime(end_date, '%m/%d/%Y').date()
-                        filtered_df = filtered_df[(filtered_df['Date'] >= start) & (filtered_df['Date'] <= end)]
-                        print(f"Weekly filter applied from {start} to {end}: {len(filtered_df)} records remaining")
-                    except (ValueError, TypeError) as e:
-                        print(f"Error parsing date range: {str(e)}")
-                        # Default to showing all data if parsing fails
-                        print("Showing all data since date range parsing failed")
-                else:
-                    # If no date range is provided, default to showing all data
-                    print("No specific week selected for weekly filter, showing all data")
-            elif time_filter == 'monthly':
-                # If specific month is provided, filter by it
-                if month and year and month != '' and year != '':
-                    try:
-                        # Handle both numeric month and month name
-                        if month.isdigit():
-                            month_num = int(month)
-                        else:
-                            try:
-                                month_num = datetime.strptime(month, '%B').month
-                            except ValueError:
-                                # Try abbreviated month name
-                                month_num = datetime.strptime(month, '%b').month
-                        
-                        year_num = int(year)
-                        print(f"Applying monthly filter for month={month_num}, year={year_num}")
-                        
-                        # Filter by month number and year
-                        filtered_df = filtered_df[(filtered_df['Timestamp'].dt.month == month_num) & 
-                                                (filtered_df['Timestamp'].dt.year == year_num)]
-                    except (ValueError, TypeError) as e:
-                        print(f"Error parsing month/year: {str(e)}")
-                        # Show all data instead of defaulting to a specific month/year
-                        print("Showing all data since month/year parsing failed")
-                else:
-                    # Show all data if no month/year specified
-                    print("No month/year specified. Showing all data")
+# Parsed once per process and shared by all requests; reloaded in the background when the file changes
+# With DATA_SHARED, appended generations are republished as snapshots so every worker maps one copy
+# Several source files are reloaded whole (each unchanged one from its own snapshot), so neither applies
+single_file = not is_multi_source(app.config['DATA_FILE'])
+data_store = DatasetStore(app.config['DATA_FILE'], load_dataset_parts,
+                          check_interval=app.config['DATA_RELOAD_INTERVAL'],
+                          appender=append_data if app.config['DATA_INCREMENTAL'] and single_file else None,
+                          publisher=(SnapshotPublisher(app.config['DATA_FILE'])
+                                     if app.config['DATA_SHARED'] and app.config['DATA_SNAPSHOT'] and single_file
+                                     else None),
+                          signature=data_signature)
+
+# Optional SQLite store every load is upserted into; with ANALYTICS_PUSHDOWN the dashboard and /filter-data
+# query it directly, syncing it from the data file themselves. The other data routes still read data_store,
+# which then loads the rows on first use
+analytics_store = AnalyticsStore(app.config['ANALYTICS_STORE']) if app.config['ANALYTICS_STORE'] else None
+analytics_source = (AnalyticsSource(analytics_store, app.config['DATA_FILE'],
+                                    check_interval=app.config['DATA_RELOAD_INTERVAL'],
+                                    appender=load_appended_data if app.config['DATA_INCREMENTAL'] else None,
+                                    chunk_rows=app.config['DATA_CHUNK_ROWS'])
+                    if analytics_store is not None and app.config['ANALYTICS_PUSHDOWN'] and single_file else None)
+
+# Results of get_bdm_performance keyed on the normalized filter window; cleared when the dataset reloads
+performance_cache = QueryCache(maxsize=app.config['QUERY_CACHE_SIZE'], ttl=app.config['QUERY_CACHE_TTL'])
+# Store generations count separately from dataset versions, so their results get their own cache
+store_cache = QueryCache(maxsize=app.config['QUERY_CACHE_SIZE'], ttl=app.config['QUERY_CACHE_TTL'])
+query_executor = QueryExecutor(app.config['QUERY_WORKERS'], app.config['QUERY_TIMEOUT'],
+                               keep_last=app.config['QUERY_CACHE_SIZE'])
+
+def performance_dataset():
+    """What the performance routes aggregate: the in-memory dataset, or the analytics store with pushdown"""
+    return analytics_source.get() if analytics_source is not None else data_store.get()
+
+def results_cache(dataset):
+    return store_cache if isinstance(dataset, StoreDataset) else performance_cache
+
+def busy_response(error):
+    """503 for a query that timed out with no earlier result to serve"""
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+def resolve_time_window(time_filter=None, month=None, year=None, state=None, start_date=None, end_date=None):
+    """Turn the time filter parameters into an inclusive (start_day, end_day) window of days since epoch"""
+    # Check for "Show All" condition
+    is_show_all = ((time_filter == 'monthly' and not month and not year) or 
+                   (time_filter == 'daily' and not start_date) or 
+                   (time_filter == 'weekly' and (not start_date or not end_date))) and state == 'All'
+
+    # Inclusive day window (days since epoch); None means unbounded
+    start_day = end_day = None
+
+    if is_show_all:
+        log.debug("Show all data request detected - skipping all time filters")
+        # Skip time filters but still apply state filter if needed
+    else:
+        # Apply time filter (daily, weekly, monthly)
+        if time_filter == 'daily':
+            if start_date:
+                try:
+                    # Parse the start date from MM/DD/YYYY format
+                    selected_date = datetime.strptime(start_date, '%m/%d/%Y').date()
+                    start_day = end_day = to_day_number(selected_date)
+                    log.debug("Daily filter applied for selected date %s", selected_date)
+                except (ValueError, TypeError) as e:
+                    # Default to showing all data if parsing fails
+                    log.warning("Error parsing start date, showing all data: %s", e)
+            else:
+                # If no start date is provided, default to showing all data
+                log.debug("No specific date selected for daily filter, showing all data")
+        elif time_filter == 'weekly':
+            if start_date and end_date:
+                try:
+                    # Parse the date range from MM/DD/YYYY format
+                    start = datetime.strptime(start_date, '%m/%d/%Y').date()
+                    end = datetime.strptime(end_date, '%m/%d/%Y').date()
+                    start_day, end_day = to_day_number(start), to_day_number(end)
+                    log.debug("Weekly filter applied from %s to %s", start, end)
+                except (ValueError, TypeError) as e:
+                    # Default to showing all data if parsing fails
+                    log.warning("Error parsing date range, showing all data: %s", e)
+            else:
+                # If no date range is provided, default to showing all data
+                log.debug("No specific week selected for weekly filter, showing all data")
+        elif time_filter == 'monthly':
+            # If specific month is provided, filter by it
+            if month and year and month != '' and year != '':
+                try:
+                    # Handle both numeric month and month name
+                    if month.isdigit():
+                        month_num = int(month)
+                    else:
+                        try:
+                            month_num = datetime.strptime(month, '%B').month
+                        except ValueError:
+                            # Try abbreviated month name
+                            month_num = datetime.strptime(month, '%b').month
+
+                    year_num = int(year)
+                    log.debug("Applying monthly filter for month=%s, year=%s", month_num, year_num)
+
+                    # A calendar month is just the day window from its first to its last day
+                    first_day = pd.Timestamp(year=year_num, month=month_num, day=1)
+                    start_day = to_day_number(first_day)
+                    end_day = to_day_number(first_day + pd.offsets.MonthEnd(0))
+                except (ValueError, TypeError) as e:
+                    # Show all data instead of defaulting to a specific month/year
+                    log.warning("Error parsing month/year, showing all data: %s", e)
+            else:
+                # Show all data if no month/year specified
+                log.debug("No month/year specified. Showing all data")
+    
+    return start_day, end_day
+
+def filter_key(time_filter=None, month=None, year=None, state=None, start_date=None, end_date=None):
+    """Normalize filter parameters to a (start_day, end_day, state_filter) cube query and cache key"""
+    with metrics.stage('filter'):
+        # Resolve the time filter to a day window
+        start_day, end_day = resolve_time_window(time_filter, month, year, state, start_date, end_date)
         
         # Apply state filter
-        if state and state != 'All':
-            state_count_before = len(filtered_df)
-            filtered_df = filtered_df[filtered_df['State'] == state]
-            print(f"State filter applied for '{state}': {state_count_before} → {len(filtered_df)} records")
+        state_filter = normalize_name(state) if state and state != 'All' else None
+    return start_day, end_day, state_filter
+
+def format_performance(performance):
+    """Turn a cube query result into the row dicts the dashboard renders"""
+    # If we don't have any data after filtering, return empty list
+    if performance.empty:
+        log.debug("No data matches the current filters")
+        return []
+    
+    with metrics.stage('format'):
+        # Rename columns for clarity
+        performance.columns = ['BDM Name', '# Visits', '# Unique Merchants Visited', '# Keys Sold', 'Key Sales Amount']
         
-        print(f"After all filtering: {len(filtered_df)} of {original_count} records remaining")
+        # Format the sales amount
+        performance['Key Sales Amount'] = performance['Key Sales Amount'].apply(lambda x: f"₹{x:,.2f}")
         
-        # If we don't have any data after filtering, return empty list
-        if filtered_df.empty:
-            print("No data matches the current filters")
+        result = performance.to_dict('records')
+    log.debug("Generated performance data for %d BDMs", len(result))
+    return result
+
+def source_cube(dataset, source=None):
+    """The cube to aggregate: the whole dataset's, or that of one of its source files"""
+    return dataset.cube if source is None else dataset.sources[source]
+
+def performance_rows(dataset, cache_key, cacheable=True, source=None):
+    """Formatted performance rows for a filter_key() window, from the result cache or the cube"""
+    start_day, end_day, state_filter = cache_key
+    cache_key = cache_key + (source,)
+    cache = results_cache(dataset)
+    if cacheable:
+        cached = cache.get(dataset.version, cache_key)
+        CACHE_EVENTS.inc('miss' if cached is None else 'hit')
+        if cached is not None:
+            log.debug("Cache hit for %s on dataset version %s", cache_key, dataset.version)
+            return [dict(row) for row in cached]
+    
+    # Calculate performance metrics grouped by BDM from the pre-aggregated daily cube
+    try:
+        with metrics.stage('aggregate'):
+            performance = source_cube(dataset, source).query(start_day, end_day, state_filter)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("After all filtering: %d of %d records remaining",
+                      int(performance['visits'].sum()), len(dataset))
+        
+        result = format_performance(performance)
+        if cacheable:
+            cache.put(dataset.version, cache_key, result)
+        # Callers get their own row dicts so the cached ones are never modified
+        return [dict(row) for row in result]
+    except Exception:
+        log.exception("Error calculating performance metrics")
+        return []
+
+def performance_columns(dataset, cache_key, source=None):
+    """Performance for a filter_key() window as one list per metric, numbers left unformatted"""
+    start_day, end_day, state_filter = cache_key
+    with metrics.stage('aggregate'):
+        performance = source_cube(dataset, source).query(start_day, end_day, state_filter)
+    with metrics.stage('format'):
+        performance = performance.rename(columns={'BDM Name': 'bdm'})
+        performance['key_amount'] = performance['key_amount'].round(2)
+        return {column: performance[column].tolist() for column in performance.columns}
+
+def get_bdm_performance(df, time_filter=None, month=None, year=None, state=None, start_date=None, end_date=None,
+                        source=None):
+    """Calculate BDM performance metrics based on filters
+
+    With source, only visits read from that file of a multi-file dataset are counted.
+    """
+    try:
+        # Accept the shared Dataset (with its pre-built cube), the analytics store, or a plain cleaned DataFrame
+        shared = isinstance(df, (Dataset, StoreDataset))
+        dataset = df if shared else Dataset(df, version=None)
+        original_count = len(dataset)
+        log.debug("Starting filtering with %d records", original_count)
+        
+        # Check if DataFrame is empty
+        if dataset.empty:
+            log.warning("Empty DataFrame provided for filtering")
             return []
         
-        # Debug info - print filtered dimensions before aggregation
-        print(f"Filtered data before aggregation: {filtered_df.shape}, unique BDMs: {filtered_df['BDM Name'].nunique()}")
+        cache_key = filter_key(time_filter, month, year, state, start_date, end_date)
         
-        # Calculate performance metrics grouped by BDM
-        try:
-            performance = filtered_df.groupby('BDM Name').agg(
-                visits=('Timestamp', 'count'),
-                unique_merchants=('Shop Name', 'nunique'),
-                keys_sold=('Keys Sold', 'sum'),
-                key_amount=('Key Amount', 'sum')
-            ).reset_index()
-            
-            # Rename columns for clarity
-            performance.columns = ['BDM Name', '# Visits', '# Unique Merchants Visited', '# Keys Sold', 'Key Sales Amount']
-            
-            # Format the sales amount
-            performance['Key Sales Amount'] = performance['Key Sales Amount'].apply(lambda x: f"₹{x:,.2f}")
-            
-            result = performance.to_dict('records')
-            print(f"Generated performance data for {len(result)} BDMs with a total of {filtered_df.shape[0]} rows")
-            return result
-        except Exception as e:
-            print(f"Error calculating performance metrics: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return []
-            
-    except Exception as e:
-        print(f"Error in get_bdm_performance: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        # Serve repeated filter combinations from the result cache (only for versioned, shared datasets)
+        return performance_rows(dataset, cache_key, cacheable=shared, source=source)
+    except Exception:
+        log.exception("Error in get_bdm_performance")
         return []
 
+def get_bdm_performance_batch(dataset, specs):
+    """Calculate BDM performance for many filter specs against one dataset in a single pass
+    
+    Each spec is a dict with the filter_data() form fields (including source). Identical windows
+    are computed once, cached ones are reused, and the rest go to the cube together so windows on
+    the same state share one gather. Returns one list of row dicts per spec, in order.
+    """
+    if dataset.empty:
+        return [[] for _ in specs]
+    
+    keys = [filter_key(spec.get('time_filter', 'monthly'), spec.get('month', ''), spec.get('year', ''),
+                       spec.get('state', 'All'), spec.get('start_date'), spec.get('end_date'))
+            + (_source_param(spec),)
+            for spec in specs]
+    
+    cache = results_cache(dataset)
+    results = {}
+    for key in dict.fromkeys(keys):
+        cached = cache.get(dataset.version, key)
+        CACHE_EVENTS.inc('miss' if cached is None else 'hit')
+        if cached is not None:
+            results[key] = cached
+    
+    # Windows on the same cube are answered together
+    for source in dict.fromkeys(key[3] for key in keys if key not in results):
+        missing = [key for key in dict.fromkeys(keys) if key not in results and key[3] == source]
+        with metrics.stage('aggregate'):
+            performances = source_cube(dataset, source).query_many([key[:3] for key in missing])
+        for key, performance in zip(missing, performances):
+            results[key] = format_performance(performance)
+            cache.put(dataset.version, key, results[key])
+    
+    # Callers get their own row dicts so the cached ones are never modified
+    return [[dict(row) for row in results[key]] for key in keys]
+
 @app.route('/')
 def dashboard():
     """Render the main dashboard page"""
     try:
-        df = load_data()
+        with metrics.stage('load'):
+            dataset = performance_dataset()
         
-        # Print debugging info
-        print(f"DataFrame shape: {df.shape}")
-        if not df.empty:
-            print(f"Data sample: {df.head(2)}")
-        else:
-            print("Warning: DataFrame is empty!")
+        # Debugging info; the sample is only rendered when DEBUG logging is on
+        log.debug("Dataset rows: %d", len(dataset))
+        if dataset.empty:
+            log.warning("Dataset is empty!")
+        elif log.isEnabledFor(logging.DEBUG) and isinstance(dataset, Dataset):
+            log.debug("Data sample: %s", dataset.frame.head(2))
         
-        # Get unique months and years for the filter
-        # Ensure we have valid entries only
-        months = sorted(df['Month'].dropna().astype(str).unique().tolist())
-        years = sorted(df['Year'].dropna().unique().tolist())
+        # Get unique months and years for the filter straight from the dataset's vocabularies
+        months = list(dataset.months)
+        years = list(dataset.years)
         
         if not months:
             # If no valid months, add current month as a fallback
@@ -307,26 +456,31 @@ def dashboard():
             years = [datetime.now().year]
         
         # Get the list of states from the data
-        states = sorted(df['State'].dropna().unique().tolist())
+        states = list(dataset.states)
         
         # Add 'All' option at the beginning if not already present
         if 'All' not in states:
             states.insert(0, 'All')
         
+        # Source files of a multi-file dataset, for attributing results to them
+        sources = list(dataset.sources or [])
+        
         # Calculate initial performance data (default: monthly, all states)
-        performance_data = get_bdm_performance(df, time_filter='monthly')
-        print(f"Performance data entries: {len(performance_data)}")
-        
-        return render_template('dashboard.html', 
-                               performance_data=performance_data,
-                               months=months,
-                               years=years,
-                               states=states)
+        performance_data, _ = query_executor.run(('dashboard', dataset.version),
+                                                 lambda: get_bdm_performance(dataset, time_filter='monthly'),
+                                                 stale_key='dashboard')
+        log.debug("Performance data entries: %d", len(performance_data))
+        
+        with metrics.stage('serialize'):
+            return render_template('dashboard.html', 
+                                   performance_data=performance_data,
+                                   months=months,
+                                   years=years,
+                                   states=states,
+                                   sources=sources)
     except Exception as e:
         # Log the error but still render the page with default empty data
-        print(f"Error rendering dashboard: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error rendering dashboard")
         
         # Provide fallback data for filters and empty performance data
         current_month = datetime.now().strftime('%B')
@@ -337,53 +491,533 @@ def dashboard():
                                months=[current_month],
                                years=[current_year],
                                states=['All'],
+                               sources=[],
                                error_message=f"Error loading data: {str(e)}")
 
-@app.route('/filter-data', methods=['POST'])
+@app.route('/filter-data', methods=['GET', 'POST'])
 def filter_data():
-    """Filter data based on the provided parameters"""
+    """Filter data based on the provided parameters
+    
+    format=rows (the default) returns one dict per BDM with the amount formatted and _total_rows on
+    every row; format=columnar returns one list per metric with raw numbers plus total_rows once.
+    source limits a multi-file dataset to the visits read from one of its files.
+    Bodies are cached encoded and compressed, and tagged so an unchanged result comes back as 304.
+    """
+    try:
+        with metrics.stage('parse'):
+            # Get filter parameters
+            params = request.values
+            time_filter = params.get('time_filter', 'monthly')
+            month = params.get('month', '')
+            year = params.get('year', '')
+            state = params.get('state', 'All')
+            start_date = params.get('start_date', None)
+            end_date = params.get('end_date', None)
+            output = params.get('format', 'rows')
+            source = _source_param(params)
+            if output not in ('rows', 'columnar'):
+                return jsonify({"error": "format must be rows or columnar"}), 400
+        
+        log.debug("Filter request received: time=%s, month=%s, year=%s, state=%s, start_date=%s, end_date=%s",
+                  time_filter, month, year, state, start_date, end_date)
+        
+        # Get the shared, already-parsed dataset
+        with metrics.stage('load'):
+            dataset = performance_dataset()
+        
+        if dataset.empty:
+            return jsonify({"error": "No data available"})
+        if source is not None and source not in (dataset.sources or {}):
+            return jsonify({"error": f"Unknown source: {source}"}), 400
+        
+        cache = results_cache(dataset)
+        cache_key = filter_key(time_filter, month, year, state, start_date, end_date)
+        # The file signature is the same in every worker process, unlike the version counter
+        etag = make_etag(dataset.signature or dataset.version, output, source, cache_key)
+        if request.if_none_match.contains_weak(etag):
+            CACHE_EVENTS.inc('not_modified')
+            response = Response(status=304)
+            stale = False
+        else:
+            encoding = choose_encoding(request.accept_encodings)
+            body_key = ('filter-data', output, source, encoding) + cache_key
+            cached = cache.get(dataset.version, body_key)
+            CACHE_EVENTS.inc('miss' if cached is None else 'hit')
+            stale = False
+            if cached is None:
+                def build_body():
+                    # A computation that finished since the lookup above has already stored the body
+                    done = cache.get(dataset.version, body_key)
+                    if done is not None:
+                        return done
+                    # Store the total number of rows in the dataset
+                    total_rows = len(dataset)
+                    if output == 'columnar':
+                        payload = {'total_rows': total_rows, **performance_columns(dataset, cache_key, source)}
+                    else:
+                        payload = performance_rows(dataset, cache_key, source=source)
+                        for row in payload:
+                            row['_total_rows'] = total_rows
+                    with metrics.stage('serialize'):
+                        body = compress(dumps(payload), encoding)
+                    cache.put(dataset.version, body_key, body)
+                    return body
+                
+                # Identical requests in flight share one computation; a slow one falls back to the last body
+                cached, stale = query_executor.run((dataset.version,) + body_key, build_body, stale_key=body_key)
+            
+            body, content_encoding = cached
+            response = Response(body, mimetype='application/json')
+            if content_encoding is not None:
+                response.headers['Content-Encoding'] = content_encoding
+        
+        response.vary.add('Accept-Encoding')
+        if stale:
+            # Computed from an older dataset version: must not be stored under the current tag
+            response.headers['X-Result-Stale'] = 'true'
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        response.set_etag(etag, weak=True)
+        # Browsers keep the body but check back every time; unchanged results cost a 304
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except QueryTimeout as e:
+        return busy_response(e)
+    except Exception as e:
+        log.exception("Error in filter_data route")
+        return jsonify({"error": str(e)})
+
+@app.route('/filter-data/batch', methods=['POST'])
+def filter_data_batch():
+    """Evaluate a JSON list of filter specs in one request
+    
+    Accepts {"queries": [spec, ...]} or a bare list. A spec has the filter_data() form fields
+    plus an optional "id"; results are keyed by that id, or by the spec's position.
+    """
     try:
-        # Get filter parameters
-        time_filter = request.form.get('time_filter', 'monthly')
-        month = request.form.get('month', '')
-        year = request.form.get('year', '')
-        state = request.form.get('state', 'All')
-        start_date = request.form.get('start_date', None)
-        end_date = request.form.get('end_date', None)
-        
-        # Check if this is essentially a "show all" request
-        is_show_all = (
-            (time_filter == 'monthly' and not month and not year) or
-            (time_filter == 'daily' and not start_date) or
-            (time_filter == 'weekly' and (not start_date or not end_date))
-        ) and state == 'All'
-        
-        print(f"Filter request received: time={time_filter}, month={month}, year={year}, state={state}, start_date={start_date}, end_date={end_date}")
-        print(f"Show all data: {is_show_all}")
-        
-        # Load data
-        df = load_data()
-        
-        if df.empty:
+        with metrics.stage('parse'):
+            payload = request.get_json(silent=True)
+            specs = payload.get('queries') if isinstance(payload, dict) else payload
+            if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+                return jsonify({"error": "Expected a JSON list of filter specs"}), 400
+            if len(specs) > app.config['BATCH_MAX_QUERIES']:
+                return jsonify({"error": f"At most {app.config['BATCH_MAX_QUERIES']} queries per batch"}), 400
+            ids = [str(spec.get('id', position)) for position, spec in enumerate(specs)]
+            if len(set(ids)) != len(ids):
+                return jsonify({"error": "Query ids must be unique"}), 400
+        
+        log.debug("Batch filter request received with %d queries", len(specs))
+        
+        with metrics.stage('load'):
+            dataset = performance_dataset()
+        
+        if dataset.empty:
             return jsonify({"error": "No data available"})
+        unknown = sorted({_source_param(spec) for spec in specs} - {None} - set(dataset.sources or ()))
+        if unknown:
+            return jsonify({"error": f"Unknown source: {unknown[0]}"}), 400
         
-        # Store the total number of rows in the dataset
-        total_rows = len(df)
-        print(f"Total rows in dataset: {total_rows}")
+        results = get_bdm_performance_batch(dataset, specs)
         
-        # Apply filters
-        performance_data = get_bdm_performance(df, time_filter, month, year, state, start_date, end_date)
+        with metrics.stage('serialize'):
+            return jsonify({'total_rows': len(dataset), 'results': dict(zip(ids, results))})
+    except Exception as e:
+        log.exception("Error in filter_data_batch route")
+        return jsonify({"error": str(e)})
+
+def get_timeseries(dataset, group_by='bdm', granularity='month', time_filter=None, month=None, year=None,
+                   state=None, start_date=None, end_date=None):
+    """Visits, unique merchants, keys sold and amount per BDM, state, city or source file for each day,
+    ISO week or month"""
+    start_day, end_day, state_filter = filter_key(time_filter, month, year, state, start_date, end_date)
+    cache_key = ('timeseries', group_by, granularity, start_day, end_day, state_filter)
+    cached = performance_cache.get(dataset.version, cache_key)
+    CACHE_EVENTS.inc('miss' if cached is None else 'hit')
+    if cached is not None:
+        return cached
+    
+    with metrics.stage('aggregate'):
+        if group_by in ('city', 'source'):
+            # City and source are not cube dimensions, so roll up the indexed raw rows instead
+            rows = dataset.rows(start_day, end_day, state_filter)
+            column = 'City' if group_by == 'city' else SOURCE_COLUMN
+            result = row_rollup(rows, column, granularity, start_day, end_day, dataset.cube.resolved_aliases,
+                                day_bounds(dataset.cube))
+        else:
+            result = cube_rollup(dataset.cube, group_by, granularity, start_day, end_day, state_filter)
+    result['group_by'] = group_by
+    performance_cache.put(dataset.version, cache_key, result)
+    return result
+
+@app.route('/timeseries', methods=['GET', 'POST'])
+def timeseries():
+    """Metric series for charts; takes the filter_data() fields plus group_by and granularity"""
+    try:
+        with metrics.stage('parse'):
+            params = request.values
+            group_by = params.get('group_by', 'bdm')
+            granularity = params.get('granularity', 'month')
+            if group_by not in GROUPINGS:
+                return jsonify({"error": f"group_by must be one of {', '.join(GROUPINGS)}"}), 400
+            if granularity not in GRANULARITIES:
+                return jsonify({"error": f"granularity must be one of {', '.join(GRANULARITIES)}"}), 400
+        
+        with metrics.stage('load'):
+            dataset = data_store.get()
+        
+        if dataset.empty:
+            return jsonify({"error": "No data available"})
+        if group_by == 'city' and 'City' not in dataset.frame:
+            return jsonify({"error": "The data has no City column"}), 400
+        if group_by == 'source' and SOURCE_COLUMN not in dataset.frame:
+            return jsonify({"error": "The data is not merged from several source files"}), 400
+        
+        filters = (params.get('time_filter', 'monthly'), params.get('month', ''), params.get('year', ''),
+                   params.get('state', 'All'), params.get('start_date'), params.get('end_date'))
+        query = ('timeseries', group_by, granularity) + filters
+        result, stale = query_executor.run((dataset.version,) + query,
+                                           lambda: get_timeseries(dataset, group_by, granularity, *filters),
+                                           stale_key=query)
+        if stale:
+            result = dict(result, stale=True)
+        
+        with metrics.stage('serialize'):
+            return jsonify(result)
+    except QueryTimeout as e:
+        return busy_response(e)
+    except Exception as e:
+        log.exception("Error in timeseries route")
+        return jsonify({"error": str(e)})
+
+def get_leaderboard(dataset, metric='keys_sold', k=10, order='both', filters=()):
+    """Top and bottom BDMs by one metric, with percentile ranks and rank change"""
+    cache_key = ('leaderboard', metric, k, order) + filter_key(*filters)
+    cached = performance_cache.get(dataset.version, cache_key)
+    CACHE_EVENTS.inc('miss' if cached is None else 'hit')
+    if cached is not None:
+        return cached
+    
+    start_day, end_day, state_filter = cache_key[-3:]
+    # A month is compared with the previous calendar month, other windows with the span before them
+    monthly = bool(filters) and filters[0] == 'monthly'
+    with metrics.stage('aggregate'):
+        result = rank_entries(dataset.cube, metric, k, order, start_day, end_day, state_filter, monthly=monthly)
+    performance_cache.put(dataset.version, cache_key, result)
+    return result
+
+@app.route('/leaderboard', methods=['GET', 'POST'])
+def leaderboard():
+    """Top/bottom k BDMs by metric; takes the filter_data() fields plus metric, k and order"""
+    try:
+        with metrics.stage('parse'):
+            params = request.values
+            metric = params.get('metric', 'keys_sold')
+            order = params.get('order', 'both')
+            if metric not in RANK_METRICS:
+                return jsonify({"error": f"metric must be one of {', '.join(RANK_METRICS)}"}), 400
+            if order not in ORDERS:
+                return jsonify({"error": f"order must be one of {', '.join(ORDERS)}"}), 400
+            try:
+                k = int(params.get('k', 10))
+            except ValueError:
+                return jsonify({"error": "k must be an integer"}), 400
+            if not 1 <= k <= app.config['LEADERBOARD_MAX_K']:
+                return jsonify({"error": f"k must be between 1 and {app.config['LEADERBOARD_MAX_K']}"}), 400
         
-        # Add total_rows to each row in performance_data
-        for row in performance_data:
-            row['_total_rows'] = total_rows
+        with metrics.stage('load'):
+            dataset = data_store.get()
         
-        return jsonify(performance_data)
+        if dataset.empty:
+            return jsonify({"error": "No data available"})
+        
+        filters = _filter_params(params)
+        query = ('leaderboard', metric, k, order) + filters
+        result, stale = query_executor.run((dataset.version,) + query,
+                                           lambda: get_leaderboard(dataset, metric, k, order, filters),
+                                           stale_key=query)
+        if stale:
+            result = dict(result, stale=True)
+        
+        with metrics.stage('serialize'):
+            return jsonify(result)
+    except QueryTimeout as e:
+        return busy_response(e)
     except Exception as e:
-        print(f"Error in filter_data route: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error in leaderboard route")
         return jsonify({"error": str(e)})
 
+BBOX_PARAMS = ['min_lat', 'min_lon', 'max_lat', 'max_lon']
+RADIUS_PARAMS = ['lat', 'lon', 'radius_km']
+VISIT_COLUMNS = ['Timestamp', 'BDM Name', 'Shop Name', 'City', 'State', 'Latitude', 'Longitude',
+                 'Keys Sold', 'Key Amount']
+
+def _float_params(params, names):
+    """Values of numeric request parameters, None if none are given; raises ValueError if only some are"""
+    given = [name for name in names if params.get(name) not in (None, '')]
+    if not given:
+        return None
+    if len(given) != len(names):
+        raise ValueError(f"{', '.join(names)} must be given together")
+    try:
+        values = [float(params[name]) for name in names]
+    except ValueError:
+        raise ValueError(f"{', '.join(names)} must be numbers")
+    if not all(np.isfinite(values)):
+        raise ValueError(f"{', '.join(names)} must be finite")
+    return values
+
+def _bbox_param(params):
+    bbox = _float_params(params, BBOX_PARAMS)
+    if bbox is not None and (bbox[0] > bbox[2] or bbox[1] > bbox[3]):
+        raise ValueError("min_lat/min_lon must not exceed max_lat/max_lon")
+    return bbox
+
+def _source_param(params):
+    """The source file a request is limited to, or None for all of them"""
+    source = params.get('source') or 'All'
+    return None if source == 'All' else source
+
+def _filter_params(params):
+    return (params.get('time_filter', 'monthly'), params.get('month', ''), params.get('year', ''),
+            params.get('state', 'All'), params.get('start_date'), params.get('end_date'))
+
+def _geo_dataset():
+    """The current dataset, or an error response if it has no coordinates to query"""
+    with metrics.stage('load'):
+        dataset = data_store.get()
+    if dataset.empty:
+        return None, jsonify({"error": "No data available"})
+    if dataset.geo is None:
+        return None, (jsonify({"error": "The data has no Latitude/Longitude columns"}), 400)
+    return dataset, None
+
+def get_geo_visits(dataset, bbox=None, radius=None, limit=1000, filters=()):
+    """Visits inside a bounding box or within radius_km of a point, with totals over all of them"""
+    start_day, end_day, state_filter = filter_key(*filters)
+    with metrics.stage('aggregate'):
+        if radius is not None:
+            positions, distances = dataset.geo.radius_rows(*radius, start_day, end_day, state_filter)
+        else:
+            positions, distances = dataset.geo.bbox_rows(*bbox, start_day, end_day, state_filter), None
+        rows = dataset.frame.iloc[positions]
+        result = {
+            'count': len(rows),
+            'unique_merchants': int(shop_keys(rows, dataset.cube.resolved_aliases).nunique()),
+            'keys_sold': int(rows['Keys Sold'].sum()),
+            'key_amount': round(float(rows['Key Amount'].sum()), 2),
+        }
+    
+    with metrics.stage('format'):
+        listed = rows[[column for column in VISIT_COLUMNS if column in rows]].iloc[:limit]
+        listed = listed.assign(Timestamp=listed['Timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S'))
+        if distances is not None:
+            listed = listed.assign(**{'Distance km': distances[:limit].round(3)})
+        # Categorical and NaN cells become plain JSON values
+        listed = listed.astype(object).where(listed.notna(), None)
+        result['visits'] = listed.to_dict('records')
+        result['truncated'] = len(rows) > limit
+    return result
+
+def get_geo_heatmap(dataset, level, bbox, filters=()):
+    """Pre-binned visit density and key sales of one grid level inside a bounding box"""
+    start_day, end_day, state_filter = filter_key(*filters)
+    with metrics.stage('aggregate'):
+        return dataset.geo.heatmap(level, *bbox, start_day, end_day, state_filter)
+
+@app.route('/geo/visits', methods=['GET', 'POST'])
+def geo_visits():
+    """Visit rows in a box (min_lat, min_lon, max_lat, max_lon) or circle (lat, lon, radius_km)"""
+    try:
+        with metrics.stage('parse'):
+            params = request.values
+            try:
+                bbox, radius = _bbox_param(params), _float_params(params, RADIUS_PARAMS)
+                limit = int(params.get('limit', app.config['GEO_MAX_VISITS']))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            if (bbox is None) == (radius is None):
+                return jsonify({"error": "Give either a bounding box or lat, lon and radius_km"}), 400
+            if radius is not None and radius[2] < 0:
+                return jsonify({"error": "radius_km must not be negative"}), 400
+            limit = min(max(limit, 0), app.config['GEO_MAX_VISITS'])
+        
+        dataset, error = _geo_dataset()
+        if error is not None:
+            return error
+        result = get_geo_visits(dataset, bbox, radius, limit, _filter_params(params))
+        
+        with metrics.stage('serialize'):
+            return jsonify(result)
+    except Exception as e:
+        log.exception("Error in geo visits route")
+        return jsonify({"error": str(e)})
+
+@app.route('/geo/heatmap', methods=['GET', 'POST'])
+def geo_heatmap():
+    """Heatmap bins in a bounding box; the grid level follows the box size unless level is given"""
+    try:
+        with metrics.stage('parse'):
+            params = request.values
+            try:
+                bbox = _bbox_param(params)
+                level = params.get('level')
+                level = int(level) if level not in (None, '') else None
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            if bbox is None:
+                return jsonify({"error": f"{', '.join(BBOX_PARAMS)} are required"}), 400
+            if level is None:
+                level = level_for_span(max(bbox[2] - bbox[0], bbox[3] - bbox[1]))
+            elif not 0 <= level < len(LEVELS):
+                return jsonify({"error": f"level must be between 0 and {len(LEVELS) - 1}"}), 400
+        
+        dataset, error = _geo_dataset()
+        if error is not None:
+            return error
+        result = get_geo_heatmap(dataset, level, bbox, _filter_params(params))
+        
+        with metrics.stage('serialize'):
+            return jsonify(result)
+    except Exception as e:
+        log.exception("Error in geo heatmap route")
+        return jsonify({"error": str(e)})
+
+@app.route('/geo/tiles/<int:z>/<int:x>/<int:y>')
+def geo_tile(z, x, y):
+    """Heatmap bins for one web-mercator map tile, so panning maps straight onto cached tiles"""
+    try:
+        if z > 22 or x >= 2 ** z or y >= 2 ** z:
+            return jsonify({"error": "No such tile"}), 404
+        dataset, error = _geo_dataset()
+        if error is not None:
+            return error
+        
+        filters = _filter_params(request.values)
+        cache_key = ('geo_tile', z, x, y, filter_key(*filters))
+        cached = performance_cache.get(dataset.version, cache_key)
+        CACHE_EVENTS.inc('miss' if cached is None else 'hit')
+        if cached is None:
+            bbox = tile_bbox(z, x, y)
+            cached = get_geo_heatmap(dataset, level_for_span(bbox[3] - bbox[1]), bbox, filters)
+            cached['tile'] = [z, x, y]
+            performance_cache.put(dataset.version, cache_key, cached)
+        
+        with metrics.stage('serialize'):
+            return jsonify(cached)
+    except Exception as e:
+        log.exception("Error in geo tile route")
+        return jsonify({"error": str(e)})
+
+@app.route('/export', methods=['GET', 'POST'])
+def export_visits():
+    """Stream the raw visit rows behind the filter_data() filters, optionally for one bdm, as CSV or XLSX
+    
+    Rows are located with the date and state index and written EXPORT_CHUNK_ROWS at a time, so
+    the download starts at once and memory does not grow with its size.
+    """
+    try:
+        with metrics.stage('parse'):
+            params = request.values
+            output = params.get('format', 'csv')
+            if output not in EXPORT_FORMATS:
+                return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+            bdm = params.get('bdm') or None
+        
+        with metrics.stage('load'):
+            dataset = data_store.get()
+        start_day, end_day, state_filter = filter_key(*_filter_params(params))
+        with metrics.stage('aggregate'):
+            positions = dataset.index.rows(start_day, end_day, state_filter)
+        
+        # The generator holds on to this dataset, so a reload mid-download does not change the rows
+        chunks = export_chunks(dataset.frame, positions, bdm, app.config['EXPORT_CHUNK_ROWS'])
+        columns = export_columns(dataset.frame)
+        if output == 'xlsx':
+            response = Response(xlsx_stream(chunks, columns),
+                                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        else:
+            response = Response(csv_stream(chunks, columns), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename="bdm_visits.{output}"'
+        # Ask proxies to pass chunks on as they come instead of buffering the whole file
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    except Exception as e:
+        log.exception("Error in export route")
+        return jsonify({"error": str(e)})
+
+@app.route('/data-quality')
+def data_quality():
+    """Rows each cleaning rule affected, and its time, for the load behind the dataset being served"""
+    dataset = data_store.get()
+    report = dataset.frame.attrs.get('quality')
+    if report is not None:
+        report = {**report, 'rules': [{'rule': name, 'rows': entry['rows'], 'seconds': round(entry['seconds'], 6)}
+                                      for name, entry in report['rules'].items()]}
+    return jsonify({'version': dataset.version, 'rows': len(dataset), 'loaded_at': dataset.loaded_at,
+                    'dummy': bool(dataset.frame.attrs.get('dummy')), 'report': report})
+
+@app.route('/cache-stats')
+def cache_stats():
+    """Report hit/miss/eviction counters of the performance result cache, and of the store's under 'store'"""
+    return jsonify({**performance_cache.stats(), 'store': store_cache.stats()})
+
+def collect_runtime_metrics():
+    """Values owned by the cache and the dataset store, read when /metrics is scraped"""
+    caches = {'performance': performance_cache.stats(), 'store': store_cache.stats()}
+    dataset = data_store.peek()
+    families = [
+        ('bdm_query_cache_entries', 'gauge', 'Entries currently held by each result cache',
+         [({'cache': cache}, stats['size']) for cache, stats in caches.items()]),
+        ('bdm_query_cache_removals_total', 'counter', 'Cache entries dropped, by cache and reason',
+         [({'cache': cache, 'reason': reason}, stats[key]) for cache, stats in caches.items()
+          for reason, key in (('eviction', 'evictions'), ('expiration', 'expirations'),
+                              ('invalidation', 'invalidations'))]),
+    ]
+    if dataset is not None:
+        families.append(('bdm_dataset_rows', 'gauge', 'Rows in the dataset being served', [({}, len(dataset))]))
+        families.append(('bdm_dataset_version', 'gauge', 'Version of the dataset being served',
+                         [({}, dataset.version)]))
+    return families
+
+metrics.REGISTRY.add_collector(collect_runtime_metrics)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request, stage, load and cache metrics in the Prometheus text format"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Opt-in per request (?profile=1) and only when PROFILE_REQUESTS is enabled
+    if app.config['PROFILE_REQUESTS'] and request.args.get('profile'):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        save_profile(profiler)
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.endpoint or 'unknown',
+                                request.method, str(response.status_code))
+    return response
+
+def save_profile(profiler):
+    """Dump a request's cProfile stats to PROFILE_DIR and log the top functions by cumulative time"""
+    try:
+        profile_dir = app.config['PROFILE_DIR']
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, f"{request.endpoint or 'unknown'}-{time.time_ns()}.prof")
+        profiler.dump_stats(path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(25)
+        log.info("Profile of %s %s saved to %s\n%s", request.method, request.path, path, report.getvalue())
+    except Exception:
+        log.exception("Error saving request profile")
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
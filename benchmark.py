@@ -0,0 +1,288 @@
+"""Benchmarks for the load and filter hot paths on synthetic BDM data
+
+Usage:
+    python benchmark.py                              # 10k, 100k, 1M and 10M rows
+    python benchmark.py --sizes 10000 100000         # a subset of sizes
+    python benchmark.py --save-baseline bench.json   # record results
+    python benchmark.py --baseline bench.json        # exit 1 if anything regressed
+
+Generated CSVs are cached in --data-dir so repeated runs skip the (slow) generation step.
+"""
+import os
+import io
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tracemalloc
+import contextlib
+import numpy as np
+import pandas as pd
+
+import app
+from dataset import Dataset
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# Same header as data/bdm_data.csv
+COLUMNS = ['Timestamp', 'Shop Name', 'RocketPay Registered Number', 'City', 'State', 'BDM Name',
+           'Visit Status', 'Latitude', 'Longitude', 'Keys Sold', 'Key Amount', 'Current Key Balance',
+           'Wallet Transaction ID']
+
+STATES = ['UTTAR PRADESH', 'MADHYA PRADESH', 'BIHAR', 'GUJARAT', 'RAJASTHAN', 'MAHARASHTRA', 'HARYANA',
+          'JHARKHAND', 'UTTARAKHAND', 'DELHI', 'KARNATAKA', 'PUNJAB', 'TELANGANA', 'WEST BENGAL', 'ASSAM']
+# Roughly the skew of the real sheet: a few states carry most visits
+STATE_WEIGHTS = np.array([33, 17, 10, 10, 9, 7, 4, 3, 2, 1, 1, 1, 1, 0.5, 0.5])
+# The real sheet's statuses and their counts in data/bdm_data.csv (14,256 visits)
+VISIT_STATUSES = ['Revisit', 'Not Interested', 'Key Purchased', 'Service Call', 'App Install']
+VISIT_STATUS_WEIGHTS = np.array([9078, 1994, 1298, 1016, 869])
+# Keys sold on a Key Purchased visit: mostly 10 or 25, and a few purchases record none
+PURCHASE_KEYS = [0, 1, 2, 5, 10, 25, 50]
+PURCHASE_KEY_WEIGHTS = np.array([4, 2, 2, 4, 49, 29, 10])
+# Bump when the generated rows change, so cached CSVs from an older generator are not reused
+SYNTHETIC_VERSION = 2
+
+
+def generate_synthetic_data(rows, seed=42):
+    """Synthetic visits with the bdm_data.csv columns and realistic cardinalities
+
+    Extends the create_dummy_data() idea: BDMs grow slowly with size (122 in the real sheet),
+    shops grow with visits, every BDM works in one home state, and timestamps span a year.
+    """
+    rng = np.random.default_rng(seed)
+    n_bdms = int(min(max(rows // 120, 20), 2000))
+    n_shops = int(max(rows // 6, 50))
+    n_cities = 250
+
+    bdm_state = rng.choice(len(STATES), n_bdms, p=STATE_WEIGHTS / STATE_WEIGHTS.sum())
+    bdm = rng.integers(0, n_bdms, rows)
+    shop = (bdm * (n_shops // n_bdms) + rng.integers(0, max(n_shops // n_bdms, 1), rows)) % n_shops
+    city = (bdm_state[bdm] * 16 + rng.integers(0, 16, rows)) % n_cities
+
+    start = np.datetime64('2025-01-01T00:00:00', 's')
+    seconds = np.sort(rng.integers(0, 365 * 86400, rows))
+    timestamps = pd.Series(start + seconds.astype('timedelta64[s]')).dt.strftime('%d/%m/%Y %H:%M:%S')
+
+    status = rng.choice(len(VISIT_STATUSES), rows, p=VISIT_STATUS_WEIGHTS / VISIT_STATUS_WEIGHTS.sum())
+    purchased = status == VISIT_STATUSES.index('Key Purchased')
+    keys = np.where(purchased, rng.choice(PURCHASE_KEYS, rows, p=PURCHASE_KEY_WEIGHTS / PURCHASE_KEY_WEIGHTS.sum()), 0)
+    sold = keys > 0
+    df = pd.DataFrame({
+        'Timestamp': timestamps,
+        'Shop Name': pd.Series(shop).map('Shop {}'.format),
+        'RocketPay Registered Number': 7_000_000_000 + shop,
+        'City': pd.Series(city).map('CITY {}'.format),
+        'State': np.asarray(STATES, dtype=object)[bdm_state[bdm]],
+        'BDM Name': pd.Series(bdm).map('BDM {}'.format),
+        'Visit Status': np.asarray(VISIT_STATUSES, dtype=object)[status],
+        'Latitude': np.round(20 + rng.random(rows) * 10, 7),
+        'Longitude': np.round(72 + rng.random(rows) * 12, 7),
+        'Keys Sold': np.where(sold, keys, np.nan),
+        'Key Amount': np.where(sold, keys * 200.0, np.nan),
+        'Current Key Balance': rng.integers(0, 20, rows),
+        'Wallet Transaction ID': np.where(sold, pd.Series(np.arange(rows)).map('TXN{:010d}'.format), ''),
+    }, columns=COLUMNS)
+    # A sprinkling of blank timestamps and names, like the real export
+    df.loc[rng.random(rows) < 0.001, 'Timestamp'] = ''
+    df.loc[rng.random(rows) < 0.001, 'BDM Name'] = ''
+    return df
+
+
+def synthetic_csv(rows, data_dir, seed=42):
+    """Path of a cached synthetic CSV with the given row count, generating it on first use"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f'bdm_synthetic_{rows}_{seed}_v{SYNTHETIC_VERSION}.csv')
+    if not os.path.exists(path):
+        print(f"Generating {rows:,} synthetic rows -> {path}")
+        tmp_path = path + '.tmp'
+        generate_synthetic_data(rows, seed).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    return path
+
+
+def filter_combinations(dataset):
+    """One request per time_filter/state combination the dashboard can produce"""
+    last = dataset.frame['Timestamp'].max()
+    week_start = (last - pd.Timedelta(days=last.weekday())).strftime('%m/%d/%Y')
+    week_end = (last - pd.Timedelta(days=last.weekday()) + pd.Timedelta(days=6)).strftime('%m/%d/%Y')
+    busiest_state = dataset.frame['State'].value_counts().index[0]
+    time_filters = {
+        'monthly-all': dict(time_filter='monthly', month='', year=''),
+        'monthly': dict(time_filter='monthly', month=last.strftime('%B'), year=str(last.year)),
+        'weekly': dict(time_filter='weekly', start_date=week_start, end_date=week_end),
+        'daily': dict(time_filter='daily', start_date=last.strftime('%m/%d/%Y')),
+    }
+    combos = {}
+    for name, params in time_filters.items():
+        for state_name, state in [('all', 'All'), ('state', busiest_state)]:
+            combos[f'{name}/{state_name}'] = dict(params, state=state)
+    return combos
+
+
+def summarize(samples):
+    """Latency percentiles (ms) and throughput (ops/s) for a list of durations in seconds"""
+    ms = np.asarray(samples) * 1000
+    return {
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean()),
+        'throughput_per_s': float(len(ms) / (ms.sum() / 1000)) if ms.sum() else float('inf'),
+    }
+
+
+def time_calls(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the app's load/filter logging so it does not skew or clutter the timings"""
+    logging.disable(logging.WARNING)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def peak_memory_mb(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_size(rows, data_dir, repeat):
+    path = synthetic_csv(rows, data_dir)
+    app.app.config['DATA_FILE'] = path
+    load_repeat = max(1, min(repeat, 3 if rows <= 1_000_000 else 1))
+    results = {}
+
+    def load_from_csv():
+        app.app.config['DATA_SNAPSHOT'] = False
+        frame, cube = app.load_data_with_cube()
+        return Dataset(frame, version=1, cube=cube)
+
+    def load_from_snapshot():
+        app.app.config['DATA_SNAPSHOT'] = True
+        frame, cube, index, geo = app.load_dataset_parts()
+        return Dataset(frame, version=1, cube=cube, index=index, geo=geo)
+
+    with quiet():
+        results['load_data/csv'] = summarize(time_calls(load_from_csv, load_repeat))
+        results['load_data/csv']['peak_memory_mb'] = peak_memory_mb(load_from_csv)
+        load_from_snapshot()  # writes the snapshot used by the timed runs
+        results['load_data/snapshot'] = summarize(time_calls(load_from_snapshot, load_repeat))
+        results['load_data/snapshot']['peak_memory_mb'] = peak_memory_mb(load_from_snapshot)
+        dataset = load_from_snapshot()
+
+    # Serve the benchmark dataset through the app's own store and routes
+    app.data_store.pin(dataset)
+    client = app.app.test_client()
+
+    for name, params in filter_combinations(dataset).items():
+        def compute():
+            app.performance_cache.clear()
+            app.get_bdm_performance(dataset, **params)
+
+        def route():
+            app.performance_cache.clear()
+            response = client.post('/filter-data', data=params)
+            assert response.status_code == 200
+
+        def cached_route():
+            response = client.post('/filter-data', data=params)
+            assert response.status_code == 200
+
+        with quiet():
+            results[f'get_bdm_performance/{name}'] = summarize(time_calls(compute, repeat))
+            results[f'filter-data/{name}'] = summarize(time_calls(route, repeat))
+            cached_route()
+            results[f'filter-data-cached/{name}'] = summarize(time_calls(cached_route, repeat))
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """List of human-readable regressions versus a saved baseline"""
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, stats in benchmarks.items():
+            before = baseline.get('results', {}).get(size, {}).get(name)
+            if not before:
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'peak_memory_mb'):
+                if metric not in stats or metric not in before:
+                    continue
+                # Ignore sub-millisecond jitter on very fast paths
+                floor = 0.5 if metric.endswith('_ms') else 1.0
+                limit = before[metric] * (1 + tolerance) + floor
+                if stats[metric] > limit:
+                    regressions.append(f"{size} rows {name} {metric}: {before[metric]:.2f} -> {stats[metric]:.2f}")
+    return regressions
+
+
+def print_results(results):
+    for size, benchmarks in results.items():
+        print(f"\n=== {int(size):,} rows ===")
+        print(f"{'benchmark':45} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'ops/s':>10} {'peak MB':>10}")
+        for name, stats in benchmarks.items():
+            peak = stats.get('peak_memory_mb')
+            print(f"{name:45} {stats['p50_ms']:10.2f} {stats['p95_ms']:10.2f} {stats['p99_ms']:10.2f} "
+                  f"{stats['throughput_per_s']:10.1f} {'' if peak is None else f'{peak:10.1f}':>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=30, help='timed iterations per filter benchmark')
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_data'))
+    parser.add_argument('--baseline', help='compare against this saved baseline and fail on regressions')
+    parser.add_argument('--save-baseline', help='write the results to this file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown fraction (default 0.25)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for rows in args.sizes:
+        print(f"Benchmarking {rows:,} rows...")
+        results[str(rows)] = benchmark_size(rows, args.data_dir, args.repeat)
+    print_results(results)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nPERFORMANCE REGRESSIONS (tolerance {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,8 +4,66 @@ class Config:
     # Flask configuration
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
     
-    # Data file path
-    DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'bdm_data.csv')
+    # Data file path; a directory or glob pattern of CSV files merges all of them, tagging each row
+    # with the file it came from
+    DATA_FILE = os.environ.get('DATA_FILE') or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            'data', 'bdm_data.csv')
+    
+    # Minimum seconds between checks of the data file for changes (hot reload)
+    DATA_RELOAD_INTERVAL = float(os.environ.get('DATA_RELOAD_INTERVAL', 2.0))
+    
+    # Rows per chunk when streaming the CSV; bounds peak parsing memory
+    DATA_CHUNK_ROWS = int(os.environ.get('DATA_CHUNK_ROWS', 100000))
+    
+    # Parse only rows appended to DATA_FILE on reload, unless earlier bytes changed
+    DATA_INCREMENTAL = os.environ.get('DATA_INCREMENTAL', '1') != '0'
+    
+    # Cache the parsed data as a memory-mapped columnar snapshot next to DATA_FILE
+    DATA_SNAPSHOT = os.environ.get('DATA_SNAPSHOT', '1') != '0'
+    
+    # Processes parsing changed files of a multi-file DATA_FILE in parallel (0 uses one per CPU)
+    DATA_LOAD_PROCESSES = int(os.environ.get('DATA_LOAD_PROCESSES', 0))
+    
+    # Several worker processes serve the same data: republish appended rows as a shared snapshot
+    # generation instead of letting every worker keep its own appended copy (set by gunicorn.conf.py)
+    DATA_SHARED = os.environ.get('DATA_SHARED', '0') != '0'
+    
+    # Optional SQLite file every load is upserted into, keeping visit history across restarts and
+    # file rewrites (empty disables it)
+    ANALYTICS_STORE = os.environ.get('ANALYTICS_STORE', '')
+    
+    # Answer the dashboard and /filter-data (and /filter-data/batch) with SQL on ANALYTICS_STORE.
+    # Only those push down: /timeseries, /leaderboard, /geo, /export and /data-quality still load
+    # the rows into memory the first time they are called
+    ANALYTICS_PUSHDOWN = os.environ.get('ANALYTICS_PUSHDOWN', '0') != '0'
+    
+    # Performance result cache: maximum entries and seconds before an entry expires
+    QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 256))
+    QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', 300))
+    
+    # Largest number of filter specs accepted by one /filter-data/batch request
+    BATCH_MAX_QUERIES = int(os.environ.get('BATCH_MAX_QUERIES', 200))
+    
+    # Threads running aggregations for request threads (0 runs them inline), and seconds a request
+    # waits before falling back to the last known result or a 503
+    QUERY_WORKERS = int(os.environ.get('QUERY_WORKERS', 4))
+    QUERY_TIMEOUT = float(os.environ.get('QUERY_TIMEOUT', 10))
+    
+    # Largest k accepted by /leaderboard
+    LEADERBOARD_MAX_K = int(os.environ.get('LEADERBOARD_MAX_K', 100))
+    
+    # Most visit rows a /geo/visits response lists (totals always cover every match)
+    GEO_MAX_VISITS = int(os.environ.get('GEO_MAX_VISITS', 1000))
+    
+    # Rows written per block of a /export download
+    EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 5000))
+    
+    # Logging level name; per-request detail is logged at DEBUG
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    
+    # Allow ?profile=1 on any request to dump a cProfile report into PROFILE_DIR
+    PROFILE_REQUESTS = os.environ.get('PROFILE_REQUESTS', '0') != '0'
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
     
     # Date format
     DATE_FORMAT = '%d-%m-%Y %H:%M'
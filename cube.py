@@ -0,0 +1,474 @@
+import numpy as np
+import pandas as pd
+
+from indexes import GroupedRangeIndex, dictionary_codes, extend_vocabulary
+from distinct import alias_codes, count_exact, raw_codes, resolve_aliases, shop_parts
+
+
+def to_day_number(value):
+    """Convert a date/datetime to whole days since the Unix epoch"""
+    return int(np.datetime64(pd.Timestamp(value).date(), 'D').astype(np.int64))
+
+
+class DailyCube:
+    """Pre-aggregated (Date, State, BDM Name) cells built once per dataset load
+
+    Additive metrics (visits, keys sold, key amount) are summed per cell. Unique merchants
+    cannot be summed, so every cell also keeps its exact set of shop codes as (cell, shop)
+    pairs; a query unions those sets over the cells in range (see distinct.count_exact).
+    Shops are normalized shop keys, not raw names. Cubes over disjoint row sets can be merged, which is how appended rows are folded in without a rebuild.
+    Cells also count their visits per Visit Status, one column per status in the vocabulary.
+    Pairs keep each row's own shop key (pair_raw_shop) next to the one queries count
+    (pair_shop), where a name is resolved to the number its BDM recorded for it, if only one
+    (see distinct.shop_keys). The (BDM, name, number) aliases behind that are kept, so a merge
+    resolves again over all of them and the result does not depend on how rows were split.
+    """
+
+    # Per-cell and per-pair arrays; together with the vocabularies they fully describe a cube
+    ARRAYS = ['cell_day', 'cell_state', 'cell_bdm', 'cell_visits', 'cell_keys', 'cell_amount', 'cell_status',
+              'pair_day', 'pair_state', 'pair_bdm', 'pair_shop', 'pair_raw_shop', 'alias_bdm', 'alias_name',
+              'alias_phone']
+
+    def __init__(self, bdm_names, states, shops, statuses, cell_day, cell_state, cell_bdm,
+                 cell_visits, cell_keys, cell_amount, cell_status, pair_day, pair_state, pair_bdm, pair_shop,
+                 pair_raw_shop, alias_bdm, alias_name, alias_phone, cell_index=None, pair_index=None):
+        self.bdm_names = bdm_names
+        self.states = states
+        self.shops = shops
+        self.statuses = statuses
+        self.shop_count = max(len(shops), 1)
+        # Cells and pairs are both sorted by day so a date window is a contiguous slice
+        self.cell_day = cell_day
+        self.cell_state = cell_state
+        self.cell_bdm = cell_bdm
+        self.cell_visits = cell_visits
+        self.cell_keys = cell_keys
+        self.cell_amount = cell_amount
+        # (cells, statuses) visit counts
+        self.cell_status = cell_status
+        self.pair_day = pair_day
+        self.pair_state = pair_state
+        self.pair_bdm = pair_bdm
+        self.pair_shop = pair_shop
+        self.pair_raw_shop = pair_raw_shop
+        # Distinct (bdm, name shop code, number shop code) triples, sorted
+        self.alias_bdm = alias_bdm
+        self.alias_name = alias_name
+        self.alias_phone = alias_phone
+        self._resolved_aliases = None
+        self._state_codes = {state: code for code, state in enumerate(states)}
+        # Day-sorted with a per-state secondary order, so a state filter is a gather, not a scan
+        if cell_index is None:
+            cell_index = GroupedRangeIndex(cell_day, cell_state, len(states))
+        if pair_index is None:
+            pair_index = GroupedRangeIndex(pair_day, pair_state, len(states))
+        self.cell_index = cell_index
+        self.pair_index = pair_index
+
+    def to_arrays(self):
+        """(arrays, JSON vocabularies) that from_arrays turns back into the same cube"""
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        for prefix, index in (('cell_index', self.cell_index), ('pair_index', self.pair_index)):
+            arrays.update({f'{prefix}.{name}': array for name, array in index.to_arrays().items()})
+        vocabularies = {'bdm_names': self.bdm_names.tolist(), 'states': self.states.tolist(),
+                        'shops': self.shops.tolist(), 'statuses': self.statuses.tolist()}
+        return arrays, vocabularies
+
+    @classmethod
+    def from_arrays(cls, arrays, vocabularies):
+        """Rebuild a cube without re-aggregating, e.g. over memory-mapped arrays from a snapshot"""
+        def index(prefix, values):
+            parts = {name.split('.', 1)[1]: array for name, array in arrays.items() if name.startswith(prefix + '.')}
+            return GroupedRangeIndex.from_arrays(values, **parts)
+
+        return cls(
+            **{name: np.asarray(values, dtype=object) for name, values in vocabularies.items()},
+            **{name: arrays[name] for name in cls.ARRAYS},
+            cell_index=index('cell_index', arrays['cell_day']),
+            pair_index=index('pair_index', arrays['pair_day']),
+        )
+
+    @classmethod
+    def build(cls, df):
+        """Aggregate a cleaned BDM frame into daily cells"""
+        timestamps = df['Timestamp'].to_numpy(dtype='datetime64[ns]')
+        valid = ~np.isnat(timestamps)
+        if not valid.all():
+            df = df[valid]
+        day = timestamps[valid].astype('datetime64[D]').astype(np.int64)
+
+        bdm_codes, bdm_names = dictionary_codes(df['BDM Name'])
+        state_codes, states = dictionary_codes(df['State'])
+        # Shop names and numbers are normalized once, over their vocabularies
+        parts = shop_parts(df)
+        owner, name, phone = alias_codes(bdm_codes, parts)
+        name_codes, names, phone_codes, phones = parts
+        # Vocabulary of the raw keys rows use, plus the name and number keys of the aliases
+        numbered = phone_codes >= 0
+        shops = np.unique(np.concatenate([names[name_codes[~numbered]], phones[phone_codes[numbered]],
+                                          names[name], phones[phone]]))
+        name_shop, phone_shop = np.searchsorted(shops, names), np.searchsorted(shops, phones)
+        shop_codes = raw_codes(parts, name_shop, phone_shop)
+        keys = df['Keys Sold'].to_numpy()
+        amount = df['Key Amount'].to_numpy(dtype=np.float64)
+        if 'Visit Status' in df:
+            status_codes, statuses = dictionary_codes(df['Visit Status'])
+        else:
+            status_codes, statuses = np.full(len(day), -1), np.empty(0, dtype=object)
+        # Rows without a status still count as visits, just under no status
+        rows = np.flatnonzero(status_codes >= 0)
+
+        # Every row is a one-visit cell and a (cell, shop) pair; _assemble folds the duplicates
+        return cls._assemble(
+            bdm_names, states, shops, statuses,
+            cells=(day, state_codes, bdm_codes, np.ones(len(day), dtype=np.int64), keys, amount),
+            status=(rows, status_codes[rows], np.ones(len(rows), dtype=np.int64)),
+            pairs=(day, state_codes, bdm_codes, shop_codes),
+            aliases=(owner, name_shop[name], phone_shop[phone]),
+        )
+
+    @classmethod
+    def merge(cls, *cubes):
+        """Combine cubes over disjoint rows (loaded data plus an appended delta, or streamed chunks)"""
+        bdm_names = np.unique(np.concatenate([cube.bdm_names for cube in cubes])).astype(object)
+        states = np.unique(np.concatenate([cube.states for cube in cubes])).astype(object)
+        shops = np.unique(np.concatenate([cube.shops for cube in cubes])).astype(object)
+        statuses = np.unique(np.concatenate([cube.statuses for cube in cubes])).astype(object)
+
+        cell_parts, status_parts, pair_parts, alias_parts = [], [], [], []
+        offset = 0
+        for cube in cubes:
+            # Translate each cube's codes into the merged vocabularies
+            bdm_map = np.searchsorted(bdm_names, cube.bdm_names)
+            state_map = np.searchsorted(states, cube.states)
+            shop_map = np.searchsorted(shops, cube.shops)
+            status_map = np.searchsorted(statuses, cube.statuses)
+            cell_parts.append((cube.cell_day, state_map[cube.cell_state], bdm_map[cube.cell_bdm],
+                               cube.cell_visits, cube.cell_keys, cube.cell_amount))
+            cell, status = np.nonzero(cube.cell_status)
+            status_parts.append((cell + offset, status_map[status], cube.cell_status[cell, status]))
+            pair_parts.append((cube.pair_day, state_map[cube.pair_state], bdm_map[cube.pair_bdm],
+                               shop_map[cube.pair_raw_shop]))
+            alias_parts.append((bdm_map[cube.alias_bdm], shop_map[cube.alias_name], shop_map[cube.alias_phone]))
+            offset += len(cube)
+
+        return cls._assemble(
+            bdm_names, states, shops, statuses,
+            cells=tuple(np.concatenate(arrays) for arrays in zip(*cell_parts)),
+            status=tuple(np.concatenate(arrays) for arrays in zip(*status_parts)),
+            pairs=tuple(np.concatenate(arrays) for arrays in zip(*pair_parts)),
+            aliases=tuple(np.concatenate(arrays) for arrays in zip(*alias_parts)),
+        )
+
+    def extend(self, other):
+        """merge(self, other) that only touches the cells, pairs and aliases other adds to
+
+        Meant for folding a small appended delta into a large cube: other's entries are looked up
+        in (and inserted into) the existing sorted arrays, and the range indexes are extended
+        rather than rebuilt. Only pairs whose name now resolves differently get resolved again.
+        """
+        bdm_names, bdm_map = extend_vocabulary(self.bdm_names, other.bdm_names)
+        states, state_map = extend_vocabulary(self.states, other.states)
+        shops, shop_map = extend_vocabulary(self.shops, other.shops)
+        statuses, status_map = extend_vocabulary(self.statuses, other.statuses)
+        # other's codes in the extended vocabularies
+        other_bdm, other_state = np.searchsorted(bdm_names, other.bdm_names), np.searchsorted(states, other.states)
+        other_shop, other_status = np.searchsorted(shops, other.shops), np.searchsorted(statuses, other.statuses)
+
+        n_states = max(len(states), 1)
+        n_bdms = max(len(bdm_names), 1)
+        n_shops = max(len(shops), 1)
+        # Both are day-sorted, so the first and last cells bound the days
+        days = np.concatenate([self.cell_day[:1], self.cell_day[-1:], other.cell_day[:1], other.cell_day[-1:]])
+        day0 = int(days.min()) if len(days) else 0
+
+        def cell_key(day, state, bdm):
+            return ((day - day0) * n_states + state) * n_bdms + bdm
+
+        cell_state, cell_bdm = _remap(self.cell_state, state_map), _remap(self.cell_bdm, bdm_map)
+        at, found = _lookup(cell_key(self.cell_day, cell_state, cell_bdm),
+                            cell_key(other.cell_day, other_state[other.cell_state], other_bdm[other.cell_bdm]))
+        status = np.zeros((len(other), len(statuses)), dtype=np.int64)
+        status[:, other_status] = other.cell_status
+        cell_status = np.zeros((len(self), len(statuses)), dtype=np.int64)
+        cell_status[:, _remap(np.arange(len(self.statuses)), status_map)] = self.cell_status
+        cells = {'visits': self.cell_visits.copy(), 'keys': self.cell_keys.copy(),
+                 'amount': self.cell_amount.astype(np.float64), 'status': cell_status}
+        added = {'visits': other.cell_visits, 'keys': other.cell_keys, 'amount': other.cell_amount,
+                 'status': status}
+        # Cells other shares with this cube are summed in place; the rest are inserted in key order
+        for name, values in cells.items():
+            values[at[found]] += added[name][found]
+        new, at = ~found, at[~found]
+        cells = {name: np.insert(values, at, added[name][new], axis=0) for name, values in cells.items()}
+        cell_day = np.insert(self.cell_day, at, other.cell_day[new])
+        cell_state = np.insert(cell_state, at, other_state[other.cell_state[new]])
+        cell_bdm = np.insert(cell_bdm, at, other_bdm[other.cell_bdm[new]])
+        cell_moved, cell_inserted = _moved(len(self), at)
+
+        pair_state, pair_bdm = _remap(self.pair_state, state_map), _remap(self.pair_bdm, bdm_map)
+        pair_raw_shop = _remap(self.pair_raw_shop, shop_map)
+        other_pair = (other.pair_day, other_state[other.pair_state], other_bdm[other.pair_bdm],
+                      other_shop[other.pair_raw_shop])
+        at, found = _lookup(cell_key(self.pair_day, pair_state, pair_bdm) * n_shops + pair_raw_shop,
+                            cell_key(*other_pair[:3]) * n_shops + other_pair[3])
+        new, at = ~found, at[~found]
+        pair_day = np.insert(self.pair_day, at, other_pair[0][new])
+        pair_state = np.insert(pair_state, at, other_pair[1][new])
+        pair_bdm = np.insert(pair_bdm, at, other_pair[2][new])
+        pair_raw_shop = np.insert(pair_raw_shop, at, other_pair[3][new])
+        pair_shop = np.insert(_remap(self.pair_shop, shop_map), at, other_pair[3][new])
+        pair_moved, pair_inserted = _moved(len(self.pair_day), at)
+
+        def alias_key(bdm, name, phone):
+            return (bdm.astype(np.int64) * n_shops + name) * n_shops + phone
+
+        keys = alias_key(_remap(self.alias_bdm, bdm_map), _remap(self.alias_name, shop_map),
+                         _remap(self.alias_phone, shop_map))
+        added = alias_key(other_bdm[other.alias_bdm], other_shop[other.alias_name], other_shop[other.alias_phone])
+        at, found = _lookup(keys, added)
+        added = added[~found]
+        keys = np.insert(keys, at[~found], added)
+
+        # New pairs, and existing ones whose (bdm, name) gained a number, are resolved against every alias
+        stale = np.zeros(len(pair_shop), dtype=bool)
+        if len(added):
+            stale = np.isin(pair_bdm.astype(np.int64) * n_shops + pair_raw_shop, np.unique(added // n_shops))
+        stale[pair_inserted] = True
+        pair_shop[stale] = _resolve_shops(pair_bdm[stale], pair_raw_shop[stale], keys, n_shops)
+
+        return DailyCube(
+            bdm_names=bdm_names,
+            states=states,
+            shops=shops,
+            statuses=statuses,
+            cell_day=cell_day,
+            cell_state=cell_state,
+            cell_bdm=cell_bdm,
+            cell_visits=cells['visits'],
+            cell_keys=cells['keys'],
+            cell_amount=cells['amount'],
+            cell_status=cells['status'],
+            pair_day=pair_day,
+            pair_state=pair_state,
+            pair_bdm=pair_bdm,
+            pair_shop=pair_shop,
+            pair_raw_shop=pair_raw_shop,
+            alias_bdm=(keys // (n_shops * n_shops)).astype(np.int32),
+            alias_name=(keys // n_shops) % n_shops,
+            alias_phone=keys % n_shops,
+            cell_index=self.cell_index.extend(cell_day, cell_moved, state_map, cell_inserted,
+                                              cell_state[cell_inserted], len(states)),
+            pair_index=self.pair_index.extend(pair_day, pair_moved, state_map, pair_inserted,
+                                              pair_state[pair_inserted], len(states)),
+        )
+
+    @classmethod
+    def _assemble(cls, bdm_names, states, shops, statuses, cells, status, pairs, aliases):
+        """Sum duplicate cells and deduplicate (cell, shop) pairs and aliases into a sorted cube
+
+        status holds sparse (input cell, status code, visits) triples for the per-status counts.
+        Pairs carry each row's own shop code; resolved ones are derived here from the aliases.
+        """
+        day, state_codes, bdm_codes, visits, keys, amount = cells
+        pair_day, pair_state, pair_bdm, pair_shop = pairs
+
+        n_states = max(len(states), 1)
+        n_bdms = max(len(bdm_names), 1)
+        n_shops = max(len(shops), 1)
+        # Offset days from the earliest one to keep the packed keys small
+        day0 = int(day.min()) if len(day) else 0
+
+        # One integer key per (day, state, bdm); sorting by it orders cells by day first
+        cell_key = ((day - day0) * n_states + state_codes) * n_bdms + bdm_codes
+        cell_keys_unique, cell_index = np.unique(cell_key, return_inverse=True)
+        n_cells = len(cell_keys_unique)
+
+        cell_visits = np.bincount(cell_index, weights=visits, minlength=n_cells).round().astype(np.int64)
+        cell_keys = np.bincount(cell_index, weights=keys, minlength=n_cells).round().astype(np.int64)
+        cell_amount = np.bincount(cell_index, weights=amount, minlength=n_cells)
+        status_cell, status_code, status_visits = status
+        n_statuses = len(statuses)
+        cell_status = np.bincount(cell_index[status_cell] * n_statuses + status_code, weights=status_visits,
+                                  minlength=n_cells * n_statuses).round().astype(np.int64).reshape(n_cells, n_statuses)
+
+        # Distinct shops per cell as sorted (day, state, bdm, shop) pairs
+        pair_key = np.unique((((pair_day - day0) * n_states + pair_state) * n_bdms + pair_bdm) * n_shops
+                             + pair_shop)
+        pair_cell_key = pair_key // n_shops
+        alias_bdm, alias_name, alias_phone = aliases
+        alias_key = np.unique((alias_bdm.astype(np.int64) * n_shops + alias_name) * n_shops + alias_phone)
+        raw_shop = pair_key % n_shops
+        pair_bdm = (pair_cell_key % n_bdms).astype(np.int32)
+
+        return cls(
+            bdm_names=bdm_names,
+            states=states,
+            shops=shops,
+            statuses=statuses,
+            cell_day=cell_keys_unique // (n_bdms * n_states) + day0,
+            cell_state=((cell_keys_unique // n_bdms) % n_states).astype(np.int32),
+            cell_bdm=(cell_keys_unique % n_bdms).astype(np.int32),
+            cell_visits=cell_visits,
+            cell_keys=cell_keys,
+            cell_amount=cell_amount,
+            cell_status=cell_status,
+            pair_day=pair_cell_key // (n_bdms * n_states) + day0,
+            pair_state=((pair_cell_key // n_bdms) % n_states).astype(np.int32),
+            pair_bdm=pair_bdm,
+            # Only shop codes change, so the pairs stay in order (a cell may now list a shop twice)
+            pair_shop=_resolve_shops(pair_bdm, raw_shop, alias_key, n_shops),
+            pair_raw_shop=raw_shop,
+            alias_bdm=(alias_key // (n_shops * n_shops)).astype(np.int32),
+            alias_name=(alias_key // n_shops) % n_shops,
+            alias_phone=alias_key % n_shops,
+        )
+
+    def __len__(self):
+        return len(self.cell_day)
+
+    COLUMNS = ['BDM Name', 'visits', 'unique_merchants', 'keys_sold', 'key_amount']
+
+    def select(self, start_day=None, end_day=None, state=None):
+        """(cells, pairs) positions between two inclusive day numbers for one state (or all)
+
+        Each is a slice or an ascending position array; both are None for an unknown state.
+        """
+        if state is not None and state not in self._state_codes:
+            return None, None
+        group = None if state is None else self._state_codes[state]
+        hi_day = None if end_day is None else end_day + 1
+        return self.cell_index.lookup(group, start_day, hi_day), self.pair_index.lookup(group, start_day, hi_day)
+
+    def query(self, start_day=None, end_day=None, state=None):
+        """Sum the cells between two inclusive day numbers for one state (or all), per BDM
+
+        Returns a DataFrame with one row per BDM that has at least one visit, ordered by name.
+        """
+        return self.query_many([(start_day, end_day, state)])[0]
+
+    def query_many(self, windows):
+        """Answer several (start_day, end_day, state) windows, sharing the work between them
+
+        Windows on the same state share one gather of the cells and pairs spanning all of them.
+        Every window boundary cuts that day-ordered run into segments. One bincount gives
+        per-segment, per-BDM totals, and a window adds up its segments. Distinct merchants
+        cannot be added up, so each window takes the unique pair keys of its own slice.
+        """
+        results = [None] * len(windows)
+        by_state = {}
+        for position, (start_day, end_day, state) in enumerate(windows):
+            if state is not None and state not in self._state_codes:
+                results[position] = pd.DataFrame(columns=self.COLUMNS)
+            else:
+                by_state.setdefault(state, []).append(position)
+
+        n_bdms = len(self.bdm_names)
+        for state, positions in by_state.items():
+            group = None if state is None else self._state_codes[state]
+            starts = [windows[position][0] for position in positions]
+            ends = [windows[position][1] for position in positions]
+            lo = None if None in starts else min(starts)
+            hi = None if None in ends else max(ends) + 1
+            cells = self.cell_index.lookup(group, lo, hi)
+            pairs = self.pair_index.lookup(group, lo, hi)
+            cell_day, cell_bdm = self.cell_day[cells], self.cell_bdm[cells]
+            pair_day, pair_bdm, pair_shop = self.pair_day[pairs], self.pair_bdm[pairs], self.pair_shop[pairs]
+
+            # Cut positions of every window edge; segment k spans cells [cuts[k], cuts[k + 1])
+            slices = [_day_slice(cell_day, start_day, end_day) for start_day, end_day in zip(starts, ends)]
+            cuts = np.unique([0, len(cell_day)] + [edge for c in slices for edge in (c.start, c.stop)])
+            segment = np.repeat(np.arange(len(cuts) - 1), np.diff(cuts))
+            cell_group = segment * n_bdms + cell_bdm
+            size = (len(cuts) - 1) * n_bdms
+            partials = [np.bincount(cell_group, weights=self.cell_visits[cells], minlength=size),
+                        np.bincount(cell_group, weights=self.cell_keys[cells], minlength=size),
+                        np.bincount(cell_group, weights=self.cell_amount[cells], minlength=size)]
+            partials = [partial.reshape(-1, n_bdms) for partial in partials]
+
+            for position, start_day, end_day, c in zip(positions, starts, ends, slices):
+                first, last = np.searchsorted(cuts, [c.start, c.stop])
+                visits, keys, amount = (partial[first:last].sum(axis=0) for partial in partials)
+                p = _day_slice(pair_day, start_day, end_day)
+                unique_merchants = count_exact(pair_bdm[p], pair_shop[p], n_bdms, self.shop_count)
+                results[position] = self._frame(visits, keys, amount, unique_merchants)
+        return results
+
+    def status_counts(self, start_day=None, end_day=None, state=None):
+        """(BDMs, statuses) visit counts between two inclusive day numbers for one state (or all)"""
+        counts = np.zeros((len(self.bdm_names), len(self.statuses)), dtype=np.int64)
+        cells, _ = self.select(start_day, end_day, state)
+        if cells is None:
+            return counts
+        cell_bdm, cell_status = self.cell_bdm[cells], self.cell_status[cells]
+        for status in range(len(self.statuses)):
+            counts[:, status] = np.bincount(cell_bdm, weights=cell_status[:, status], minlength=len(self.bdm_names))
+        return counts
+
+    @property
+    def resolved_aliases(self):
+        """resolve_aliases() over every row the cube was built from, for shop_keys() on a subset of them"""
+        if self._resolved_aliases is None:
+            self._resolved_aliases = resolve_aliases(pd.DataFrame({
+                'owner': self.bdm_names[self.alias_bdm], 'name': self.shops[self.alias_name],
+                'phone': self.shops[self.alias_phone]}))
+        return self._resolved_aliases
+
+    def _frame(self, visits, keys, amount, unique_merchants):
+        """Per-BDM result frame from summed metrics and distinct merchant counts"""
+        total_visits = visits.round().astype(np.int64)
+        present = total_visits > 0
+        return pd.DataFrame({
+            'BDM Name': self.bdm_names[present],
+            'visits': total_visits[present],
+            'unique_merchants': unique_merchants[present].astype(np.int64),
+            'keys_sold': keys.round().astype(np.int64)[present],
+            'key_amount': amount[present],
+        }, columns=self.COLUMNS)
+
+
+def _resolve_shops(bdm, shop, alias_key, n_shops):
+    """Shop codes with names replaced by the number their BDM recorded for them, where that is just one
+
+    alias_key holds the sorted, distinct packed (bdm, name, number) aliases.
+    """
+    if not len(alias_key):
+        return shop
+    owner_name, phone = alias_key // n_shops, alias_key % n_shops
+    # A (bdm, name) seen with several numbers stays a name
+    starts = np.flatnonzero(np.r_[True, owner_name[1:] != owner_name[:-1]])
+    single = np.diff(np.r_[starts, len(owner_name)]) == 1
+    names, numbers = owner_name[starts[single]], phone[starts[single]]
+    if not len(names):
+        return shop
+    key = bdm.astype(np.int64) * n_shops + shop
+    position = np.minimum(np.searchsorted(names, key), len(names) - 1)
+    return np.where(names[position] == key, numbers[position], shop)
+
+
+def _remap(codes, code_map):
+    """Codes translated by an extend_vocabulary() code map (None leaves them as they are)"""
+    return codes if code_map is None else code_map[codes].astype(codes.dtype)
+
+
+def _lookup(keys, new_keys):
+    """(insert position, present) of each sorted new key in a sorted key array"""
+    at = np.searchsorted(keys, new_keys)
+    found = at < len(keys)
+    found[found] = keys[at[found]] == new_keys[found]
+    return at, found
+
+
+def _moved(length, at):
+    """(new position of each existing entry or None, positions of the new ones) after np.insert at at"""
+    if not len(at):
+        return None, at
+    shift = np.cumsum(np.bincount(at, minlength=length + 1))[:length]
+    return np.arange(length) + shift, at + np.arange(len(at))
+
+
+def _day_slice(days, start_day, end_day):
+    """Slice of an ascending day array between two inclusive day numbers (None is unbounded)"""
+    first = 0 if start_day is None else int(np.searchsorted(days, start_day, side='left'))
+    last = len(days) if end_day is None else int(np.searchsorted(days, end_day, side='right'))
+    return slice(first, max(first, last))
@@ -0,0 +1,384 @@
+import os
+import threading
+import time
+import hashlib
+import logging
+import itertools
+import numpy as np
+import pandas as pd
+
+from cube import DailyCube
+from geo import GeoIndex
+from indexes import RowIndex
+from metrics import RELOAD_EVENTS, RELOAD_SECONDS
+from quality import SeenSubmissions, merge_reports, submission_hashes
+
+log = logging.getLogger(__name__)
+
+# Text columns stored as integer codes plus a shared vocabulary; snapshots map the codes as they are.
+# Near-unique ID columns (Wallet Transaction ID) stay plain strings: a vocabulary as long as the
+# column saves nothing and makes every concat_frames() merge it
+CATEGORICAL_COLUMNS = ['BDM Name', 'Shop Name', 'State', 'City', 'Month', 'Visit Status', 'Source']
+
+
+def encode_categoricals(frame):
+    """Return the frame with its text dimensions dictionary-encoded as pandas categoricals"""
+    encoded = {
+        column: frame[column].astype('category')
+        for column in CATEGORICAL_COLUMNS
+        if column in frame.columns and not isinstance(frame[column].dtype, pd.CategoricalDtype)
+    }
+    return frame.assign(**encoded) if encoded else frame
+
+
+def concat_frames(*frames):
+    """Stack frames, keeping categorical columns categorical over the union of all vocabularies"""
+    if len(frames) == 1:
+        return frames[0]
+    encoded = {}
+    for column in CATEGORICAL_COLUMNS:
+        if not all(column in frame.columns for frame in frames):
+            continue
+        categories = frames[0][column].cat.categories
+        for frame in frames[1:]:
+            categories = categories.append(frame[column].cat.categories.difference(categories))
+        # Only appending categories keeps the first frame's codes, so it is not recoded. The codes are
+        # stacked directly: concatenating categoricals would compare (hash) every frame's vocabulary
+        codes = [frames[0][column].cat.codes.to_numpy()]
+        for frame in frames[1:]:
+            # A trailing -1 keeps missing values (code -1) missing
+            recode = np.append(categories.get_indexer(frame[column].cat.categories), -1)
+            codes.append(recode[frame[column].cat.codes.to_numpy()])
+        encoded[column] = pd.Categorical.from_codes(np.concatenate(codes),
+                                                    dtype=pd.CategoricalDtype(categories))
+    columns = pd.concat([frame.iloc[:0] for frame in frames]).columns
+    combined = pd.concat([frame.drop(columns=list(encoded)) for frame in frames], ignore_index=True)
+    # Inserted in column order, so every column lands where pd.concat would have put it
+    for column in sorted(encoded, key=columns.get_loc):
+        combined.insert(columns.get_loc(column), column, encoded[column])
+    return combined
+
+
+def _observed_categories(series):
+    """Sorted vocabulary values that actually occur in a categorical column"""
+    codes = series.cat.codes.to_numpy()
+    present = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories)) > 0
+    return sorted(series.cat.categories[present].tolist())
+
+
+class Dataset:
+    """Immutable, fully prepared BDM data shared by every request in the process"""
+
+    def __init__(self, frame, version, signature=None, cube=None, ingest=None, index=None, geo=None, sources=None):
+        # Rows are kept in Timestamp order so date windows are contiguous slices
+        if not frame.empty and not _timestamp_sorted(frame['Timestamp']):
+            frame = frame.sort_values('Timestamp', kind='stable', na_position='last', ignore_index=True)
+            # Prebuilt indexes describe the unsorted rows
+            index = geo = None
+        frame = encode_categoricals(frame)
+        # The frame is never modified after construction - readers must treat it as read-only
+        self.frame = frame
+        self.version = version
+        self.signature = signature
+        self.ingest = ingest
+        self.loaded_at = time.time()
+        # Aggregates are built up front so requests never touch the raw rows
+        self.cube = cube if cube is not None else DailyCube.build(frame)
+        self.index = index if index is not None else RowIndex(frame)
+        # Spatial index for map queries, when the visits carry coordinates
+        if geo is None and 'Latitude' in frame and 'Longitude' in frame:
+            geo = GeoIndex(frame)
+        self.geo = geo
+        # {source name: cube} when the rows were merged from several data files
+        self.sources = sources
+
+        # Filter dropdown values come from the vocabularies, not from a scan per page view
+        self.states = _observed_categories(frame['State']) if 'State' in frame else []
+        self.months = [str(month) for month in _observed_categories(frame['Month'])] if 'Month' in frame else []
+        self.years = sorted(int(year) for year in frame['Year'].dropna().unique()) if 'Year' in frame else []
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def empty(self):
+        return self.frame.empty
+
+    def rows(self, start_day=None, end_day=None, state=None):
+        """Raw visit rows between two inclusive day numbers, optionally for one state"""
+        return self.frame.iloc[self.index.rows(start_day, end_day, state)]
+
+    def append(self, delta, version, signature=None, ingest=None):
+        """New Dataset with cleaned delta rows added; the cube is merged rather than rebuilt
+
+        With no new rows (e.g. only blank lines or duplicates were appended) this same Dataset is
+        returned with just its signature and ingest state moved on, so its version and every
+        result cached for it stay valid.
+        """
+        if delta is None or delta.empty:
+            self.signature = signature
+            self.ingest = ingest
+            return self
+        delta = encode_categoricals(delta)
+        if not _timestamp_sorted(delta['Timestamp']):
+            delta = delta.sort_values('Timestamp', kind='stable', na_position='last', ignore_index=True)
+        moved, inserted = _insert_positions(self.frame['Timestamp'], delta['Timestamp'])
+        frame = concat_frames(self.frame, delta)
+        if moved is not None:
+            # Some delta rows are older than existing ones: interleave them as a stable sort would
+            order = np.empty(len(frame), dtype=np.int64)
+            order[moved] = np.arange(len(self.frame))
+            order[inserted] = len(self.frame) + np.arange(len(delta))
+            frame = frame.take(order).reset_index(drop=True)
+        frame.attrs['quality'] = merge_reports(self.frame.attrs.get('quality'), delta.attrs.get('quality'))
+        # Only what the delta touches is updated; the indexes keep their existing order
+        cube = self.cube.extend(DailyCube.build(delta))
+        index = self.index.extend(frame, moved, inserted)
+        geo = self.geo.extend(frame, moved, inserted) if self.geo is not None else None
+        return Dataset(frame, version, signature, cube=cube, ingest=ingest, index=index, geo=geo)
+
+
+def _timestamp_sorted(column):
+    """Whether a Timestamp column is ascending with any NaT at the end, the order Dataset keeps"""
+    values = column.to_numpy(dtype='datetime64[ns]')
+    valid = int((~np.isnat(values)).sum())
+    if np.isnat(values[:valid]).any():
+        return False
+    return bool((np.diff(values[:valid].view(np.int64)) >= 0).all())
+
+
+def _insert_positions(timestamps, added):
+    """(new position of each existing row or None, positions of the added rows) in the merged order
+
+    Both columns are Timestamp-sorted with NaT last. Added rows go after existing rows with the
+    same timestamp, which is where a stable sort of the concatenated rows puts them. moved is
+    None when every added row lands after the existing ones.
+    """
+    def sort_key(column):
+        values = column.to_numpy(dtype='datetime64[ns]')
+        return np.where(np.isnat(values), np.iinfo(np.int64).max, values.view(np.int64))
+
+    existing = sort_key(timestamps)
+    at = np.searchsorted(existing, sort_key(added), side='right')
+    inserted = at + np.arange(len(at))
+    if not len(at) or at[0] == len(existing):
+        return None, inserted
+    shift = np.cumsum(np.bincount(at, minlength=len(existing) + 1))[:len(existing)]
+    return np.arange(len(existing)) + shift, inserted
+
+
+def file_signature(path):
+    """Return a cheap (mtime, size) fingerprint of the data file, or None if it is missing"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class IngestState:
+    """Where the last parse of the data file stopped, so appended rows can be parsed on their own"""
+
+    def __init__(self, offset, rows, header, prefix_hash, ends_with_newline, submissions=None):
+        self.offset = offset
+        self.rows = rows
+        self.header = header
+        # Running hash of bytes [0, offset); copied and extended on each append
+        self.prefix_hash = prefix_hash
+        self.ends_with_newline = ends_with_newline
+        # SeenSubmissions of the rows parsed so far, so appended duplicates are dropped; None if unknown
+        self.submissions = submissions
+
+
+def _hash_prefix(path, length, chunk_size=1 << 20):
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+
+def capture_ingest_state(path, size, rows, submissions=None):
+    """Record the parse position after a full load of the first `size` bytes"""
+    with open(path, 'rb') as f:
+        header = f.readline()
+        f.seek(max(size - 1, 0))
+        last_byte = f.read(1)
+    return IngestState(size, rows, header, _hash_prefix(path, size), last_byte == b'\n', submissions)
+
+
+def resume_ingest_state(path, offset, rows, header, prefix_digest, ends_with_newline, submissions=None):
+    """Rebuild a persisted IngestState, or None if the first `offset` bytes are no longer the same"""
+    prefix_hash = _hash_prefix(path, offset)
+    if prefix_hash.digest() != prefix_digest:
+        return None
+    return IngestState(offset, rows, header, prefix_hash, ends_with_newline, submissions)
+
+
+def read_appended_bytes(path, state, size):
+    """Return (header + complete appended lines, new IngestState), or None if earlier bytes changed"""
+    if size < state.offset:
+        return None
+    if _hash_prefix(path, state.offset).digest() != state.prefix_hash.digest():
+        return None
+
+    with open(path, 'rb') as f:
+        f.seek(state.offset)
+        tail = f.read(size - state.offset)
+
+    consumed = 0
+    if not state.ends_with_newline:
+        # The last parsed row had no line ending; appended rows must start on a new line
+        if tail.startswith(b'\r\n'):
+            consumed = 2
+        elif tail.startswith(b'\n'):
+            consumed = 1
+        elif tail:
+            return None
+
+    # Only take complete lines; a row still being written is picked up on the next change
+    end = tail.rfind(b'\n') + 1
+    if end <= consumed:
+        return b'', state
+    prefix_hash = state.prefix_hash.copy()
+    prefix_hash.update(tail[:end])
+    # The appended rows are added to a copy, so a failed append leaves the current state alone
+    submissions = None if state.submissions is None else state.submissions.copy()
+    new_state = IngestState(state.offset + end, state.rows, state.header, prefix_hash, True, submissions)
+    return state.header + tail[consumed:end], new_state
+
+
+class DatasetStore:
+    """Process-wide holder of the current Dataset with background hot-reload on file change"""
+
+    def __init__(self, path, loader, check_interval=2.0, appender=None, publisher=None, signature=file_signature):
+        self.path = path
+        self.loader = loader
+        # Fingerprint of the path that changes whenever it needs reloading (see sources.data_signature)
+        self.signature = signature
+        # Optional callable turning header + appended CSV bytes into cleaned rows; it is also passed
+        # the SeenSubmissions of the rows already loaded, to drop appended duplicates of them
+        self.appender = appender
+        # Optional shared store (see snapshot.SnapshotPublisher) that lets several worker processes
+        # map one copy of each dataset generation instead of each holding its own
+        self.publisher = publisher
+        self.check_interval = check_interval
+        self._current = None
+        self._versions = itertools.count(1)
+        # Guards loading/rebuild bookkeeping only; readers never take it once a dataset exists
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._last_check = 0.0
+
+    def get(self):
+        """Return the current Dataset, triggering a background rebuild if the file changed"""
+        current = self._current
+        if current is None:
+            with self._lock:
+                # First load blocks: there is nothing older to serve yet
+                if self._current is None:
+                    self._current = self._build(self.signature(self.path))
+                    self._last_check = time.monotonic()
+            return self._current
+
+        self._maybe_refresh(current)
+        return current
+
+    def peek(self):
+        """The Dataset being served, or None before the first load; never loads or checks the file"""
+        return self._current
+
+    def pin(self, dataset):
+        """Serve dataset from now on without checking the file for changes (e.g. in benchmarks)"""
+        self._current = dataset
+        self._last_check = float('inf')
+
+    def _maybe_refresh(self, current):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+
+        signature = self.signature(self.path)
+        if signature is None or signature == current.signature:
+            return
+
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        log.info("Data file changed (%s -> %s), rebuilding in background", current.signature, signature)
+        thread = threading.Thread(target=self._rebuild, args=(signature,), daemon=True)
+        thread.start()
+
+    def _rebuild(self, signature):
+        started = time.perf_counter()
+        try:
+            kind = 'append'
+            dataset = self._append(self._current, signature)
+            if dataset is None:
+                kind = 'full'
+                dataset = self._build(signature)
+            elif dataset is not self._current and self.publisher is not None and self.publisher.publish(dataset):
+                # Swap the private appended copy for the shared generation just published
+                kind = 'shared'
+                dataset = self._build(signature)
+            if dataset.frame.attrs.get('dummy') and not self._current.frame.attrs.get('dummy'):
+                # The loader fell back to dummy rows (e.g. the file was caught half written); keep serving
+                # the real ones and try again on the next check, which still sees a changed signature
+                RELOAD_EVENTS.inc('failed')
+                log.warning("Reload produced no readable data, keeping version %s", self._current.version)
+                return
+            # Single reference assignment: readers see either the old or the new dataset, never a partial one
+            self._current = dataset
+            RELOAD_SECONDS.observe(time.perf_counter() - started, kind)
+            RELOAD_EVENTS.inc(kind)
+            log.info("Dataset version %s swapped in with %d rows", dataset.version, len(dataset))
+        except Exception:
+            RELOAD_EVENTS.inc('failed')
+            log.exception("Background reload failed, keeping version %s", self._current.version)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _append(self, current, signature):
+        """Fold only the newly appended rows into the current dataset, or None if a full rebuild is needed"""
+        if self.appender is None or current.ingest is None:
+            return None
+        if self.publisher is not None and self.publisher.published(signature):
+            # Another process already produced this generation; mapping it beats appending again
+            return None
+        appended = read_appended_bytes(self.path, current.ingest, signature[1])
+        if appended is None:
+            log.info("Earlier rows of the data file changed, falling back to a full reload")
+            return None
+
+        data, ingest = appended
+        delta = self.appender(data, ingest.submissions) if data else None
+        if data and delta is None:
+            return None
+        rows = 0 if delta is None else len(delta)
+        ingest.rows = current.ingest.rows + rows
+        log.info("Appended %d new rows to dataset version %s", rows, current.version)
+        return current.append(delta, next(self._versions), signature, ingest)
+
+    def _build(self, signature):
+        # Capture the signature before loading so a change during the load triggers another rebuild
+        # The loader returns a frame, or (frame, cube[, index[, geo[, source cubes]]]) when it has those prebuilt
+        loaded = self.loader()
+        if not isinstance(loaded, tuple):
+            loaded = (loaded,)
+        frame, cube, index, geo, sources = (loaded + (None,) * 4)[:5]
+        ingest = None
+        if (self.appender is not None and signature is not None and not frame.attrs.get('dummy')
+                and file_signature(self.path) == signature):
+            ingest = capture_ingest_state(self.path, signature[1], len(frame),
+                                          SeenSubmissions(submission_hashes(frame)))
+        return Dataset(frame, next(self._versions), signature, cube=cube, ingest=ingest, index=index, geo=geo,
+                       sources=sources)
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+
+# Merchants are identified by this number where it is present, by their normalized name otherwise
+PHONE_COLUMN = 'RocketPay Registered Number'
+
+# Dense bitmaps are used once the pairs would fill at least 1/16 of the bits; sparser sets are sorted instead
+BITMAP_DENSITY = 16
+
+
+def normalize_shop_names(names):
+    """Case-, spacing- and punctuation-insensitive form of each shop name in an Index"""
+    return names.astype(str).str.casefold().str.replace(r'[^0-9a-z]+', ' ', regex=True).str.strip()
+
+
+def normalize_phones(values):
+    """Last 10 digits of each registered number in an Index (dropping +91 or 0 prefixes), NaN if it has fewer"""
+    # Numbers read from a column with blanks come back as floats: 7990036324.0
+    digits = values.astype(str).str.replace(r'\.0$', '', regex=True).str.replace(r'\D', '', regex=True)
+    return digits.str[-10:].where(digits.str.len() >= 10)
+
+
+def _key_codes(series, normalize, prefix, missing=None):
+    """(per-row codes, keys) normalizing each distinct value once; code -1 where there is no key
+
+    Categorical columns are normalized over their categories, so the work follows the
+    vocabulary, not the rows. Spellings that normalize alike share one key.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        codes, uniques = pd.factorize(series)
+        uniques = pd.Index(uniques)
+    key_codes, keys = pd.factorize(prefix + normalize(uniques))
+    keys = np.asarray(keys, dtype=object)
+    if missing is not None:
+        keys = np.append(keys, missing)
+    # Code -1 (a missing value) takes the trailing slot
+    lookup = np.append(key_codes, len(keys) - 1 if missing is not None else -1)
+    return lookup[codes], keys
+
+
+def shop_parts(df):
+    """(name codes, name keys, number codes, number keys) of a frame's rows
+
+    Every row has a name key; number codes are -1 where a row has no usable number.
+    """
+    # A missing name is the 'Unknown' that clean_data fills in
+    name_codes, names = _key_codes(df['Shop Name'], normalize_shop_names, 'name:', missing='name:unknown')
+    if PHONE_COLUMN not in df:
+        return name_codes, names, np.full(len(df), -1, dtype=np.int64), np.empty(0, dtype=object)
+    phone_codes, phones = _key_codes(df[PHONE_COLUMN], normalize_phones, 'tel:')
+    return name_codes, names, phone_codes, phones
+
+
+def raw_codes(parts, name_map, phone_map):
+    """Per-row codes of the raw keys, given where each name and number key lands in a vocabulary"""
+    name_codes, _, phone_codes, _ = parts
+    codes = np.asarray(name_map)[name_codes]
+    numbered = phone_codes >= 0
+    codes[numbered] = np.asarray(phone_map)[phone_codes[numbered]]
+    return codes
+
+
+def alias_codes(owner_codes, parts):
+    """Distinct (owner, name, number) code triples of the rows with a usable number and an owner"""
+    name_codes, names, phone_codes, phones = parts
+    rows = np.flatnonzero((phone_codes >= 0) & (owner_codes >= 0))
+    n_names, n_phones = len(names), max(len(phones), 1)
+    key = np.unique((owner_codes[rows].astype(np.int64) * n_names + name_codes[rows]) * n_phones
+                    + phone_codes[rows])
+    return key // (n_names * n_phones), key // n_phones % n_names, key % n_phones
+
+
+def _owner_codes(df):
+    """Per-row BDM codes and names; a missing BDM is the empty name"""
+    if 'BDM Name' not in df:
+        return np.zeros(len(df), dtype=np.int64), np.array([''], dtype=object)
+    codes, owners = _key_codes(df['BDM Name'], lambda values: values.astype(str), '', missing='')
+    return codes, owners
+
+
+def _aliases(df, parts):
+    owner_codes, owners = _owner_codes(df)
+    owner, name, phone = alias_codes(owner_codes, parts)
+    return pd.DataFrame({'owner': owners[owner], 'name': parts[1][name], 'phone': parts[3][phone]})
+
+
+def shop_aliases(df):
+    """Distinct (BDM, name key, number key) triples of the rows that carry a usable number"""
+    return _aliases(df, shop_parts(df))
+
+
+def resolve_aliases(aliases):
+    """Number key per (BDM, name key), for the names a BDM only ever recorded with one number"""
+    single = aliases.drop_duplicates(['owner', 'name'], keep=False)
+    return pd.Series(single['phone'].to_numpy(), index=pd.MultiIndex.from_frame(single[['owner', 'name']]))
+
+
+def _raw_keys(parts):
+    name_codes, names, phone_codes, phones = parts
+    keys = names[name_codes]
+    numbered = phone_codes >= 0
+    keys[numbered] = phones[phone_codes[numbered]]
+    return keys
+
+
+def raw_shop_keys(df):
+    """Per-row keys before name resolution: depend on the row alone, so they suit row identity"""
+    return pd.Series(_raw_keys(shop_parts(df)), index=df.index, name='Shop Key')
+
+
+def shop_keys(df, resolved=None):
+    """Merchant identity per row, so near-duplicate spellings of one shop count once
+
+    'tel:<last 10 digits>' when the RocketPay Registered Number is usable, otherwise
+    'name:<normalized Shop Name>'. A row without a number still gets the 'tel:' key when its
+    BDM recorded that name with exactly one number (resolved, from resolve_aliases(); by
+    default from the frame's own rows), so a shop seen both ways counts once.
+    """
+    parts = shop_parts(df)
+    name_codes, names, phone_codes, _ = parts
+    keys = _raw_keys(parts)
+    if resolved is None:
+        resolved = resolve_aliases(_aliases(df, parts))
+    missing = np.flatnonzero(phone_codes < 0)
+    if len(resolved) and len(missing):
+        # Look up each distinct (BDM, name) once rather than every row
+        owner_codes, owners = _owner_codes(df)
+        pair, inverse = np.unique(owner_codes[missing].astype(np.int64) * len(names) + name_codes[missing],
+                                  return_inverse=True)
+        position = resolved.index.get_indexer(pd.MultiIndex.from_arrays([owners[pair // len(names)],
+                                                                          names[pair % len(names)]]))[inverse]
+        found = position >= 0
+        keys[missing[found]] = resolved.to_numpy()[position[found]]
+    return pd.Series(keys, index=df.index, name='Shop Key')
+
+
+def count_exact(groups, members, n_groups, n_members):
+    """Distinct members per group over (group, member) pairs, duplicates allowed
+
+    Like a roaring bitmap, dense sets are unioned in a bitmap and sparse ones as a sorted array.
+    """
+    keys = groups.astype(np.int64) * n_members + members
+    if n_groups * n_members <= BITMAP_DENSITY * len(keys):
+        seen = np.zeros(n_groups * n_members, dtype=bool)
+        seen[keys] = True
+        return seen.reshape(n_groups, n_members).sum(axis=1)
+    return np.bincount(np.unique(keys) // n_members, minlength=n_groups)
+
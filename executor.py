@@ -0,0 +1,85 @@
+import threading
+import contextvars
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from metrics import QUERY_EVENTS
+
+log = logging.getLogger(__name__)
+
+
+class QueryTimeout(Exception):
+    """A query did not finish in time and there is no earlier result to fall back on"""
+
+
+class QueryExecutor:
+    """Runs aggregations on a bounded thread pool, coalescing identical queries in flight
+
+    Request threads only wait for a result, so a burst of heavy queries queues in the pool
+    instead of pinning every request thread, and NumPy kernels (which release the GIL) overlap.
+    Concurrent calls with the same key share one computation (single-flight). A caller that
+    times out gets the last result computed for its stale key, if any, while the computation
+    finishes in the background and refreshes that result. With max_workers=0 queries run inline.
+    """
+
+    def __init__(self, max_workers=4, timeout=10.0, keep_last=256):
+        self.timeout = timeout
+        self.keep_last = keep_last
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix='query') if max_workers > 0 else None
+        self._in_flight = {}
+        self._last = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, stale_key=None):
+        """Future for fn's result, shared with any identical query already running"""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                QUERY_EVENTS.inc('coalesced')
+                return future
+            # Runs in the caller's context, so metric stages keep the request's endpoint label
+            future = self._pool.submit(contextvars.copy_context().run, fn)
+            self._in_flight[key] = future
+            QUERY_EVENTS.inc('submitted')
+        future.add_done_callback(lambda done: self._finish(key, stale_key, done))
+        return future
+
+    def run(self, key, fn, stale_key=None, timeout=None):
+        """(result, stale) for a query; stale results are the last one computed for stale_key"""
+        if self._pool is None:
+            result = fn()
+            self._remember(stale_key, result)
+            return result, False
+        future = self.submit(key, fn, stale_key)
+        try:
+            return future.result(self.timeout if timeout is None else timeout), False
+        except FutureTimeout:
+            QUERY_EVENTS.inc('timeout')
+            with self._lock:
+                last = self._last.get(stale_key) if stale_key is not None else None
+            if last is None:
+                raise QueryTimeout(f"Query did not finish within {self.timeout if timeout is None else timeout}s")
+            QUERY_EVENTS.inc('stale')
+            log.warning("Query %s timed out, serving the last known result", stale_key)
+            return last, True
+
+    def _finish(self, key, stale_key, future):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._remember(stale_key, future.result())
+
+    def _remember(self, stale_key, result):
+        if stale_key is None or self.keep_last <= 0:
+            return
+        with self._lock:
+            self._last[stale_key] = result
+            self._last.move_to_end(stale_key)
+            while len(self._last) > self.keep_last:
+                self._last.popitem(last=False)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
@@ -0,0 +1,195 @@
+import io
+import re
+import zipfile
+import numpy as np
+import pandas as pd
+
+from quality import normalize_name
+
+EXPORT_FORMATS = ['csv', 'xlsx']
+
+# The data file's own columns, in its order, then the file a merged row came from; derived ones
+# (Month, Week, ...) are left out
+EXPORT_COLUMNS = ['Timestamp', 'Shop Name', 'RocketPay Registered Number', 'City', 'State', 'BDM Name',
+                  'Visit Status', 'Latitude', 'Longitude', 'Keys Sold', 'Key Amount', 'Current Key Balance',
+                  'Wallet Transaction ID', 'Source']
+
+# Written the way the data file writes them, so an export can be loaded back
+TIMESTAMP_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+# Characters XML 1.0 does not allow, even escaped
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def export_columns(frame):
+    """The export columns the frame has, in export order; every chunk and the header use these"""
+    return [column for column in EXPORT_COLUMNS if column in frame]
+
+
+def export_chunks(frame, positions, bdm=None, chunk_rows=5000):
+    """Frames of the export columns for rows at positions (a slice or array), chunk_rows rows at a time
+
+    Only one chunk of rows is materialized at a time. With bdm, rows of other BDMs are
+    dropped chunk by chunk, comparing dictionary codes rather than names.
+    """
+    bdm = None if bdm is None else normalize_name(bdm)
+    columns = export_columns(frame)
+    if isinstance(positions, slice):
+        start, stop, _ = positions.indices(len(frame))
+        bounds = ((lo, min(lo + chunk_rows, stop)) for lo in range(start, stop, chunk_rows))
+        batches = (np.arange(lo, hi) for lo, hi in bounds)
+    else:
+        batches = (positions[lo:lo + chunk_rows] for lo in range(0, len(positions), chunk_rows))
+
+    codes = code = None
+    if bdm is not None:
+        names = frame['BDM Name']
+        if isinstance(names.dtype, pd.CategoricalDtype):
+            if bdm not in names.cat.categories:
+                return
+            codes, code = names.cat.codes.to_numpy(), names.cat.categories.get_loc(bdm)
+        else:
+            codes, code = names.to_numpy(dtype=object), bdm
+
+    # Decided once over every selected row, so a column is written the same way in every chunk
+    selected = None if codes is None else codes[positions] == code
+    integers = _integer_columns(frame, positions, selected, columns)
+
+    # Take rows first, then columns: selecting columns of the whole frame would copy all of it
+    column_positions = [frame.columns.get_loc(column) for column in columns]
+    for batch in batches:
+        if codes is not None:
+            batch = batch[codes[batch] == code]
+        if len(batch):
+            chunk = frame.iloc[batch, column_positions]
+            if integers:
+                chunk = chunk.assign(**{column: chunk[column].astype('Int64') for column in integers})
+            yield chunk
+
+
+def _integer_columns(frame, positions, selected, columns):
+    """Float columns to write as integers: those whose selected values are all whole numbers
+
+    Phone numbers and balances read next to blanks come in as floats. A column holding any
+    fraction or infinity stays a float column.
+    """
+    integers = []
+    for column in columns:
+        values = frame[column]
+        if values.dtype.kind != 'f' or column in ('Latitude', 'Longitude', 'Key Amount'):
+            continue
+        values = values.to_numpy()[positions]
+        if selected is not None:
+            values = values[selected]
+        present = values[~np.isnan(values)]
+        if np.isfinite(present).all() and (present == np.round(present)).all():
+            integers.append(column)
+    return integers
+
+
+def csv_stream(chunks, columns):
+    """CSV text blocks: the header of export_columns() first, then one block per chunk"""
+    # Written up front, so a file where nothing matched still has the same columns
+    yield pd.DataFrame(columns=columns).to_csv(index=False)
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=False, date_format=TIMESTAMP_FORMAT)
+
+
+class _Sink(io.RawIOBase):
+    """Unseekable file zipfile writes into; whatever it has collected is taken with drain()"""
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Visits" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'),
+}
+
+
+def _text_cells(values):
+    text = values.astype(str).str.replace('&', '&amp;').str.replace('<', '&lt;').str.replace('>', '&gt;')
+    text = text.str.replace(_XML_ILLEGAL, '', regex=True)
+    return ('<c t="inlineStr"><is><t xml:space="preserve">' + text + '</t></is></c>').where(values.notna(), '<c/>')
+
+
+def _header_row(columns):
+    return ('<row>' + ''.join(_text_cells(pd.Series(list(columns), dtype=object))) + '</row>').encode('utf-8')
+
+
+def _sheet_rows(chunk):
+    """SpreadsheetML <row> elements for a chunk, built a column at a time"""
+    cells = None
+    for column in chunk.columns:
+        values = chunk[column]
+        if column == 'Timestamp':
+            cell = _text_cells(values.dt.strftime(TIMESTAMP_FORMAT))
+        elif pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+            cell = ('<c><v>' + values.astype(str) + '</v></c>').where(values.notna(), '<c/>')
+        else:
+            cell = _text_cells(values.astype(object))
+        cells = cell if cells is None else cells + cell
+    return ''.join('<row>' + cells + '</row>')
+
+
+def xlsx_stream(chunks, columns):
+    """Bytes of a one-sheet XLSX workbook, written and sent a chunk of rows at a time
+
+    zipfile writes to an unseekable stream with data descriptors, so nothing has to be
+    buffered until the end: each chunk is deflated and handed out as soon as it is written.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in _XLSX_PARTS.items():
+            workbook.writestr(name, content)
+        yield sink.drain()
+        # The sheet's size is unknown up front, so allow it to grow past 4 GiB
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(_header_row(columns))
+            for chunk in chunks:
+                sheet.write(_sheet_rows(chunk).encode('utf-8'))
+                data = sink.drain()
+                if data:
+                    yield data
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
@@ -0,0 +1,277 @@
+import math
+import numpy as np
+import pandas as pd
+
+from indexes import NS_PER_DAY
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.195
+
+# Heatmap grid levels in degrees, coarse to fine (about 110 km, 22 km and 5.5 km cells)
+LEVELS = [1.0, 0.2, 0.05]
+# Individual visits are indexed on the finest grid
+ROW_LEVEL = len(LEVELS) - 1
+# Aim for about this many heatmap bins across the width of a map view
+BINS_ACROSS = 64
+
+AGGREGATE_ARRAYS = ['cell', 'day', 'state', 'visits', 'keys', 'amount']
+
+
+def _grid(size):
+    """(rows, columns) of the global grid with the given cell size in degrees"""
+    return round(180 / size), round(360 / size)
+
+
+def cell_ids(lat, lon, size):
+    """Grid cell of each coordinate, numbered row by row from the south-west corner"""
+    n_lat, n_lon = _grid(size)
+    lat_bin = np.clip(np.floor((np.asarray(lat) + 90) / size).astype(np.int64), 0, n_lat - 1)
+    lon_bin = np.clip(np.floor((np.asarray(lon) + 180) / size).astype(np.int64), 0, n_lon - 1)
+    return lat_bin * n_lon + lon_bin
+
+
+def cell_centers(cells, size):
+    """(lat, lon) centre of each grid cell"""
+    _, n_lon = _grid(size)
+    return (cells // n_lon + 0.5) * size - 90, (cells % n_lon + 0.5) * size - 180
+
+
+def cell_ranges(min_lat, min_lon, max_lat, max_lon, size):
+    """Half-open cell id ranges covering a bounding box: one contiguous run per grid row"""
+    n_lat, n_lon = _grid(size)
+    lat_lo, lat_hi = (int(min(max(math.floor((value + 90) / size), 0), n_lat - 1)) for value in (min_lat, max_lat))
+    lon_lo, lon_hi = (int(min(max(math.floor((value + 180) / size), 0), n_lon - 1)) for value in (min_lon, max_lon))
+    rows = np.arange(lat_lo, lat_hi + 1, dtype=np.int64) * n_lon
+    return rows + lon_lo, rows + lon_hi + 1
+
+
+def _gather_ranges(sorted_cells, starts, stops):
+    """Positions in a cell-sorted array of all entries inside the given cell id ranges"""
+    first = np.searchsorted(sorted_cells, starts, side='left')
+    last = np.searchsorted(sorted_cells, stops, side='left')
+    lengths = last - first
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    # Concatenate the ranges without a Python loop: arange shifted per range
+    offsets = np.repeat(first - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    return np.arange(total, dtype=np.int64) + offsets
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def radius_bbox(lat, lon, km):
+    """(min_lat, min_lon, max_lat, max_lon) enclosing a circle"""
+    dlat = km / KM_PER_DEGREE_LAT
+    dlon = km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, max(lon - dlon, -180.0), lat + dlat, min(lon + dlon, 180.0)
+
+
+def tile_bbox(z, x, y):
+    """(min_lat, min_lon, max_lat, max_lon) of a web-mercator (slippy map) tile"""
+    n = 2 ** z
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+    return lat(y + 1), x / n * 360 - 180, lat(y), (x + 1) / n * 360 - 180
+
+
+def level_for_span(span_degrees):
+    """Finest pre-binned level that still gives about BINS_ACROSS bins over a view this wide"""
+    target = span_degrees / BINS_ACROSS
+    coarse_enough = [level for level, size in enumerate(LEVELS) if size >= target]
+    return coarse_enough[-1] if coarse_enough else 0
+
+
+def _merge_bins(bins, added):
+    """Cell-sorted (cell, day, state) totals with another set added in, summing bins present in both"""
+    if not len(added['cell']):
+        return bins
+    days = np.concatenate([bins['day'], added['day']])
+    day0, n_days = int(days.min()), int(days.max() - days.min()) + 1
+    n_states = int(max(bins['state'].max(initial=-1), added['state'].max())) + 2
+
+    def packed(aggregate):
+        # Same (cell, day, state) order the bins are sorted in
+        return ((aggregate['cell'] * n_days + (aggregate['day'] - day0)) * n_states + aggregate['state'] + 1)
+
+    keys, new_keys = packed(bins), packed(added)
+    position = np.searchsorted(keys, new_keys)
+    found = position < len(keys)
+    found[found] = keys[position[found]] == new_keys[found]
+    merged = {}
+    for name in AGGREGATE_ARRAYS:
+        values = bins[name]
+        if name in ('visits', 'keys', 'amount'):
+            values = values.copy()
+            values[position[found]] += added[name][found]
+        merged[name] = np.insert(values, position[~found], added[name][~found])
+    return merged
+
+
+def _coordinates(series):
+    if series.dtype.kind == 'f':
+        return series.to_numpy(dtype=np.float64)
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+
+
+class GeoIndex:
+    """Grid index over visit coordinates, plus heatmap bins pre-aggregated at every level
+
+    Visits are sorted by their finest-level cell, so a bounding box becomes one contiguous run
+    of positions per grid row; only those candidates get the exact box or haversine test. The
+    heatmap levels hold (cell, day, state) totals sorted by cell, so panning and zooming read
+    the bins in view instead of touching the visits. Rows without usable coordinates (missing,
+    out of range or 0,0) are left out.
+    """
+
+    def __init__(self, df, saved=None):
+        self._columns(df)
+        if saved is not None:
+            arrays, _ = saved
+            self.order, self.cells = arrays['order'], arrays['cells']
+            self.levels = [{name: arrays[f'level{level}.{name}'] for name in AGGREGATE_ARRAYS}
+                           for level in range(len(LEVELS))]
+            return
+
+        rows = self._located(np.arange(len(self.lat)))
+        cells = cell_ids(self.lat[rows], self.lon[rows], LEVELS[ROW_LEVEL])
+        # Stable, so rows inside a cell stay in timestamp order
+        order = np.argsort(cells, kind='stable')
+        self.order, self.cells = rows[order], cells[order]
+        self.levels = [self._aggregate(rows, size) for size in LEVELS]
+
+    def _columns(self, df):
+        self.lat = _coordinates(df['Latitude'])
+        self.lon = _coordinates(df['Longitude'])
+        self.timestamps = df['Timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        state = df['State']
+        if isinstance(state.dtype, pd.CategoricalDtype):
+            self.state_codes, states = state.cat.codes.to_numpy(), state.cat.categories
+        else:
+            self.state_codes, states = pd.factorize(state)
+        self.states = {name: code for code, name in enumerate(states)}
+        self.keys_sold = df['Keys Sold'].to_numpy()
+        self.amount = df['Key Amount'].to_numpy(dtype=np.float64)
+
+    def _located(self, rows):
+        """The given rows that have usable coordinates and a timestamp"""
+        lat, lon = self.lat[rows], self.lon[rows]
+        with np.errstate(invalid='ignore'):
+            valid = (np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+                     & ((lat != 0) | (lon != 0)) & (self.timestamps[rows] != np.iinfo(np.int64).min))
+        return rows[valid]
+
+    def extend(self, df, moved, inserted):
+        """Index over df, the indexed frame with rows inserted at the ascending positions inserted
+
+        moved holds the new position of every existing row, or None if they all kept theirs. Only
+        the inserted rows are binned; their totals are added into the existing heatmap levels.
+        """
+        index = GeoIndex.__new__(GeoIndex)
+        index._columns(df)
+        rows = index._located(inserted)
+        # Cell-major keys: the existing rows are already in key order, so the new ones are merged in
+        size = max(len(index.lat), 1)
+        keys = self.cells * size + (self.order if moved is None else moved[self.order])
+        new_keys = np.sort(cell_ids(index.lat[rows], index.lon[rows], LEVELS[ROW_LEVEL]) * size + rows)
+        keys = np.insert(keys, np.searchsorted(keys, new_keys), new_keys)
+        index.order, index.cells = keys % size, keys // size
+
+        # Existing bins hold codes of the old state vocabulary
+        state_map = np.array([index.states[state] for state in self.states], dtype=np.int32)
+        index.levels = []
+        for level, size in enumerate(LEVELS):
+            aggregate = self.levels[level]
+            if len(state_map) and not np.array_equal(state_map, np.arange(len(state_map))):
+                state = aggregate['state']
+                aggregate = {**aggregate, 'state': np.where(state >= 0, state_map[state], state)}
+            index.levels.append(_merge_bins(aggregate, index._aggregate(rows, size)))
+        return index
+
+    def _aggregate(self, rows, size):
+        """(cell, day, state) totals over the given rows, sorted by cell"""
+        if not len(rows):
+            return {name: np.empty(0, dtype=np.int64) for name in AGGREGATE_ARRAYS}
+        cell = cell_ids(self.lat[rows], self.lon[rows], size)
+        day = self.timestamps[rows] // NS_PER_DAY
+        # Shift state codes by one so a missing state (-1) packs like any other
+        state = self.state_codes[rows].astype(np.int64) + 1
+        day0, n_days, n_states = int(day.min()), int(day.max() - day.min()) + 1, len(self.states) + 1
+        packed, inverse = np.unique((cell * n_days + (day - day0)) * n_states + state, return_inverse=True)
+        return {
+            'cell': packed // (n_days * n_states),
+            'day': (packed // n_states % n_days + day0).astype(np.int32),
+            'state': (packed % n_states - 1).astype(np.int32),
+            'visits': np.bincount(inverse).astype(np.int64),
+            'keys': np.bincount(inverse, weights=self.keys_sold[rows]).round().astype(np.int64),
+            'amount': np.bincount(inverse, weights=self.amount[rows]),
+        }
+
+    def to_arrays(self):
+        """(arrays, JSON metadata) that GeoIndex(df, saved=...) accepts for the same frame"""
+        arrays = {'order': self.order, 'cells': self.cells}
+        for level, aggregate in enumerate(self.levels):
+            arrays.update({f'level{level}.{name}': array for name, array in aggregate.items()})
+        return arrays, {}
+
+    def __len__(self):
+        return len(self.order)
+
+    def _day_state_mask(self, day, state_codes, start_day, end_day, state):
+        mask = np.ones(len(day), dtype=bool)
+        if start_day is not None:
+            mask &= day >= start_day
+        if end_day is not None:
+            mask &= day <= end_day
+        if state is not None:
+            mask &= state_codes == self.states.get(state, -2)
+        return mask
+
+    def bbox_rows(self, min_lat, min_lon, max_lat, max_lon, start_day=None, end_day=None, state=None):
+        """Ascending row positions of visits inside a box, optionally within a day window and state"""
+        starts, stops = cell_ranges(min_lat, min_lon, max_lat, max_lon, LEVELS[ROW_LEVEL])
+        rows = self.order[_gather_ranges(self.cells, starts, stops)]
+        lat, lon = self.lat[rows], self.lon[rows]
+        mask = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        mask &= self._day_state_mask(self.timestamps[rows] // NS_PER_DAY, self.state_codes[rows],
+                                     start_day, end_day, state)
+        return np.sort(rows[mask])
+
+    def radius_rows(self, lat, lon, km, start_day=None, end_day=None, state=None):
+        """(row positions, distances in km) of visits within km of a point, nearest first"""
+        rows = self.bbox_rows(*radius_bbox(lat, lon, km), start_day, end_day, state)
+        distances = haversine_km(lat, lon, self.lat[rows], self.lon[rows])
+        inside = distances <= km
+        order = np.argsort(distances[inside], kind='stable')
+        return rows[inside][order], distances[inside][order]
+
+    def heatmap(self, level, min_lat, min_lon, max_lat, max_lon, start_day=None, end_day=None, state=None):
+        """Visit density and key sales per grid cell of one level inside a box, as parallel lists"""
+        size = LEVELS[level]
+        aggregate = self.levels[level]
+        positions = _gather_ranges(aggregate['cell'], *cell_ranges(min_lat, min_lon, max_lat, max_lon, size))
+        mask = self._day_state_mask(aggregate['day'][positions], aggregate['state'][positions],
+                                    start_day, end_day, state)
+        positions = positions[mask]
+        # Ranges are gathered in ascending cell order, so each cell is one run of positions
+        cells = aggregate['cell'][positions]
+        starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))[:len(cells)]
+        lat, lon = cell_centers(cells[starts], size)
+
+        def totals(name):
+            values = aggregate[name][positions]
+            return np.add.reduceat(values, starts) if len(starts) else values[:0]
+
+        return {
+            'level': level,
+            'cell_degrees': size,
+            'lat': lat.round(6).tolist(),
+            'lon': lon.round(6).tolist(),
+            'visits': totals('visits').tolist(),
+            'keys_sold': totals('keys').tolist(),
+            'key_amount': totals('amount').round(2).tolist(),
+        }
@@ -0,0 +1,25 @@
+import os
+import multiprocessing
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# More than one thread selects the gthread worker: a slow aggregation no longer blocks the
+# worker's other requests, which wait on the shared query pool instead (see executor.py)
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Load the app in the master so the dataset is mapped once before the workers fork
+preload_app = True
+
+# Workers publish appended data as shared snapshot generations instead of private copies
+os.environ.setdefault('DATA_SHARED', '1' if workers > 1 else '0')
+
+
+def when_ready(server):
+    # Parse (or map) the data in the master; forked workers inherit the mapping and never parse at startup
+    # With pushdown the performance routes read the analytics store instead, so only that is synced;
+    # the routes that do not push down load the rows in each worker on first use
+    from app import analytics_source, data_store
+    if analytics_source is not None:
+        analytics_source.get()
+    else:
+        data_store.get()
@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+
+NS_PER_DAY = 86400 * 10**9
+
+
+def dictionary_codes(values):
+    """Integer codes and their sorted vocabulary for a column
+
+    Categorical columns reuse their existing codes; anything else is factorized. Code order
+    always follows the sorted vocabulary so grouped output comes out ordered by name.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        if not (codes < 0).any():
+            categories = values.cat.categories
+            if categories.is_monotonic_increasing:
+                return codes, np.asarray(categories, dtype=object)
+            # Remap codes so they follow the sorted vocabulary
+            order = np.argsort(np.asarray(categories, dtype=object))
+            rank = np.empty(len(order), dtype=codes.dtype)
+            rank[order] = np.arange(len(order), dtype=codes.dtype)
+            return rank[codes], np.asarray(categories, dtype=object)[order]
+        values = values.astype(object)
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), sort=True)
+    return codes, np.asarray(uniques, dtype=object)
+
+
+def extend_vocabulary(vocabulary, values):
+    """(sorted vocabulary with the sorted, distinct values added, old code -> new code or None)
+
+    The code map is None when nothing was added, so existing codes stay valid as they are.
+    """
+    if len(vocabulary):
+        position = np.minimum(np.searchsorted(vocabulary, values), len(vocabulary) - 1)
+        values = values[vocabulary[position] != values]
+    if not len(values):
+        return vocabulary, None
+    at = np.searchsorted(vocabulary, values)
+    # Each existing code moves up by the number of values inserted before it
+    shift = np.cumsum(np.bincount(at, minlength=len(vocabulary) + 1))[:len(vocabulary)]
+    return np.insert(vocabulary, at, values), np.arange(len(vocabulary)) + shift
+
+
+class GroupedRangeIndex:
+    """Range lookups over an ascending array, overall or restricted to one integer group
+
+    The primary order is the array itself, so a value range is a contiguous slice found with
+    searchsorted. The secondary per-group order is a stable argsort of the group codes, which
+    keeps every group's positions (and therefore values) ascending; a value range inside one
+    group is then a contiguous slice of that permutation.
+    """
+
+    def __init__(self, values, groups, n_groups):
+        self.values = values
+        self.order = np.argsort(groups, kind='stable')
+        self.group_values = values[self.order]
+        self.offsets = np.zeros(n_groups + 1, dtype=np.int64)
+        np.cumsum(np.bincount(groups, minlength=n_groups), out=self.offsets[1:])
+
+    @classmethod
+    def from_arrays(cls, values, order, group_values, offsets):
+        """Rebuild an index from the arrays returned by to_arrays (e.g. memory-mapped from disk)"""
+        index = cls.__new__(cls)
+        index.values = values
+        index.order = order
+        index.group_values = group_values
+        index.offsets = offsets
+        return index
+
+    def to_arrays(self):
+        """The derived arrays; values are left out because the owner already stores them"""
+        return {'order': self.order, 'group_values': self.group_values, 'offsets': self.offsets}
+
+    def extend(self, values, moved, group_map, inserted, groups, n_groups):
+        """Index over values after entries were inserted, without sorting the existing ones again
+
+        moved holds the new position of every indexed entry (None if they kept theirs) and
+        group_map their new group code (None if unchanged); both must preserve order. inserted
+        and groups are the new entries' ascending positions and their group codes.
+        """
+        old_groups = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        if group_map is not None:
+            old_groups = group_map[old_groups]
+        positions = self.order if moved is None else moved[self.order]
+        # Group-major keys: the existing entries are already in key order, so the new ones are merged in
+        size = max(len(values), 1)
+        keys = old_groups.astype(np.int64) * size + positions
+        new_keys = np.sort(np.asarray(groups, dtype=np.int64) * size + inserted)
+        keys = np.insert(keys, np.searchsorted(keys, new_keys), new_keys)
+        order = keys % size
+        offsets = np.searchsorted(keys, np.arange(n_groups + 1, dtype=np.int64) * size).astype(np.int64)
+        return GroupedRangeIndex.from_arrays(values, order, values[order], offsets)
+
+    def __len__(self):
+        return len(self.values)
+
+    def window(self, lo=None, hi=None):
+        """Slice of positions whose value is in [lo, hi); None leaves that side unbounded"""
+        return slice(*self._bounds(self.values, lo, hi))
+
+    def group_window(self, group, lo=None, hi=None):
+        """Ascending positions of one group whose value is in [lo, hi)"""
+        start, stop = self.offsets[group], self.offsets[group + 1]
+        first, last = self._bounds(self.group_values[start:stop], lo, hi)
+        return self.order[start + first:start + last]
+
+    def lookup(self, group=None, lo=None, hi=None):
+        """Slice (all groups) or position array (one group) for a value range"""
+        if group is None:
+            return self.window(lo, hi)
+        return self.group_window(group, lo, hi)
+
+    @staticmethod
+    def _bounds(values, lo, hi):
+        first = 0 if lo is None else int(np.searchsorted(values, lo, side='left'))
+        last = len(values) if hi is None else int(np.searchsorted(values, hi, side='left'))
+        return first, max(first, last)
+
+
+class RowIndex:
+    """Timestamp and per-state index over the rows of a Timestamp-sorted BDM frame"""
+
+    def __init__(self, df, saved=None):
+        timestamps = df['Timestamp'].to_numpy(dtype='datetime64[ns]')
+        if saved is not None:
+            # Reuse a persisted index; only the timestamp view is taken from the frame
+            arrays, meta = saved
+            self.valid_rows = meta['valid_rows']
+            self.states = np.asarray(meta['states'], dtype=object)
+            self._index = GroupedRangeIndex.from_arrays(timestamps[:self.valid_rows].view(np.int64), **arrays)
+        else:
+            # NaT sorts last, so the indexed rows are the leading run of valid timestamps
+            self.valid_rows = int((~np.isnat(timestamps)).sum())
+            # A view, not a copy: a memory-mapped Timestamp column stays shared between processes
+            ns = timestamps[:self.valid_rows].view(np.int64)
+
+            state_codes, self.states = dictionary_codes(df['State'].iloc[:self.valid_rows])
+            self._index = GroupedRangeIndex(ns, state_codes, len(self.states))
+        self._state_codes = {state: code for code, state in enumerate(self.states)}
+
+    def to_arrays(self):
+        """(arrays, JSON metadata) that RowIndex(df, saved=...) accepts for the same frame"""
+        return self._index.to_arrays(), {'valid_rows': self.valid_rows, 'states': self.states.tolist()}
+
+    def extend(self, df, moved, inserted):
+        """Index over df, the indexed frame with rows inserted at the ascending positions inserted
+
+        moved holds the new position of every existing row, or None if they all kept theirs.
+        """
+        index = RowIndex.__new__(RowIndex)
+        timestamps = df['Timestamp'].to_numpy(dtype='datetime64[ns]')
+        index.valid_rows = self.valid_rows + int((~np.isnat(timestamps[inserted])).sum())
+        inserted = inserted[inserted < index.valid_rows]
+        states = np.asarray(df['State'].iloc[inserted], dtype=object)
+        index.states, group_map = extend_vocabulary(self.states, np.unique(states))
+        index._index = self._index.extend(timestamps[:index.valid_rows].view(np.int64), moved, group_map,
+                                          inserted, np.searchsorted(index.states, states), len(index.states))
+        index._state_codes = {state: code for code, state in enumerate(index.states)}
+        return index
+
+    def rows(self, start_day=None, end_day=None, state=None):
+        """Row positions between two inclusive day numbers, optionally for a single state
+
+        Returns a slice when no state is given and an ascending position array otherwise.
+        """
+        if state is not None and state not in self._state_codes:
+            return np.empty(0, dtype=np.int64)
+        lo = None if start_day is None else start_day * NS_PER_DAY
+        hi = None if end_day is None else (end_day + 1) * NS_PER_DAY
+        group = None if state is None else self._state_codes[state]
+        return self._index.lookup(group, lo, hi)
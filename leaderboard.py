@@ -0,0 +1,110 @@
+import numpy as np
+
+# Visit Status values behind the conversion metrics
+STATUS_RATES = {'conversion_rate': 'Key Purchased', 'not_interested_rate': 'Not Interested'}
+RANK_METRICS = ['visits', 'unique_merchants', 'keys_sold', 'key_amount'] + list(STATUS_RATES)
+ORDERS = ['top', 'bottom', 'both']
+
+
+def top_k(values, k, largest=True):
+    """Positions of the k largest (or smallest) values, best first, ties broken by position
+
+    np.partition finds the k-th value in linear time, so only the k winners are sorted.
+    """
+    k = min(k, len(values))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    keyed = -values if largest else values
+    if k < len(values):
+        kth = np.partition(keyed, k - 1)[k - 1]
+        better = np.flatnonzero(keyed < kth)
+        candidates = np.concatenate([better, np.flatnonzero(keyed == kth)[:k - len(better)]])
+    else:
+        candidates = np.arange(len(values))
+    return candidates[np.lexsort((candidates, keyed[candidates]))]
+
+
+def metric_values(cube, performance, metric, start_day=None, end_day=None, state=None):
+    """Per-BDM values of a ranking metric, aligned with the rows of a cube query result"""
+    if metric not in STATUS_RATES:
+        return performance[metric].to_numpy(dtype=np.float64)
+    status = np.flatnonzero(cube.statuses == STATUS_RATES[metric])
+    if not len(status):
+        return np.zeros(len(performance))
+    codes = np.searchsorted(cube.bdm_names, performance['BDM Name'].to_numpy(dtype=object))
+    counts = cube.status_counts(start_day, end_day, state)[codes, status[0]]
+    return counts / performance['visits'].to_numpy(dtype=np.float64)
+
+
+def _display(metric, value):
+    if metric in STATUS_RATES:
+        return round(float(value), 4)
+    if metric == 'key_amount':
+        return round(float(value), 2)
+    return int(value)
+
+
+def previous_window(start_day, end_day, monthly=False):
+    """The window just before [start_day, end_day], or None if unbounded
+
+    For a monthly filter that is the whole previous calendar month, whatever its length;
+    otherwise it is the span of the same length ending the day before start_day.
+    """
+    if start_day is None or end_day is None:
+        return None
+    if monthly:
+        month = np.datetime64(start_day, 'D').astype('datetime64[M]') - 1
+        return int(month.astype('datetime64[D]').astype(np.int64)), start_day - 1
+    return 2 * start_day - end_day - 1, start_day - 1
+
+
+def rank_entries(cube, metric, k=10, order='both', start_day=None, end_day=None, state=None, monthly=False):
+    """Top and/or bottom k BDMs by a metric, with rank, percentile and rank change
+
+    Ranks are competition ranks over the BDMs with visits in the window (1 = highest value).
+    The percentile is the share of those BDMs with a lower value, counting ties as half.
+    Rank change compares with the preceding window (see previous_window): positive means the
+    BDM moved up; it is None when the BDM had no visits then or the window is unbounded.
+    """
+    performance = cube.query(start_day, end_day, state)
+    names = performance['BDM Name'].to_numpy(dtype=object)
+    visits = performance['visits'].to_numpy()
+    values = metric_values(cube, performance, metric, start_day, end_day, state)
+    ordered = np.sort(values)
+
+    previous_ranks = {}
+    previous = previous_window(start_day, end_day, monthly)
+    if previous is not None:
+        before = cube.query(*previous, state)
+        before_values = metric_values(cube, before, metric, *previous, state)
+        before_sorted = np.sort(before_values)
+        ranks = len(before_sorted) - np.searchsorted(before_sorted, before_values, side='right') + 1
+        previous_ranks = dict(zip(before['BDM Name'], ranks.tolist()))
+
+    def entries(positions):
+        selected = values[positions]
+        ranks = len(ordered) - np.searchsorted(ordered, selected, side='right') + 1
+        below = np.searchsorted(ordered, selected, side='left')
+        ties = np.searchsorted(ordered, selected, side='right') - below
+        percentiles = (below + ties / 2) / len(ordered) * 100
+        result = []
+        for position, value, rank, percentile in zip(positions, selected, ranks, percentiles):
+            previous_rank = previous_ranks.get(names[position])
+            result.append({
+                'bdm': names[position],
+                'value': _display(metric, value),
+                'rank': int(rank),
+                'percentile': round(float(percentile), 1),
+                'previous_rank': previous_rank,
+                'rank_change': None if previous_rank is None else previous_rank - int(rank),
+                'visits': int(visits[position]),
+            })
+        return result
+
+    result = {'metric': metric, 'k': k, 'bdms': len(values),
+              'previous_window': None if previous is None else [str(np.datetime64(day, 'D')) for day in previous]}
+    if order in ('top', 'both'):
+        result['top'] = entries(top_k(values, k))
+    if order in ('bottom', 'both'):
+        result['bottom'] = entries(top_k(values, k, largest=False))
+    return result
@@ -0,0 +1,307 @@
+import io
+import codecs
+import functools
+import logging
+import numpy as np
+import pandas as pd
+
+from dataset import encode_categoricals, concat_frames
+from cube import DailyCube
+import quality
+from quality import SeenSubmissions, drop_duplicate_submissions, merge_reports, run_rules
+
+log = logging.getLogger(__name__)
+
+# Encodings tried in order, both for whole-file reads and for sniffing a streamed file
+ENCODINGS = ['utf-8', 'latin-1', 'cp1252', 'ISO-8859-1']
+
+# Rows whose timestamp is missing or unreadable are kept, dated to this day
+DEFAULT_TIMESTAMP = pd.Timestamp('2025-01-01')
+
+# Day-first timestamp layouts seen in the sheet exports, checked against a sample of each load
+TIMESTAMP_FORMATS = [
+    '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y',
+    '%d-%m-%Y %H:%M:%S', '%d-%m-%Y %H:%M', '%d-%m-%Y',
+    '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d',
+]
+
+def infer_timestamp_formats(values, sample_size=2000):
+    """Formats from TIMESTAMP_FORMATS that match an evenly spaced sample, most common first"""
+    if len(values) == 0:
+        return []
+    step = max(len(values) // sample_size, 1)
+    sample = values[::step][:sample_size]
+    matches = []
+    for fmt in TIMESTAMP_FORMATS:
+        matched = int(pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum())
+        if matched:
+            matches.append((matched, fmt))
+    # Stable sort keeps TIMESTAMP_FORMATS order between equally common formats
+    return [fmt for _, fmt in sorted(matches, key=lambda match: -match[0])]
+
+# Fixed-width fields understood by the fast parser; anything else goes through strptime
+FIELD_WIDTHS = {'%d': 2, '%m': 2, '%Y': 4, '%H': 2, '%M': 2, '%S': 2}
+DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+def _fixed_width_layout(fmt):
+    """(width, {directive: (start, stop)}, {position: literal code point}) or None if not fixed width"""
+    fields, literals, position, i = {}, {}, 0, 0
+    while i < len(fmt):
+        token = fmt[i:i + 2]
+        if token in FIELD_WIDTHS:
+            fields[token] = (position, position + FIELD_WIDTHS[token])
+            position += FIELD_WIDTHS[token]
+            i += 2
+        elif fmt[i] == '%':
+            return None
+        else:
+            literals[position] = ord(fmt[i])
+            position += 1
+            i += 1
+    return position, fields, literals
+
+def _days_from_civil(year, month, day):
+    """Days since 1970-01-01 for proleptic Gregorian dates (vectorized)"""
+    year = year - (month <= 2)
+    era = np.floor_divide(year, 400)
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+def parse_fixed_width(values, fmt):
+    """Parse zero-padded timestamps of one layout with array arithmetic; non-matching values become NaT"""
+    width, fields, literals = _fixed_width_layout(fmt)
+    # One extra character column tells longer strings apart; non-strings fail the literal checks
+    chars = np.asarray(values, dtype=object).astype(f'U{width + 1}').view(np.uint32).reshape(-1, width + 1)
+    valid = (chars[:, width] == 0) & (chars[:, width - 1] != 0)
+    for position, code in literals.items():
+        valid &= chars[:, position] == code
+    digits = chars[:, :width].astype(np.int64) - ord('0')
+    
+    def field(directive, default):
+        nonlocal valid
+        number = np.full(len(chars), default, dtype=np.int64)
+        if directive in fields:
+            start, stop = fields[directive]
+            number[:] = 0
+            for position in range(start, stop):
+                valid &= (digits[:, position] >= 0) & (digits[:, position] <= 9)
+                number = number * 10 + digits[:, position]
+        return number
+    
+    year, month, day = field('%Y', 1970), field('%m', 1), field('%d', 1)
+    hour, minute, second = field('%H', 0), field('%M', 0), field('%S', 0)
+    leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+    days_in_month = DAYS_IN_MONTH[np.clip(month, 0, 12)] + ((month == 2) & leap)
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month)
+    valid &= (hour < 24) & (minute < 60) & (second < 60)
+    # Whole years datetime64[ns] can hold; anything else would overflow the multiply below
+    valid &= (year >= 1678) & (year <= 2261)
+    
+    seconds = ((_days_from_civil(year, month, day) * 24 + hour) * 60 + minute) * 60 + second
+    parsed = (np.where(valid, seconds, 0) * 10**9).astype('datetime64[ns]')
+    parsed[~valid] = np.datetime64('NaT')
+    return parsed
+
+def parse_timestamps(series, sample_size=2000):
+    """Parse a Timestamp column one inferred format at a time, falling back per element for the rest
+
+    Each inferred format first gets a fixed-width arithmetic pass, then the rows it still
+    misses (e.g. single-digit days) get a vectorized strptime pass. Only rows no format
+    matched reach the per-element parser. Returns the parsed datetime64 Series and how
+    many rows each path handled.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series, {}
+    
+    values = series.to_numpy(dtype=object)
+    parsed = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+    pending = np.flatnonzero(pd.notna(values))
+    counts = {'missing': len(values) - len(pending)}
+    formats = infer_timestamp_formats(values[pending], sample_size)
+    
+    def apply(result, label):
+        nonlocal pending
+        matched = ~np.isnat(result)
+        if matched.any():
+            parsed[pending[matched]] = result[matched]
+            counts[label] = int(matched.sum())
+        pending = pending[~matched]
+    
+    for fmt in formats:
+        if len(pending) and _fixed_width_layout(fmt) is not None:
+            apply(parse_fixed_width(values[pending], fmt), f'fixed {fmt}')
+    for fmt in formats:
+        if len(pending):
+            apply(pd.to_datetime(values[pending], format=fmt, errors='coerce').to_numpy(dtype='datetime64[ns]'),
+                  f'strptime {fmt}')
+    
+    # Whatever no common format matched goes through the slow per-element parser
+    if len(pending):
+        apply(pd.to_datetime(pd.Series(values[pending]).astype(str), errors='coerce', dayfirst=True,
+                             format='mixed').to_numpy(dtype='datetime64[ns]'), 'fallback')
+        counts['unparsed'] = len(pending)
+    
+    return pd.Series(parsed, index=series.index, name=series.name), counts
+
+def read_csv_with_fallback(source):
+    """Read a CSV path or raw bytes, trying several encodings; returns None if none work"""
+    # Try to read the CSV file with different encodings
+    for encoding in ENCODINGS:
+        try:
+            log.debug("Trying to read CSV with %s encoding", encoding)
+            data = io.BytesIO(source) if isinstance(source, bytes) else source
+            df = pd.read_csv(data, encoding=encoding, low_memory=False)
+            log.debug("Successfully read CSV with %s encoding", encoding)
+            return df
+        except UnicodeDecodeError:
+            log.debug("Failed to read with %s encoding", encoding)
+            continue
+        except Exception as e:
+            log.warning("Error reading CSV with %s encoding: %s", encoding, e)
+            continue
+    
+    return None
+
+def parse_timestamp_column(df):
+    """Parse Timestamp, filling missing or unreadable values with DEFAULT_TIMESTAMP so no row is dropped"""
+    df['Timestamp'], parse_counts = parse_timestamps(df['Timestamp'])
+    log.debug("Timestamp parsing paths: %s", parse_counts)
+    missing = int(df['Timestamp'].isna().sum())
+    if missing:
+        df['Timestamp'] = df['Timestamp'].fillna(DEFAULT_TIMESTAMP)
+    return df, missing
+
+# Timestamps come first: later rules compare them and the date columns are derived from them
+CLEANING_RULES = [('parse_timestamps', parse_timestamp_column)] + quality.CLEANING_RULES
+
+def clean_data(df, rules=None, seen=None):
+    """Validate and clean freshly read CSV rows; returns None if required columns are missing
+
+    rules defaults to CLEANING_RULES; the rows each rule affected and its time are left in
+    df.attrs['quality']. seen (a quality.SeenSubmissions) carries the rows of earlier chunks
+    or loads of the same file, so a submission repeated across them is dropped as well.
+    """
+    total_rows = len(df)
+    log.debug("Column names: %s", df.columns.tolist())
+    
+    # Verify required columns exist
+    required_columns = ['Timestamp', 'BDM Name', 'Shop Name', 'State', 'Keys Sold', 'Key Amount']
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    
+    if missing_columns:
+        log.warning("Missing required columns: %s", missing_columns)
+        # If missing required columns, try to be flexible with column names by checking for similar ones
+        for missing_col in missing_columns.copy():
+            for col in df.columns:
+                if missing_col.lower() in col.lower():
+                    log.warning("Found alternative column '%s' for '%s'", col, missing_col)
+                    df[missing_col] = df[col]
+                    missing_columns.remove(missing_col)
+                    break
+    
+    if missing_columns:
+        log.error("Still missing columns after attempting to find alternatives: %s", missing_columns)
+        return None
+    
+    # Parse, check and fill column by column; each rule replaces whole columns of this chunk
+    rules = CLEANING_RULES if rules is None else rules
+    if seen is not None:
+        rules = [(name, functools.partial(rule, seen=seen) if rule is drop_duplicate_submissions else rule)
+                 for name, rule in rules]
+    df, report = run_rules(df, rules)
+    log.debug("Cleaning rules: %s", report['rules'])
+    
+    # Create date-related columns
+    df['Month'] = df['Timestamp'].dt.month_name()
+    df['Week'] = df['Timestamp'].dt.isocalendar().week
+    df['Year'] = df['Timestamp'].dt.year
+    # Midnight of the visit's day: datetime64 rather than date objects, so snapshots can map it
+    df['Date'] = df['Timestamp'].dt.normalize()
+    
+    # Summary statistics scan every column, so only compute them when someone will read them
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Unique BDMs: %d, shops: %d, states: %d", df['BDM Name'].nunique(),
+                  df['Shop Name'].nunique(), df['State'].nunique())
+        log.debug("Total keys sold: %s, total sales amount: %s", df['Keys Sold'].sum(), df['Key Amount'].sum())
+    
+    # Only duplicate submissions may be dropped
+    if len(df) != total_rows:
+        log.info("Dropped %d duplicate rows of %d", total_rows - len(df), total_rows)
+    
+    # Keep rows in timestamp order so the snapshot can be indexed without re-sorting
+    df = df.sort_values('Timestamp', kind='stable', ignore_index=True)
+    
+    # Store BDM, shop, state and city names, visit statuses and transaction IDs as integer codes
+    # with shared vocabularies
+    df = encode_categoricals(df)
+    # The per-rule counts travel with the rows, so every load can report on its own cleaning
+    df.attrs['quality'] = report
+    return df
+
+def detect_encoding(file_path, sample_size=1 << 20):
+    """Pick the first encoding that decodes a leading byte sample of the file"""
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+    for encoding in ENCODINGS:
+        try:
+            # Incremental decode tolerates a multi-byte character cut off at the end of the sample
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return ENCODINGS[-1]
+
+def iter_clean_chunks(file_path, chunk_rows, encoding, seen=None):
+    """Yield cleaned, dictionary-encoded chunks of at most chunk_rows rows
+
+    Duplicate submissions are dropped across chunks, not just within each one; pass seen to
+    collect the rows kept.
+    """
+    seen = SeenSubmissions() if seen is None else seen
+    reader = pd.read_csv(file_path, encoding=encoding, chunksize=chunk_rows, low_memory=False)
+    with reader:
+        for chunk in reader:
+            cleaned = clean_data(chunk, seen=seen)
+            if cleaned is None:
+                raise ValueError("Required columns are missing from the data file")
+            yield cleaned
+
+def load_csv_streaming(file_path, chunk_rows=100000):
+    """Read the CSV in fixed-size chunks, cleaning each one and aggregating it as it arrives
+
+    Only one raw chunk is alive at a time; what accumulates is the compact encoded rows and
+    one small cube per chunk. Returns (frame, cube), or None if the file cannot be read.
+    """
+    encoding = detect_encoding(file_path)
+    log.info("Streaming CSV with %s encoding in chunks of %d rows", encoding, chunk_rows)
+    
+    for attempt in [encoding] + [e for e in ENCODINGS if e != encoding]:
+        frames, cubes = [], []
+        try:
+            for chunk in iter_clean_chunks(file_path, chunk_rows, attempt):
+                frames.append(chunk)
+                cubes.append(DailyCube.build(chunk))
+            break
+        except UnicodeDecodeError:
+            # The sample looked fine but a later chunk did not; restart with the next encoding
+            log.warning("Failed to stream with %s encoding", attempt)
+            continue
+        except ValueError as e:
+            log.error("Error streaming CSV: %s", e)
+            return None
+    else:
+        return None
+    
+    if not frames:
+        return None
+    
+    report = merge_reports(*(frame.attrs.get('quality') for frame in frames))
+    df = concat_frames(*frames)
+    if not df['Timestamp'].is_monotonic_increasing:
+        df = df.sort_values('Timestamp', kind='stable', ignore_index=True)
+    df.attrs['quality'] = report
+    cube = cubes[0] if len(cubes) == 1 else DailyCube.merge(*cubes)
+    log.info("Streamed %d rows in %d chunks", len(df), len(frames))
+    return df, cube
@@ -0,0 +1,196 @@
+import time
+import logging
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# Text dimensions that are trimmed and case-folded, so 'Assam ' and 'ASSAM' are one state
+NAME_COLUMNS = ['State', 'BDM Name']
+
+# Missing text is filled with this, after normalizing so it keeps its spelling
+MISSING_TEXT = 'Unknown'
+TEXT_COLUMNS = ['BDM Name', 'Shop Name', 'State']
+
+# Coordinates outside these ranges, or exactly (0, 0), are blanked rather than plotted
+LATITUDE_RANGE = (-90.0, 90.0)
+LONGITUDE_RANGE = (-180.0, 180.0)
+
+# Added to cleaned rows after the rules run (or, for Source, once loaded); left out of row hashes
+DERIVED_COLUMNS = ['Month', 'Week', 'Year', 'Date', 'Source']
+
+# Hash given to a missing value whatever column dtype the chunk it came in was read with
+_NULL_HASH = np.uint64(0)
+
+
+def normalize_names(df):
+    """Trim, collapse inner whitespace and upper-case the state and BDM names"""
+    changed = np.zeros(len(df), dtype=bool)
+    for column in NAME_COLUMNS:
+        # Normalize each distinct spelling once rather than every row
+        codes, uniques = pd.factorize(df[column])
+        if not len(uniques):
+            continue
+        original = pd.Index(uniques).astype(str)
+        cleaned = original.str.split().str.join(' ').str.upper()
+        lookup = np.append(cleaned.to_numpy(dtype=object), None)
+        modified = np.append(cleaned != original, False)
+        df[column] = lookup[codes]
+        changed |= modified[codes]
+    return df, int(changed.sum())
+
+
+def normalize_name(value):
+    """A state or BDM name given as a filter, spelled the way normalize_names stores it"""
+    if value == MISSING_TEXT:
+        # Filled in after normalizing, so it keeps this spelling
+        return value
+    return ' '.join(str(value).split()).upper()
+
+
+def fill_missing_text(df):
+    """Fill missing BDM, shop and state names with 'Unknown'"""
+    missing = np.zeros(len(df), dtype=bool)
+    for column in TEXT_COLUMNS:
+        nulls = df[column].isna().to_numpy()
+        if nulls.any():
+            missing |= nulls
+            df[column] = df[column].fillna(MISSING_TEXT)
+    return df, int(missing.sum())
+
+
+def coerce_numbers(df):
+    """Keys Sold and Key Amount as numbers, 0 where blank; counts values that were not numbers"""
+    invalid = np.zeros(len(df), dtype=bool)
+    for column, dtype in [('Keys Sold', int), ('Key Amount', float)]:
+        numbers = pd.to_numeric(df[column], errors='coerce')
+        invalid |= (numbers.isna() & df[column].notna()).to_numpy()
+        df[column] = numbers.fillna(0).astype(dtype)
+    return df, int(invalid.sum())
+
+
+def submission_hashes(df):
+    """64-bit hash of each row over the columns the data file gave it
+
+    Chunks of one file can be read with different dtypes for the same column (ints as floats
+    once a value is blank, text as categories once cleaned), so numbers are hashed as floats,
+    categories as their values and every missing value alike.
+    """
+    columns = {}
+    for column in df.columns:
+        if column in DERIVED_COLUMNS:
+            continue
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+            values = values.astype(np.float64)
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+        columns[column] = np.where(values.isna().to_numpy(), _NULL_HASH, hashes)
+    # Column order does not matter: an appended chunk is read with the file's header
+    frame = pd.DataFrame({column: columns[column] for column in sorted(columns)}, index=df.index)
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+class SeenSubmissions:
+    """Hashes of the rows kept so far, so a submission repeated in a later chunk or append is dropped too"""
+
+    def __init__(self, hashes=()):
+        # Sorted and unique; replaced rather than modified, so copies can share it
+        self.hashes = np.unique(np.asarray(hashes, dtype=np.uint64))
+
+    def copy(self):
+        seen = SeenSubmissions()
+        seen.hashes = self.hashes
+        return seen
+
+    def contains(self, hashes):
+        position = np.minimum(np.searchsorted(self.hashes, hashes), max(len(self.hashes) - 1, 0))
+        return self.hashes[position] == hashes if len(self.hashes) else np.zeros(len(hashes), dtype=bool)
+
+    def add(self, hashes):
+        self.hashes = np.union1d(self.hashes, hashes)
+
+
+def drop_duplicate_submissions(df, seen=None):
+    """Drop rows identical in every column to an earlier one, i.e. a form submitted twice
+
+    seen (a SeenSubmissions) extends "earlier" to rows of previous chunks or loads of the
+    same file, and is updated with the rows kept here.
+    """
+    hashes = submission_hashes(df)
+    duplicated = pd.Series(hashes).duplicated().to_numpy()
+    if seen is not None:
+        duplicated |= seen.contains(hashes)
+        seen.add(hashes[~duplicated])
+    if not duplicated.any():
+        return df, 0
+    return df[~duplicated].reset_index(drop=True), int(duplicated.sum())
+
+
+def check_coordinates(df):
+    """Blank latitudes and longitudes that are out of range, unreadable or exactly (0, 0)"""
+    if 'Latitude' not in df or 'Longitude' not in df:
+        return df, 0
+    lat = pd.to_numeric(df['Latitude'], errors='coerce').to_numpy(dtype=np.float64)
+    lon = pd.to_numeric(df['Longitude'], errors='coerce').to_numpy(dtype=np.float64)
+    given = df['Latitude'].notna().to_numpy() | df['Longitude'].notna().to_numpy()
+    with np.errstate(invalid='ignore'):
+        valid = ((lat >= LATITUDE_RANGE[0]) & (lat <= LATITUDE_RANGE[1])
+                 & (lon >= LONGITUDE_RANGE[0]) & (lon <= LONGITUDE_RANGE[1]) & ((lat != 0) | (lon != 0)))
+    df['Latitude'] = np.where(valid, lat, np.nan)
+    df['Longitude'] = np.where(valid, lon, np.nan)
+    return df, int((given & ~valid).sum())
+
+
+def flag_impossible_amounts(df):
+    """Count rows with negative keys or amounts, or an amount without any keys sold; rows are kept"""
+    keys = df['Keys Sold'].to_numpy()
+    amount = df['Key Amount'].to_numpy()
+    flagged = int(((keys < 0) | (amount < 0) | ((keys == 0) & (amount > 0))).sum())
+    if flagged:
+        log.warning("%d rows have impossible key sales", flagged)
+    return df, flagged
+
+
+# Applied in order by clean_data after the timestamps are parsed; each rule takes the frame and
+# returns (frame, rows affected), replacing whole columns rather than copying the frame
+CLEANING_RULES = [
+    ('normalize_names', normalize_names),
+    ('fill_missing_text', fill_missing_text),
+    ('coerce_numbers', coerce_numbers),
+    ('check_coordinates', check_coordinates),
+    ('drop_duplicate_submissions', drop_duplicate_submissions),
+    ('flag_impossible_amounts', flag_impossible_amounts),
+]
+
+
+def run_rules(df, rules, report=None):
+    """Apply (name, rule) pairs in order, adding rows affected and time taken per rule to report"""
+    report = new_report() if report is None else report
+    report['rows_in'] += len(df)
+    for name, rule in rules:
+        started = time.perf_counter()
+        df, affected = rule(df)
+        entry = report['rules'].setdefault(name, {'rows': 0, 'seconds': 0.0})
+        entry['rows'] += affected
+        entry['seconds'] += time.perf_counter() - started
+    report['rows_out'] += len(df)
+    return df, report
+
+
+def new_report():
+    return {'rows_in': 0, 'rows_out': 0, 'rules': {}}
+
+
+def merge_reports(*reports):
+    """Sum per-rule counts and timings of reports from several chunks or loads; None ones are skipped"""
+    merged = new_report()
+    for report in reports:
+        if not report:
+            continue
+        merged['rows_in'] += report['rows_in']
+        merged['rows_out'] += report['rows_out']
+        for name, entry in report['rules'].items():
+            total = merged['rules'].setdefault(name, {'rows': 0, 'seconds': 0.0})
+            total['rows'] += entry['rows']
+            total['seconds'] += entry['seconds']
+    return merged
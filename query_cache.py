@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """Bounded LRU cache with a TTL for computed query results, scoped to one dataset version
+
+    Entries are tagged with the dataset version they were computed from. The first lookup
+    against a newer version drops everything, so a reload invalidates the cache without
+    any explicit hook.
+    """
+
+    def __init__(self, maxsize=256, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, version, key):
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key) if version == self._version else None
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, version, key, value):
+        with self._lock:
+            self._check_version(version)
+            # A slow computation may finish after a reload; don't let it pollute the new version
+            if version != self._version:
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def _check_version(self, version):
+        if self._version is None or (version is not None and version > self._version):
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
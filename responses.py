@@ -0,0 +1,45 @@
+import gzip
+import json
+import hashlib
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library encoder gives the same JSON, just slower
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Optional: clients that accept gzip still get compressed bodies
+    brotli = None
+
+# Bodies smaller than this are sent as they are; compressing them costs more than it saves
+MIN_COMPRESS_BYTES = 1024
+
+ENCODINGS = (['br'] if brotli is not None else []) + ['gzip']
+
+
+def dumps(value):
+    """Compact UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def choose_encoding(accept_encodings):
+    """Best compression the client accepts (a werkzeug Accept header), or None for identity"""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(body, encoding):
+    """Body compressed with the given content coding; None or a tiny body leaves it as is"""
+    if encoding is None or len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    if encoding == 'br':
+        return brotli.compress(body, quality=5), 'br'
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, compresslevel=6, mtime=0), 'gzip'
+
+
+def make_etag(*parts):
+    """Short stable tag for the given JSON-serializable parts"""
+    return hashlib.blake2b(json.dumps(parts, default=str).encode('utf-8'), digest_size=12).hexdigest()
@@ -0,0 +1,290 @@
+import os
+import json
+import shutil
+import uuid
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server only
+    fcntl = None
+
+from dataset import file_signature
+from cube import DailyCube
+from indexes import RowIndex
+from geo import GeoIndex
+
+log = logging.getLogger(__name__)
+
+# Bump whenever the cleaned frame layout produced by load_data() changes
+SNAPSHOT_FORMAT = 10
+
+
+def snapshot_root(data_file):
+    """Directory next to the data file that holds its columnar snapshots"""
+    directory, name = os.path.split(os.path.abspath(data_file))
+    return os.path.join(directory, f'.{name}.snapshot')
+
+
+def _snapshot_name(signature):
+    mtime_ns, size = signature
+    return f'v{SNAPSHOT_FORMAT}-{mtime_ns}-{size}'
+
+
+def _encode_vocab(values):
+    """JSON-safe vocabulary and its value type, or None if the values cannot be stored"""
+    values = list(values)
+    if all(isinstance(value, str) for value in values):
+        return values, 'str'
+    if all(isinstance(value, datetime.date) for value in values):
+        return [value.isoformat() for value in values], 'date'
+    return None
+
+
+def _decode_vocab(spec):
+    if spec['vocab_type'] == 'date':
+        return [datetime.date.fromisoformat(value) for value in spec['vocab']]
+    return spec['vocab']
+
+
+def _encode_column(series):
+    """Turn a column into (kind, arrays, extra metadata) that can be saved as plain .npy files"""
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        # Already dictionary encoded: store the codes and the categories as they are
+        vocab = _encode_vocab(dtype.categories)
+        if vocab is None:
+            return None
+        codes = series.cat.codes.to_numpy()
+        return 'categorical', {'codes': codes}, {'vocab': vocab[0], 'vocab_type': vocab[1]}
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+        if not hasattr(dtype, 'numpy_dtype'):
+            return None
+        # Nullable numeric columns such as the UInt32 ISO week: plain values plus a null mask
+        data = series.to_numpy(dtype=dtype.numpy_dtype, na_value=0)
+        return 'masked', {'data': data, 'mask': series.isna().to_numpy()}, {'dtype': str(dtype)}
+    if dtype != object:
+        return 'numeric', {'data': series.to_numpy()}, {}
+
+    # Any other object column is dictionary encoded: int32 codes plus a JSON vocabulary. Unlike
+    # categorical and numeric columns it is rebuilt in every process that reads the snapshot.
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    vocab = _encode_vocab(uniques)
+    if vocab is None:
+        return None
+    return 'dictionary', {'codes': codes.astype(np.int32)}, {'vocab': vocab[0], 'vocab_type': vocab[1]}
+
+
+def _decode_column(directory, index, spec):
+    kind = spec['kind']
+    if kind == 'numeric':
+        return np.load(os.path.join(directory, f'{index}.data.npy'), mmap_mode='r')
+    if kind == 'masked':
+        dtype = pd.api.types.pandas_dtype(spec['dtype'])
+        data = np.load(os.path.join(directory, f'{index}.data.npy'), mmap_mode='r')
+        mask = np.load(os.path.join(directory, f'{index}.mask.npy'), mmap_mode='r')
+        array_type = dtype.construct_array_type()
+        if issubclass(array_type, (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)):
+            # Wraps the mapped values and mask without copying them
+            return array_type(data.view(np.ndarray), mask.view(np.ndarray))
+        data = pd.array(np.array(data), dtype=dtype)
+        if mask.any():
+            data[mask] = pd.NA
+        return data
+
+    codes = np.load(os.path.join(directory, f'{index}.codes.npy'), mmap_mode='r')
+    vocab = _decode_vocab(spec)
+    if kind == 'categorical':
+        # Codes were saved in pandas' own code dtype, so skipping validation also skips the copy
+        return pd.Categorical.from_codes(codes.view(np.ndarray), categories=vocab, validate=False)
+
+    # Code -1 marks a missing value; it indexes the trailing NaN slot
+    lookup = np.empty(len(vocab) + 1, dtype=object)
+    lookup[:len(vocab)] = vocab
+    lookup[-1] = np.nan
+    return lookup[codes]
+
+
+def _load_arrays(directory, prefix, names):
+    return {name: np.load(os.path.join(directory, f'{prefix}.{name}.npy'), mmap_mode='r') for name in names}
+
+
+def _save_arrays(directory, prefix, arrays):
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f'{prefix}.{name}.npy'), np.asarray(array), allow_pickle=False)
+    return list(arrays)
+
+
+def _share_vocabularies(vocabularies, df):
+    """Replace cube vocabularies holding the same values as a categorical column with a reference to it
+
+    Saves storing (and, once loaded, holding) the shop names a second time: the cube's sorted
+    vocabulary is rebuilt by sorting the column's categories, which shares their string objects.
+    """
+    shared = {}
+    for name, vocab in vocabularies.items():
+        shared[name] = vocab
+        for column in df.columns:
+            dtype = df[column].dtype
+            if (isinstance(dtype, pd.CategoricalDtype) and len(dtype.categories) == len(vocab)
+                    and sorted(dtype.categories) == vocab):
+                shared[name] = {'column': column}
+                break
+    return shared
+
+
+def read_snapshot_parts(data_file):
+    """Return (frame, cube, row index, geo index) from a snapshot matching the data file, or None
+
+    Every array is memory-mapped, so processes reading the same snapshot share one copy of
+    it in the page cache. The cube and indexes are None if the snapshot was written without them.
+    """
+    signature = file_signature(data_file)
+    if signature is None:
+        return None
+    directory = os.path.join(snapshot_root(data_file), _snapshot_name(signature))
+    meta_path = os.path.join(directory, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        columns = {}
+        for index, spec in enumerate(meta['columns']):
+            columns[spec['name']] = _decode_column(directory, index, spec)
+        # copy=False keeps the numeric columns as read-only views over the memory-mapped files
+        df = pd.DataFrame(columns, copy=False)
+        if 'quality' in meta:
+            df.attrs['quality'] = meta['quality']
+
+        cube = row_index = geo_index = None
+        if 'cube' in meta:
+            vocabularies = {name: sorted(df[vocab['column']].cat.categories) if isinstance(vocab, dict) else vocab
+                            for name, vocab in meta['cube']['vocabularies'].items()}
+            cube = DailyCube.from_arrays(_load_arrays(directory, 'cube', meta['cube']['arrays']), vocabularies)
+        if 'index' in meta:
+            row_index = RowIndex(df, saved=(_load_arrays(directory, 'index', meta['index']['arrays']),
+                                            meta['index']['meta']))
+        if 'geo' in meta:
+            geo_index = GeoIndex(df, saved=(_load_arrays(directory, 'geo', meta['geo']['arrays']), meta['geo']['meta']))
+        log.info("Loaded snapshot %s with shape %s", directory, df.shape)
+        return df, cube, row_index, geo_index
+    except Exception as e:
+        log.warning("Ignoring unreadable snapshot %s: %s", directory, e)
+        return None
+
+
+def write_snapshot(df, data_file, signature, cube=None, row_index=None, geo_index=None):
+    """Persist the cleaned frame (and optionally its cube and indexes) keyed on the source file's signature"""
+    if signature is None:
+        return False
+    root = snapshot_root(data_file)
+    final_dir = os.path.join(root, _snapshot_name(signature))
+    if os.path.exists(final_dir):
+        return True
+
+    tmp_dir = os.path.join(root, f'tmp-{os.getpid()}-{uuid.uuid4().hex}')
+    try:
+        os.makedirs(tmp_dir)
+        specs = []
+        for index, name in enumerate(df.columns):
+            encoded = _encode_column(df[name])
+            if encoded is None:
+                log.warning("Column '%s' cannot be stored in a snapshot, skipping it", name)
+                return False
+            kind, arrays, extra = encoded
+            for suffix, array in arrays.items():
+                np.save(os.path.join(tmp_dir, f'{index}.{suffix}.npy'), array, allow_pickle=False)
+            specs.append({'name': name, 'kind': kind, **extra})
+
+        meta = {'format': SNAPSHOT_FORMAT, 'signature': list(signature), 'rows': len(df), 'columns': specs}
+        if df.attrs.get('quality') is not None:
+            # The cleaning report of the parse the snapshot came from
+            meta['quality'] = df.attrs['quality']
+        if cube is not None:
+            arrays, vocabularies = cube.to_arrays()
+            meta['cube'] = {'arrays': _save_arrays(tmp_dir, 'cube', arrays),
+                            'vocabularies': _share_vocabularies(vocabularies, df)}
+        if row_index is not None:
+            arrays, index_meta = row_index.to_arrays()
+            meta['index'] = {'arrays': _save_arrays(tmp_dir, 'index', arrays), 'meta': index_meta}
+        if geo_index is not None:
+            arrays, geo_meta = geo_index.to_arrays()
+            meta['geo'] = {'arrays': _save_arrays(tmp_dir, 'geo', arrays), 'meta': geo_meta}
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+        # Publish atomically; another worker may have won the race, which is fine
+        try:
+            os.rename(tmp_dir, final_dir)
+        except OSError:
+            return os.path.exists(final_dir)
+        log.info("Wrote snapshot %s", final_dir)
+
+        # Drop snapshots of older versions of the file
+        for entry in os.listdir(root):
+            if entry != os.path.basename(final_dir) and not entry.startswith(('tmp-', '.')):
+                shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+        return True
+    except Exception:
+        log.exception("Error writing snapshot")
+        return False
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# flock() excludes other processes; this excludes other threads of the same one
+_thread_lock = threading.RLock()
+
+
+@contextmanager
+def snapshot_lock(data_file):
+    """Hold an exclusive cross-process lock on the data file's snapshots
+
+    Worker processes take it around parsing, so the first one parses and writes the snapshot
+    while the rest wait and then map what it wrote. Not reentrant across processes: do not
+    nest it. Where fcntl is unavailable it only excludes threads.
+    """
+    with _thread_lock:
+        if fcntl is None:
+            yield
+            return
+        root = snapshot_root(data_file)
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, '.lock'), 'a+b') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class SnapshotPublisher:
+    """Publishes dataset generations as shared snapshots for DatasetStore
+
+    A generation is the snapshot for one data file signature. Whichever process first builds
+    a new generation (by appending rows) writes it; the others find it published and map it.
+    """
+
+    def __init__(self, data_file):
+        self.data_file = data_file
+
+    def published(self, signature):
+        directory = os.path.join(snapshot_root(self.data_file), _snapshot_name(signature))
+        return os.path.exists(os.path.join(directory, 'meta.json'))
+
+    def publish(self, dataset):
+        """Write the dataset as the generation for its signature; True once it is available"""
+        if dataset.signature is None or file_signature(self.data_file) != dataset.signature:
+            return False
+        with snapshot_lock(self.data_file):
+            if self.published(dataset.signature):
+                return True
+            return write_snapshot(dataset.frame, self.data_file, dataset.signature,
+                                  cube=dataset.cube, row_index=dataset.index, geo_index=dataset.geo)
@@ -0,0 +1,147 @@
+import os
+import glob
+import time
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from cube import DailyCube
+from dataset import concat_frames, file_signature
+from loader import load_csv_streaming
+from metrics import LOAD_SECONDS
+from quality import merge_reports
+from snapshot import read_snapshot_parts, snapshot_lock, write_snapshot
+
+log = logging.getLogger(__name__)
+
+# Column naming the file each visit row was read from
+SOURCE_COLUMN = 'Source'
+
+
+def is_multi_source(path):
+    """True when DATA_FILE names a directory or a glob pattern of CSV files rather than one file"""
+    return os.path.isdir(path) or glob.has_magic(path)
+
+
+def source_files(path):
+    """{source name: file path} for every CSV file the directory or pattern covers, in name order
+
+    Names are paths relative to the files' common directory, so files of the same name in
+    different subdirectories stay apart.
+    """
+    pattern = os.path.join(path, '*.csv') if os.path.isdir(path) else path
+    files = sorted(file for file in glob.glob(pattern) if os.path.isfile(file))
+    if not files:
+        return {}
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(file)) for file in files])
+    return {os.path.relpath(os.path.abspath(file), root).replace(os.sep, '/'): file for file in files}
+
+
+def sources_signature(path):
+    """((name, mtime, size), ...) over every source file, or None if there are none; changes with any file"""
+    signatures = []
+    for name, file in source_files(path).items():
+        signature = file_signature(file)
+        if signature is not None:
+            signatures.append((name,) + signature)
+    return tuple(signatures) or None
+
+
+def data_signature(path):
+    """Signature of DATA_FILE, whether it names one file or several"""
+    return sources_signature(path) if is_multi_source(path) else file_signature(path)
+
+
+def _with_source(df, name):
+    """The frame with a single-valued categorical Source column naming the file it came from"""
+    source = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), categories=[name])
+    return df.assign(**{SOURCE_COLUMN: source})
+
+
+def _parse_source(file_path, name, chunk_rows, snapshot):
+    """Parse one source file (in a pool process); returns (frame, cube), or None once its snapshot is written
+
+    The snapshot is the same one single-file mode writes for the file, without a Source
+    column: the name depends on how DATA_FILE is set, so it is added only once loaded. The
+    snapshot lock keeps processes loading the same file from parsing it twice: a waiter finds
+    the snapshot already written and returns straight away.
+    """
+    if not snapshot:
+        return _load_source(file_path, name, chunk_rows)
+    with snapshot_lock(file_path):
+        signature = file_signature(file_path)
+        if read_snapshot_parts(file_path) is not None:
+            return None
+        parsed = _load_source(file_path, name, chunk_rows)
+        # Only snapshot if the file did not change while we were parsing it
+        if (parsed is not None and file_signature(file_path) == signature
+                and write_snapshot(parsed[0], file_path, signature, cube=parsed[1])):
+            return None
+        return parsed
+
+
+def _load_source(file_path, name, chunk_rows):
+    started = time.perf_counter()
+    loaded = load_csv_streaming(file_path, chunk_rows=chunk_rows)
+    if loaded is None:
+        return None
+    df, cube = loaded
+    LOAD_SECONDS.observe(time.perf_counter() - started, 'csv')
+    log.info("Parsed source %s with shape %s", name, df.shape)
+    return df, cube
+
+
+def load_sources(path, chunk_rows=100000, processes=None, snapshot=True):
+    """Load every source file into (merged frame, merged cube, {source name: cube}), or None if none load
+
+    Files with an up-to-date snapshot are mapped as they are; the rest are parsed in a pool of
+    processes, each writing the snapshot of its file so the parent maps it (with snapshots off
+    the parsed frames are sent back instead). Only changed files are reparsed on a reload.
+    """
+    files = source_files(path)
+    parts = {}
+    pending = []
+    for name, file in files.items():
+        started = time.perf_counter()
+        cached = read_snapshot_parts(file) if snapshot else None
+        if cached is not None:
+            LOAD_SECONDS.observe(time.perf_counter() - started, 'snapshot')
+            parts[name] = cached[:2]
+        else:
+            pending.append(name)
+
+    if pending:
+        log.info("Parsing %d of %d source files", len(pending), len(files))
+        workers = min(processes or os.cpu_count() or 1, len(pending))
+        if workers > 1:
+            # Spawned rather than forked: the loading process has reload and query threads running
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = {name: pool.submit(_parse_source, files[name], name, chunk_rows, snapshot)
+                           for name in pending}
+                parsed = {name: future.result() for name, future in futures.items()}
+        else:
+            parsed = {name: _parse_source(files[name], name, chunk_rows, snapshot) for name in pending}
+        for name in pending:
+            result = parsed[name]
+            if result is None and snapshot:
+                result = read_snapshot_parts(files[name])
+            if result is None:
+                log.warning("Skipping source %s: it could not be read with the required columns", name)
+                continue
+            parts[name] = result[:2]
+
+    # Tag rows with their source here, however they were read, so the name is always current
+    parts = {name: (_with_source(df, name), cube) for name, (df, cube) in parts.items()}
+    if not parts:
+        return None
+    names = sorted(parts)
+    frames = [parts[name][0] for name in names]
+    # Vocabularies are unioned, so every source's rows share one set of codes per column
+    frame = concat_frames(*frames)
+    frame.attrs['quality'] = merge_reports(*(df.attrs.get('quality') for df in frames))
+    cubes = {name: parts[name][1] if parts[name][1] is not None else DailyCube.build(parts[name][0])
+             for name in names}
+    cube = cubes[names[0]] if len(names) == 1 else DailyCube.merge(*cubes.values())
+    return frame, cube, cubes
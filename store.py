@@ -0,0 +1,486 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+from cube import DailyCube
+from dataset import capture_ingest_state, file_signature, read_appended_bytes, resume_ingest_state
+from distinct import raw_shop_keys, shop_keys
+from loader import ENCODINGS, detect_encoding, iter_clean_chunks
+from metrics import LOAD_SECONDS, RELOAD_EVENTS
+from quality import SeenSubmissions, drop_duplicate_submissions, submission_hashes
+
+log = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+# One row per visit. Timestamps are whole seconds since the epoch, so a day window is a range
+# scan; the state and BDM indexes lead with the column a query filters or groups on.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS visits (
+    visit_key TEXT PRIMARY KEY,
+    timestamp INTEGER NOT NULL,
+    bdm TEXT NOT NULL,
+    shop TEXT NOT NULL,
+    shop_key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    city TEXT,
+    visit_status TEXT,
+    latitude REAL,
+    longitude REAL,
+    keys_sold INTEGER NOT NULL,
+    key_amount REAL NOT NULL,
+    wallet_transaction_id TEXT
+);
+CREATE INDEX IF NOT EXISTS visits_timestamp ON visits (timestamp);
+CREATE INDEX IF NOT EXISTS visits_state ON visits (state, timestamp);
+CREATE INDEX IF NOT EXISTS visits_bdm ON visits (bdm, timestamp);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value);
+"""
+
+COLUMNS = ['visit_key', 'timestamp', 'bdm', 'shop', 'shop_key', 'state', 'city',
+           'visit_status', 'latitude', 'longitude', 'keys_sold', 'key_amount', 'wallet_transaction_id']
+
+# Re-ingesting a row replaces every column, so a corrected row in the file corrects the store
+UPSERT = (f"INSERT INTO visits ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+          f"ON CONFLICT (visit_key) DO UPDATE SET "
+          + ', '.join(f'{column} = excluded.{column}' for column in COLUMNS[1:]))
+
+TRANSACTION_COLUMN = 'Wallet Transaction ID'
+
+
+def _text(df, column):
+    """Column values as a list of str, None where missing or absent"""
+    if column not in df:
+        return [None] * len(df)
+    values = df[column].astype(object)
+    return values.where(values.notna(), None).map(lambda value: None if value is None else str(value)).tolist()
+
+
+def _real(df, column):
+    if column not in df:
+        return [None] * len(df)
+    values = pd.to_numeric(df[column], errors='coerce').astype(object)
+    return values.where(values.notna(), None).tolist()
+
+
+def _visits(df, seconds, keys):
+    """(timestamp|BDM|merchant visit per row, mask of rows with a Wallet Transaction ID, their IDs)"""
+    stamp = pd.Series(seconds, index=df.index).astype(str)
+    visit = stamp + '|' + df['BDM Name'].astype(str) + '|' + keys
+    if TRANSACTION_COLUMN not in df:
+        return visit, pd.Series(False, index=df.index), None
+    transaction = df[TRANSACTION_COLUMN].astype(object)
+    present = transaction.notna() & (transaction.astype(str).str.strip() != '')
+    return visit, present, 'txn:' + transaction.astype(str).str.strip() + '|' + stamp
+
+
+def visit_keys(df, seconds, keys, seen=None):
+    """Upsert key per cleaned row
+
+    Purchases are keyed on their Wallet Transaction ID plus timestamp (a few IDs are reused for
+    different visits). Other visits are keyed on timestamp, BDM and merchant, numbered in file
+    order so repeats within one second stay separate rows. seen counts each visit's repeats
+    before df - in earlier chunks of the same file, or already stored - and is updated with df's.
+    """
+    visit, present, transactions = _visits(df, seconds, keys)
+    plain = visit[~present]
+    number = plain.groupby(plain, sort=False).cumcount()
+    if seen is not None:
+        if seen:
+            number += plain.map(seen).fillna(0).astype(np.int64)
+        for value, count in plain.value_counts(sort=False).items():
+            seen[value] = seen.get(value, 0) + count
+    if transactions is None:
+        return plain + '#' + number.astype(str)
+    return visit.where(present, plain + '#' + number.astype(str)).where(~present, transactions)
+
+
+def visit_records(df, seen=None):
+    """Cleaned rows as parameter tuples for UPSERT, in COLUMNS order (seen as for visit_keys)"""
+    seconds = df['Timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+    keys = shop_keys(df)
+    columns = [
+        # Identity must not change with the rows around it, so it uses the row's own shop key
+        visit_keys(df, seconds, raw_shop_keys(df), seen).tolist(),
+        seconds.tolist(),
+        _text(df, 'BDM Name'),
+        _text(df, 'Shop Name'),
+        keys.tolist(),
+        _text(df, 'State'),
+        _text(df, 'City'),
+        _text(df, 'Visit Status'),
+        _real(df, 'Latitude'),
+        _real(df, 'Longitude'),
+        df['Keys Sold'].astype(np.int64).tolist(),
+        df['Key Amount'].astype(np.float64).tolist(),
+        _text(df, TRANSACTION_COLUMN),
+    ]
+    return zip(*columns)
+
+
+class AnalyticsStore:
+    """Visits kept in a local SQLite file, queried with the filters and GROUP BY pushed down
+
+    Rows are upserted, so ingesting the same file (or an overlapping export) twice changes
+    nothing, and rows dropped from a later file stay as history. query() has the same shape as
+    DailyCube.query(), so the performance routes can run on it without loading any rows. Each
+    thread (and each forked process) opens its own connection; WAL mode lets queries read
+    the last committed ingest while a new one is being written.
+    """
+
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        # (generation, summary()) of the last generation summarized
+        self._summary = None
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection must not cross a fork; the child opens its own
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """One write transaction; other writers (threads or processes) wait for it to finish"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _meta(self, conn, name, default=None):
+        row = conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, conn, **values):
+        conn.executemany('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', values.items())
+
+    def generation(self):
+        """Counter bumped by every committed ingest; identifies what queries currently see"""
+        return self._meta(self._connection(), 'generation', 0)
+
+    def ingested_signature(self):
+        """Data file signature recorded by the last whole ingest, or None"""
+        value = self._meta(self._connection(), 'signature')
+        return None if value is None else _tuples(json.loads(value))
+
+    def _upsert(self, conn, df, seen=None):
+        if df is None or df.empty:
+            return 0
+        conn.executemany(UPSERT, visit_records(df, seen))
+        return len(df)
+
+    def _stored_repeats(self, conn, df):
+        """How many rows of each of df's visits (see visit_keys) the store already holds"""
+        seconds = df['Timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+        visit, present, _ = _visits(df, seconds, raw_shop_keys(df))
+        seen = {}
+        for value in visit[~present].unique():
+            # Keys are '<visit>#<n>': a primary key range scan over just that visit's repeats
+            count, = conn.execute('SELECT COUNT(*) FROM visits WHERE visit_key >= ? AND visit_key < ?',
+                                  (value + '#', value + '$')).fetchone()
+            if count:
+                seen[value] = count
+        return seen
+
+    def _append(self, conn, df):
+        """Upsert rows appended to the ingested file, numbering repeats after the stored ones"""
+        if df is None or df.empty:
+            return 0
+        return self._upsert(conn, df, self._stored_repeats(conn, df))
+
+    def _bump(self, conn):
+        # The row count is kept here, by the writer, so readers never count the table
+        count, = conn.execute('SELECT COUNT(*) FROM visits').fetchone()
+        self._set_meta(conn, generation=self._meta(conn, 'generation', 0) + 1, row_count=count)
+
+    def upsert(self, df):
+        """Insert or replace the cleaned rows of a whole file in one transaction; returns the rows written
+
+        Ingesting the same rows again changes nothing. For rows appended to what was already
+        ingested use append(), which numbers repeated visits after the stored ones.
+        """
+        with self._write() as conn:
+            rows = self._upsert(conn, df, {})
+            if rows:
+                self._bump(conn)
+        return rows
+
+    def append(self, df):
+        """Insert cleaned rows appended to the ingested file in one transaction; returns the rows written
+
+        Rows the store already holds from the file (a sync may have got to them first) are skipped.
+        """
+        with self._write() as conn:
+            seen = self._submissions(conn)
+            if seen is not None and df is not None:
+                df, _ = drop_duplicate_submissions(df, seen)
+                self._set_meta(conn, submissions=seen.hashes.tobytes())
+            rows = self._append(conn, df)
+            if rows:
+                self._bump(conn)
+        return rows
+
+    def _record_file(self, conn, path, signature, ingest):
+        """Remember where the ingest of `path` stopped, so appended rows can be ingested on their own"""
+        if file_signature(path) != signature:
+            # Changed while it was being read; leave it for the next sync to pick up again
+            return
+        submissions = None if ingest.submissions is None else ingest.submissions.hashes.tobytes()
+        self._set_meta(conn, signature=json.dumps(list(signature)), offset=ingest.offset, rows=ingest.rows,
+                       header=ingest.header, prefix_digest=ingest.prefix_hash.digest(),
+                       ends_with_newline=int(ingest.ends_with_newline), submissions=submissions)
+
+    def ingest_frame(self, df, path, signature, chunk_rows=100000):
+        """Upsert a frame parsed from the whole of `path` (at `signature`) and record it as ingested"""
+        started = time.perf_counter()
+        with self._write() as conn:
+            # Repeats are numbered across the whole frame, not per chunk
+            seen = {}
+            for start in range(0, len(df), chunk_rows):
+                self._upsert(conn, df.iloc[start:start + chunk_rows], seen)
+            if os.path.isfile(path):
+                self._record_file(conn, path, signature, capture_ingest_state(
+                    path, signature[1], len(df), SeenSubmissions(submission_hashes(df))))
+            else:
+                # Several source files: nothing to resume appends from, only what was ingested
+                self._set_meta(conn, signature=json.dumps(signature))
+            self._bump(conn)
+        LOAD_SECONDS.observe(time.perf_counter() - started, 'store')
+        log.info("Upserted %d rows into the analytics store", len(df))
+
+    def sync(self, path, appender=None, chunk_rows=100000):
+        """Bring the store up to date with the data file; returns False if it already was
+
+        Only rows appended since the last sync are parsed when the earlier bytes are unchanged
+        (appender turns header + appended CSV bytes into cleaned rows). Otherwise the file is
+        streamed in chunks, so memory follows chunk_rows however long the history gets.
+        """
+        signature = file_signature(path)
+        if signature is None:
+            return False
+        started = time.perf_counter()
+        with self._write() as conn:
+            # Another worker may have synced this version while we waited for the write lock
+            if self._meta(conn, 'signature') == json.dumps(list(signature)):
+                return False
+            kind, rows, ingest = 'append', 0, None
+            state = self._resume_state(conn, path)
+            appended = read_appended_bytes(path, state, signature[1]) if state and appender else None
+            if appended is not None:
+                data, ingest = appended
+                delta = appender(data, ingest.submissions) if data else None
+                if data and delta is None:
+                    ingest = None
+                else:
+                    rows = self._append(conn, delta)
+                    ingest.rows = state.rows + rows
+            if ingest is None:
+                kind = 'full'
+                rows, seen = self._ingest_file(conn, path, chunk_rows)
+                ingest = capture_ingest_state(path, signature[1], rows, seen)
+            self._record_file(conn, path, signature, ingest)
+            self._bump(conn)
+        RELOAD_EVENTS.inc('store')
+        LOAD_SECONDS.observe(time.perf_counter() - started, 'store')
+        log.info("Analytics store %s sync upserted %d rows", kind, rows)
+        return True
+
+    def _submissions(self, conn):
+        """SeenSubmissions of the rows ingested from the file, or None if they were not recorded"""
+        hashes = self._meta(conn, 'submissions')
+        return None if hashes is None else SeenSubmissions(np.frombuffer(hashes, dtype=np.uint64))
+
+    def _resume_state(self, conn, path):
+        offset = self._meta(conn, 'offset')
+        if offset is None:
+            return None
+        return resume_ingest_state(path, offset, self._meta(conn, 'rows'), self._meta(conn, 'header'),
+                                   self._meta(conn, 'prefix_digest'), bool(self._meta(conn, 'ends_with_newline')),
+                                   self._submissions(conn))
+
+    def _ingest_file(self, conn, path, chunk_rows):
+        """Upsert the whole file chunk by chunk; returns (rows, SeenSubmissions of them)"""
+        encoding = detect_encoding(path)
+        for attempt in [encoding] + [e for e in ENCODINGS if e != encoding]:
+            # Rows upserted under an encoding that later fails are undone before the next attempt
+            conn.execute('SAVEPOINT attempt')
+            try:
+                repeats, seen = {}, SeenSubmissions()
+                rows = sum(self._upsert(conn, chunk, repeats)
+                           for chunk in iter_clean_chunks(path, chunk_rows, attempt, seen))
+            except UnicodeDecodeError:
+                conn.execute('ROLLBACK TO attempt')
+                log.warning("Failed to stream with %s encoding", attempt)
+                continue
+            conn.execute('RELEASE attempt')
+            return rows, seen
+        raise ValueError(f"Could not decode {path} with any of {ENCODINGS}")
+
+    def query(self, start_day=None, end_day=None, state=None):
+        """Per-BDM visits, unique merchants, keys sold and amount, in DailyCube.query() layout
+
+        Runs as one indexed range scan and GROUP BY inside SQLite.
+        """
+        clauses, params = [], []
+        if state is not None:
+            clauses.append('state = ?')
+            params.append(state)
+        if start_day is not None:
+            clauses.append('timestamp >= ?')
+            params.append(int(start_day) * SECONDS_PER_DAY)
+        if end_day is not None:
+            clauses.append('timestamp < ?')
+            params.append((int(end_day) + 1) * SECONDS_PER_DAY)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._connection().execute(
+            f"SELECT bdm, COUNT(*), COUNT(DISTINCT shop_key), SUM(keys_sold), SUM(key_amount) "
+            f"FROM visits {where} GROUP BY bdm ORDER BY bdm", params).fetchall()
+        if not rows:
+            return pd.DataFrame(columns=DailyCube.COLUMNS)
+        return pd.DataFrame(rows, columns=DailyCube.COLUMNS).astype(
+            {'visits': np.int64, 'unique_merchants': np.int64, 'keys_sold': np.int64, 'key_amount': np.float64})
+
+    def query_many(self, windows):
+        return [self.query(start_day, end_day, state) for start_day, end_day, state in windows]
+
+    def summary(self, generation=None):
+        """(rows, states, month names, years) for the dashboard filters, without a full table scan
+
+        The result for a generation is kept, so rebuilding a StoreDataset for it costs nothing.
+        """
+        cached = self._summary
+        if generation is not None and cached is not None and cached[0] == generation:
+            return cached[1]
+        conn = self._connection()
+        rows = self._meta(conn, 'row_count')
+        if rows is None:
+            # Written before row counts were kept
+            rows, = conn.execute('SELECT COUNT(*) FROM visits').fetchone()
+        # Hop from state to state along the state index: one lookup per state present
+        states = []
+        state, = conn.execute('SELECT MIN(state) FROM visits').fetchone()
+        while state is not None:
+            states.append(state)
+            state, = conn.execute('SELECT MIN(state) FROM visits WHERE state > ?', (state,)).fetchone()
+        # Hop from month to month along the timestamp index: one lookup per month present
+        months = []
+        first, = conn.execute('SELECT MIN(timestamp) FROM visits').fetchone()
+        while first is not None:
+            month = np.datetime64(first, 's').astype('datetime64[M]')
+            months.append(month)
+            following = int((month + 1).astype('datetime64[s]').astype(np.int64))
+            first, = conn.execute('SELECT MIN(timestamp) FROM visits WHERE timestamp >= ?', (following,)).fetchone()
+        names = sorted({pd.Timestamp(month).month_name() for month in months})
+        years = sorted({int(str(month)[:4]) for month in months})
+        if generation is not None:
+            self._summary = (generation, (rows, states, names, years))
+        return rows, states, names, years
+
+
+def _tuples(value):
+    """JSON lists back as the (nested) tuples signatures are compared as"""
+    return tuple(_tuples(item) for item in value) if isinstance(value, list) else value
+
+
+class StoreDataset:
+    """One generation of the analytics store, standing in for a Dataset on the performance routes
+
+    It carries what those routes read - version, signature, length, filter values and a cube
+    whose query() runs in SQL - but no rows, so serving from it keeps memory flat.
+    """
+
+    def __init__(self, store, generation):
+        self.cube = store
+        self.version = generation
+        # Shared by every worker using the same file, so ETags match across processes
+        self.signature = ('store', generation)
+        # The store keeps no per-source aggregates
+        self.sources = None
+        self.rows, self.states, self.months, self.years = store.summary(generation)
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def empty(self):
+        return self.rows == 0
+
+
+class AnalyticsSource:
+    """Process-wide current StoreDataset, syncing the store from the data file in the background"""
+
+    def __init__(self, store, path, check_interval=2.0, appender=None, chunk_rows=100000):
+        self.store = store
+        self.path = path
+        self.check_interval = check_interval
+        self.appender = appender
+        self.chunk_rows = chunk_rows
+        self._current = None
+        self._lock = threading.Lock()
+        self._syncing = False
+        self._last_check = 0.0
+
+    def get(self):
+        """Return the current StoreDataset, starting a background sync if the file changed"""
+        current = self._current
+        if current is None:
+            with self._lock:
+                # The first call blocks only if the file was never ingested; history is served as is
+                if self._current is None:
+                    if self.store.ingested_signature() is None:
+                        self._sync()
+                    self._current = StoreDataset(self.store, self.store.generation())
+                    self._last_check = time.monotonic()
+            return self._current
+
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return current
+        self._last_check = now
+
+        # Another process may have committed a sync since
+        generation = self.store.generation()
+        if generation != current.version:
+            current = self._current = StoreDataset(self.store, generation)
+        signature = file_signature(self.path)
+        if signature is not None and signature != self.store.ingested_signature():
+            with self._lock:
+                if self._syncing:
+                    return current
+                self._syncing = True
+            threading.Thread(target=self._sync_in_background, daemon=True).start()
+        return current
+
+    def _sync(self):
+        try:
+            self.store.sync(self.path, self.appender, self.chunk_rows)
+        except Exception:
+            RELOAD_EVENTS.inc('failed')
+            log.exception("Analytics store sync failed")
+
+    def _sync_in_background(self):
+        try:
+            self._sync()
+            self._current = StoreDataset(self.store, self.store.generation())
+        finally:
+            with self._lock:
+                self._syncing = False
@@ -0,0 +1,95 @@
+import gzip
+
+import app
+
+
+def test_batch_matches_individual_filter_requests():
+    client = app.app.test_client()
+    specs = [
+        {'id': 'all', 'time_filter': 'monthly', 'state': 'All'},
+        {'id': 'march', 'time_filter': 'monthly', 'month': 'March', 'year': '2025', 'state': 'All'},
+        {'id': 'week', 'time_filter': 'weekly', 'start_date': '03/17/2025', 'end_date': '03/23/2025',
+         'state': 'UTTAR PRADESH'},
+        {'id': 'again', 'time_filter': 'monthly', 'month': 'March', 'year': '2025', 'state': 'All'},
+        {'id': 'nowhere', 'time_filter': 'daily', 'start_date': '03/24/2025', 'state': 'NOWHERE'},
+    ]
+    response = client.post('/filter-data/batch', json={'queries': specs})
+    assert response.status_code == 200
+    body = response.get_json()
+
+    for spec in specs:
+        form = {key: value for key, value in spec.items() if key != 'id'}
+        single = client.post('/filter-data', data=form).get_json()
+        for row in single:
+            assert row.pop('_total_rows') == body['total_rows']
+        assert body['results'][spec['id']] == single
+
+
+def test_batch_rejects_malformed_specs():
+    client = app.app.test_client()
+    assert client.post('/filter-data/batch', json={'queries': 'monthly'}).status_code == 400
+    assert client.post('/filter-data/batch', json=[{'id': 1}, {'id': '1'}]).status_code == 400
+    # Without ids, results are keyed by position
+    body = client.post('/filter-data/batch', json=[{'state': 'All'}]).get_json()
+    assert list(body['results']) == ['0']
+
+
+def test_timeseries_endpoint():
+    client = app.app.test_client()
+    body = client.get('/timeseries?group_by=state&granularity=month&time_filter=monthly'
+                      '&month=March&year=2025').get_json()
+    assert body['periods'] == ['2025-03']
+    summary = client.post('/filter-data', data={'time_filter': 'monthly', 'month': 'March', 'year': '2025'}).get_json()
+    assert sum(series['visits'][0] for series in body['series']) == sum(row['# Visits'] for row in summary)
+
+    assert client.get('/timeseries?granularity=hourly').status_code == 400
+
+
+def test_geo_endpoints():
+    client = app.app.test_client()
+    box = 'min_lat=6&min_lon=68&max_lat=37&max_lon=98'
+    heatmap = client.get(f'/geo/heatmap?{box}&time_filter=monthly&month=March&year=2025').get_json()
+    visits = client.get(f'/geo/visits?{box}&limit=5&time_filter=monthly&month=March&year=2025').get_json()
+    assert sum(heatmap['visits']) == visits['count']
+    assert len(visits['visits']) == min(5, visits['count'])
+
+    near = client.get('/geo/visits?lat=22.3131763&lon=70.7595555&radius_km=2').get_json()
+    distances = [visit['Distance km'] for visit in near['visits']]
+    assert distances == sorted(distances) and distances[-1] <= 2
+
+    assert client.get('/geo/visits?lat=22.3&lon=70.7').status_code == 400
+    assert client.get('/geo/heatmap?min_lat=30&min_lon=68&max_lat=6&max_lon=98').status_code == 400
+    assert client.get('/geo/tiles/2/4/0').status_code == 404
+
+
+def test_filter_data_columnar_etag_and_compression():
+    client = app.app.test_client()
+    form = {'time_filter': 'monthly', 'month': 'March', 'year': '2025', 'state': 'All'}
+    rows = client.post('/filter-data', data=form).get_json()
+    response = client.get('/filter-data', query_string={**form, 'format': 'columnar'})
+    columns = response.get_json()
+    assert columns['bdm'] == [row['BDM Name'] for row in rows]
+    assert columns['visits'] == [row['# Visits'] for row in rows]
+    assert [f"₹{amount:,.2f}" for amount in columns['key_amount']] == [row['Key Sales Amount'] for row in rows]
+    assert columns['total_rows'] == rows[0]['_total_rows']
+
+    etag = response.headers['ETag']
+    repeat = client.get('/filter-data', query_string={**form, 'format': 'columnar'}, headers={'If-None-Match': etag})
+    assert repeat.status_code == 304 and not repeat.data
+    other = client.get('/filter-data', query_string={**form, 'format': 'columnar', 'state': 'GUJARAT'},
+                       headers={'If-None-Match': etag})
+    assert other.status_code == 200
+
+    everything = client.get('/filter-data', query_string={'format': 'columnar'}, headers={'Accept-Encoding': 'gzip'})
+    plain = client.get('/filter-data', query_string={'format': 'columnar'})
+    if len(plain.data) >= 1024:
+        assert everything.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(everything.data) == plain.data
+
+
+def test_data_quality_reports_every_rule():
+    body = app.app.test_client().get('/data-quality').get_json()
+    assert body['rows'] == len(app.data_store.get())
+    if not body['dummy']:
+        rules = [entry['rule'] for entry in body['report']['rules']]
+        assert rules[0] == 'parse_timestamps' and 'drop_duplicate_submissions' in rules
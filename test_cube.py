@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+from cube import DailyCube, to_day_number
+
+
+def _random_frame(rows=2000, seed=7):
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 90 * 24 * 60, rows), unit='min')
+    df = pd.DataFrame({
+        'Timestamp': timestamps,
+        'BDM Name': rng.choice([f'BDM {i}' for i in range(12)], rows),
+        'Shop Name': rng.choice([f'Shop {i}' for i in range(150)], rows),
+        'State': rng.choice(['GUJARAT', 'BIHAR', 'UTTAR PRADESH'], rows),
+        'Keys Sold': rng.integers(0, 5, rows),
+        'Key Amount': rng.integers(0, 2000, rows).astype(float),
+    })
+    df['Date'] = df['Timestamp'].dt.date
+    return df
+
+
+def _expected(df):
+    return df.groupby('BDM Name').agg(
+        visits=('Timestamp', 'count'),
+        unique_merchants=('Shop Name', 'nunique'),
+        keys_sold=('Keys Sold', 'sum'),
+        key_amount=('Key Amount', 'sum')
+    ).reset_index()
+
+
+def test_cube_matches_groupby_over_windows():
+    df = _random_frame()
+    cube = DailyCube.build(df)
+    start, end = pd.Timestamp('2025-02-03').date(), pd.Timestamp('2025-02-16').date()
+
+    cases = [
+        (None, None, None, df),
+        (start, end, None, df[(df['Date'] >= start) & (df['Date'] <= end)]),
+        (start, end, 'BIHAR', df[(df['Date'] >= start) & (df['Date'] <= end) & (df['State'] == 'BIHAR')]),
+        (start, start, 'GUJARAT', df[(df['Date'] == start) & (df['State'] == 'GUJARAT')]),
+    ]
+    for first, last, state, subset in cases:
+        result = cube.query(None if first is None else to_day_number(first),
+                            None if last is None else to_day_number(last), state)
+        pd.testing.assert_frame_equal(result, _expected(subset), check_dtype=False)
+
+
+def test_cube_unknown_state_is_empty():
+    cube = DailyCube.build(_random_frame(rows=50))
+    assert cube.query(state='NOWHERE').empty
+
+
+def test_query_many_matches_groupby_per_window():
+    df = _random_frame()
+    cube = DailyCube.build(df)
+    day = to_day_number(pd.Timestamp('2025-02-01'))
+    windows = [(day, day + 27, None), (day + 7, day + 13, 'BIHAR'), (None, day, 'BIHAR'),
+               (day + 14, None, 'GUJARAT'), (day, day + 27, None), (day, day, 'NOWHERE'), (day + 500, None, None)]
+
+    days = df['Timestamp'].dt.normalize().map(to_day_number)
+    for (first, last, state), result in zip(windows, cube.query_many(windows)):
+        mask = (days >= (first if first is not None else days.min())) & (days <= (last if last is not None else days.max()))
+        if state:
+            mask &= df['State'] == state
+        expected = _expected(df[mask])
+        if expected.empty:
+            assert result.empty
+        else:
+            pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_extend_matches_merge():
+    rng = np.random.default_rng(5)
+    df = _random_frame(3000)
+    # Half the visits carry a number, so names resolve to numbers and back as rows are added
+    numbers = rng.integers(7000000000, 7000000150, len(df)).astype(float)
+    df['RocketPay Registered Number'] = np.where(rng.random(len(df)) < 0.5, numbers, np.nan)
+    df['Visit Status'] = rng.choice(['Revisit', 'App Install', None], len(df))
+    df.loc[2900:, 'State'] = 'KERALA'
+    df.loc[2950:, 'Visit Status'] = 'Service Call'
+    for split in [0, 2000, 2900, 2999, 3000]:
+        base, delta = DailyCube.build(df.iloc[:split]), DailyCube.build(df.iloc[split:])
+        merged, extended = DailyCube.merge(base, delta), base.extend(delta)
+        for name in ['bdm_names', 'states', 'shops', 'statuses'] + DailyCube.ARRAYS:
+            np.testing.assert_array_equal(getattr(extended, name), getattr(merged, name))
+        for name, array in merged.cell_index.to_arrays().items():
+            np.testing.assert_array_equal(extended.cell_index.to_arrays()[name], array)
+        for name, array in merged.pair_index.to_arrays().items():
+            np.testing.assert_array_equal(extended.pair_index.to_arrays()[name], array)
@@ -0,0 +1,263 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from cube import to_day_number
+from dataset import Dataset, DatasetStore, file_signature
+
+
+def _write_csv(path, rows):
+    pd.DataFrame({
+        'Timestamp': pd.date_range('2025-03-01', periods=rows, freq='D'),
+        'BDM Name': [f'BDM {i}' for i in range(rows)],
+        'Shop Name': [f'Shop {i}' for i in range(rows)],
+        'State': 'GUJARAT',
+        'Keys Sold': 1,
+        'Key Amount': 100.0,
+    }).to_csv(path, index=False)
+
+
+def test_store_loads_once_and_hot_reloads(tmp_path):
+    file_path = tmp_path / 'bdm_data.csv'
+    _write_csv(file_path, 3)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return pd.read_csv(file_path, parse_dates=['Timestamp'])
+
+    store = DatasetStore(str(file_path), loader, check_interval=0)
+    first = store.get()
+    assert len(first) == 3
+    assert store.get() is first
+    assert len(calls) == 1
+
+    # Rewrite with a different size and a newer mtime
+    _write_csv(file_path, 5)
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    # Readers keep getting the old dataset until the background rebuild swaps the new one in
+    assert store.get() is first
+    deadline = time.time() + 5
+    while store.get() is first and time.time() < deadline:
+        time.sleep(0.01)
+
+    second = store.get()
+    assert len(second) == 5
+    assert second.version > first.version
+    assert len(calls) == 2
+
+
+def test_peek_and_pin_never_load_or_check_the_file(tmp_path):
+    file_path = tmp_path / 'bdm_data.csv'
+    _write_csv(file_path, 3)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return pd.read_csv(file_path, parse_dates=['Timestamp'])
+
+    store = DatasetStore(str(file_path), loader, check_interval=0)
+    assert store.peek() is None and not calls
+    pinned = Dataset(loader(), version=0)
+    store.pin(pinned)
+    _write_csv(file_path, 5)
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert store.get() is pinned and store.peek() is pinned
+    time.sleep(0.05)
+    assert store.get() is pinned and len(calls) == 1
+
+
+def test_unreadable_reload_keeps_current_dataset(tmp_path):
+    file_path = tmp_path / 'bdm_data.csv'
+    _write_csv(file_path, 3)
+    broken = []
+
+    def loader():
+        df = pd.read_csv(file_path, parse_dates=['Timestamp'])
+        if broken:
+            # What the app's loader returns when it cannot read the file
+            df = df.head(1)
+            df.attrs['dummy'] = True
+        return df
+
+    store = DatasetStore(str(file_path), loader, check_interval=0)
+    first = store.get()
+    broken.append(True)
+    _write_csv(file_path, 5)
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    store.get()
+    deadline = time.time() + 5
+    while store._rebuilding and time.time() < deadline:
+        time.sleep(0.01)
+    assert store.get() is first
+
+    # Once the file reads again, the next check picks it up
+    broken.clear()
+    deadline = time.time() + 5
+    while store.get() is first and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(store.get()) == 5
+
+
+def test_dataset_rows_use_sorted_index():
+    rng = np.random.default_rng(3)
+    timestamps = pd.Timestamp('2025-03-01') + pd.to_timedelta(rng.integers(0, 60 * 24, 500), unit='h')
+    df = pd.DataFrame({
+        'Timestamp': timestamps,
+        'BDM Name': rng.choice(['A', 'B', 'C'], 500),
+        'Shop Name': rng.choice(['X', 'Y', 'Z'], 500),
+        'State': rng.choice(['GUJARAT', 'BIHAR'], 500),
+        'Keys Sold': 1,
+        'Key Amount': 10.0,
+    })
+    df['Date'] = df['Timestamp'].dt.date
+    dataset = Dataset(df, version=1)
+    assert dataset.frame['Timestamp'].is_monotonic_increasing
+
+    start, end = pd.Timestamp('2025-03-10').date(), pd.Timestamp('2025-03-20').date()
+    for state in [None, 'BIHAR']:
+        rows = dataset.rows(to_day_number(start), to_day_number(end), state)
+        frame = dataset.frame
+        mask = (frame['Date'] >= start) & (frame['Date'] <= end)
+        if state:
+            mask &= frame['State'] == state
+        pd.testing.assert_frame_equal(rows, frame[mask])
+
+    assert dataset.rows(state='NOWHERE').empty
+
+
+def test_store_appends_only_new_rows(tmp_path):
+    from app import clean_data, load_appended_data
+
+    file_path = tmp_path / 'bdm_data.csv'
+    header = 'Timestamp,Shop Name,City,State,BDM Name,Keys Sold,Key Amount\n'
+    file_path.write_text(header +
+                         '24/03/2025 17:41:41,Keval mobile,RAJKOT,GUJARAT,HARDIK GOHIL,1,500\n'
+                         '25/03/2025 10:02:00,Shiv mobile,RAJKOT,GUJARAT,HARDIK GOHIL,,\n')
+    full_loads = []
+
+    def loader():
+        full_loads.append(1)
+        return clean_data(pd.read_csv(file_path))
+
+    store = DatasetStore(str(file_path), loader, check_interval=0, appender=load_appended_data)
+    first = store.get()
+    assert len(first) == 2
+
+    with open(file_path, 'a') as f:
+        f.write('26/03/2025 11:00,New shop,PATNA,BIHAR,Vinay Kumar,2,1000\n'
+                '20/03/2025 09:30,Keval mobile,RAJKOT,GUJARAT,HARDIK GOHIL,1,500\n'
+                # Submitted again: dropped like a duplicate within one parse
+                '24/03/2025 17:41:41,Keval mobile,RAJKOT,GUJARAT,HARDIK GOHIL,1,500\n')
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    deadline = time.time() + 5
+    while store.get() is first and time.time() < deadline:
+        time.sleep(0.01)
+    appended = store.get()
+    assert len(full_loads) == 1
+    assert appended.ingest.rows == 4
+    assert appended.frame['Timestamp'].is_monotonic_increasing
+
+    # The merged cube must answer exactly like one built from a full parse
+    rebuilt = Dataset(loader(), version=0)
+    pd.testing.assert_frame_equal(appended.cube.query(), rebuilt.cube.query())
+    pd.testing.assert_frame_equal(appended.cube.query(state='BIHAR'), rebuilt.cube.query(state='BIHAR'))
+    assert appended.states == rebuilt.states
+
+
+def test_append_extends_indexes_like_a_rebuild():
+    rng = np.random.default_rng(3)
+    rows = 3000
+    df = pd.DataFrame({
+        'Timestamp': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 60 * 24, rows), unit='h'),
+        'BDM Name': rng.choice(['A', 'B', 'C'], rows),
+        'Shop Name': rng.choice([f'Shop {i}' for i in range(200)], rows),
+        'State': rng.choice(['GUJARAT', 'BIHAR'], rows),
+        'Latitude': rng.uniform(20.0, 24.0, rows),
+        'Longitude': rng.uniform(69.0, 74.0, rows),
+        'Keys Sold': rng.integers(0, 4, rows),
+        'Key Amount': rng.integers(0, 900, rows).astype(float),
+    })
+    df.loc[rng.random(rows) < 0.02, 'Timestamp'] = pd.NaT
+    # The delta brings a new state, rows older than loaded ones, and rows without a timestamp
+    df.loc[2800:, 'State'] = 'GOA'
+    base, delta = df.iloc[:2700].reset_index(drop=True), df.iloc[2700:].reset_index(drop=True)
+    appended = Dataset(base, version=1).append(delta, 2)
+    rebuilt = Dataset(df, version=2)
+
+    pd.testing.assert_frame_equal(appended.frame, rebuilt.frame, check_categorical=False)
+    pd.testing.assert_frame_equal(appended.cube.query(), rebuilt.cube.query())
+    start, end = to_day_number(pd.Timestamp('2025-01-10')), to_day_number(pd.Timestamp('2025-02-10'))
+    for state in [None, 'GOA', 'BIHAR']:
+        np.testing.assert_array_equal(np.arange(len(appended))[appended.index.rows(start, end, state)],
+                                      np.arange(len(rebuilt))[rebuilt.index.rows(start, end, state)])
+        box = (21.0, 70.0, 23.0, 72.5, start, end, state)
+        np.testing.assert_array_equal(appended.geo.bbox_rows(*box), rebuilt.geo.bbox_rows(*box))
+        for level in range(3):
+            assert appended.geo.heatmap(level, *box) == rebuilt.geo.heatmap(level, *box)
+
+
+def test_append_without_new_rows_keeps_the_dataset(tmp_path):
+    from app import clean_data, load_appended_data
+
+    file_path = tmp_path / 'bdm_data.csv'
+    line = '24/03/2025 17:41:41,Keval mobile,RAJKOT,GUJARAT,HARDIK GOHIL,1,500\n'
+    file_path.write_text('Timestamp,Shop Name,City,State,BDM Name,Keys Sold,Key Amount\n' + line)
+    store = DatasetStore(str(file_path), lambda: clean_data(pd.read_csv(file_path)), check_interval=0,
+                         appender=load_appended_data)
+    first = store.get()
+    version, offset = first.version, first.ingest.offset
+
+    # Only a duplicate submission is appended
+    with open(file_path, 'a') as f:
+        f.write(line)
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    signature = file_signature(str(file_path))
+
+    deadline = time.time() + 5
+    while store.get().signature != signature and time.time() < deadline:
+        time.sleep(0.01)
+    assert store.get() is first
+    assert first.version == version and first.ingest.offset == offset + len(line)
+    assert first.ingest.rows == 1
+
+
+def test_appended_generation_is_published_once(tmp_path):
+    from app import clean_data, load_appended_data
+    from snapshot import SnapshotPublisher, read_snapshot_parts
+
+    file_path = tmp_path / 'bdm_data.csv'
+    file_path.write_text('Timestamp,Shop Name,State,BDM Name,Keys Sold,Key Amount\n'
+                         '24/03/2025 17:41:41,Keval mobile,GUJARAT,HARDIK GOHIL,1,500\n')
+
+    def loader():
+        parts = read_snapshot_parts(str(file_path))
+        return parts if parts is not None else clean_data(pd.read_csv(file_path))
+
+    # Two stores over one file stand in for two worker processes
+    stores = [DatasetStore(str(file_path), loader, check_interval=0, appender=load_appended_data,
+                           publisher=SnapshotPublisher(str(file_path))) for _ in range(2)]
+    firsts = [store.get() for store in stores]
+
+    with open(file_path, 'a') as f:
+        f.write('26/03/2025 11:00,New shop,BIHAR,Vinay Kumar,2,1000\n')
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    for store, first in zip(stores, firsts):
+        deadline = time.time() + 5
+        while store.get() is first and time.time() < deadline:
+            time.sleep(0.01)
+        dataset = store.get()
+        assert len(dataset) == 2
+        # Both serve the published generation's mapped arrays, not a private appended copy
+        assert isinstance(dataset.cube.cell_visits, np.memmap)
+        assert dataset.cube.query(state='BIHAR')['keys_sold'].tolist() == [2]
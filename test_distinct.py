@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from cube import DailyCube
+from distinct import count_exact, raw_shop_keys, shop_keys
+
+
+def test_shop_keys_prefer_registered_number():
+    df = pd.DataFrame({
+        'Shop Name': ['Keval Mobile', 'keval  mobile.', 'KEVAL MOBILE', 'Shiv Mobile', None],
+        'RocketPay Registered Number': [9737256525.0, np.nan, '+91 97372 56525', np.nan, np.nan],
+    })
+    assert raw_shop_keys(df).tolist() == ['tel:9737256525', 'name:keval mobile', 'tel:9737256525',
+                                          'name:shiv mobile', 'name:unknown']
+    # The unnumbered visit takes the only number that name was recorded with
+    assert shop_keys(df).tolist() == ['tel:9737256525', 'tel:9737256525', 'tel:9737256525',
+                                      'name:shiv mobile', 'name:unknown']
+    assert shop_keys(df.drop(columns='RocketPay Registered Number')).nunique() == 3
+
+
+def test_names_resolve_per_bdm_and_across_merged_cubes():
+    df = pd.DataFrame({
+        'Timestamp': pd.to_datetime(['2025-03-01', '2025-03-01', '2025-03-02', '2025-03-02', '2025-03-03',
+                                     '2025-03-03', '2025-03-04']),
+        'BDM Name': ['A', 'B', 'A', 'A', 'A', 'A', 'A'],
+        'State': 'GUJARAT',
+        'Shop Name': ['Keval', 'Keval', 'Keval', 'Shiv', 'Shiv', 'Shiv', 'Om'],
+        'RocketPay Registered Number': [np.nan, np.nan, 9737256525.0, 1111111111.0, 2222222222.0, np.nan,
+                                        3333333333.0],
+        'Keys Sold': 1,
+        'Key Amount': 0.0,
+    })
+    # B never recorded Keval's number; Shiv has two numbers, so its unnumbered visit stays a name
+    assert shop_keys(df).tolist() == ['tel:9737256525', 'name:keval', 'tel:9737256525', 'tel:1111111111',
+                                      'tel:2222222222', 'name:shiv', 'tel:3333333333']
+    whole = DailyCube.build(df)
+    for parts in [(df.iloc[:2], df.iloc[2:]), (df.iloc[:4], df.iloc[4:]), tuple(df.iloc[[i]] for i in range(7))]:
+        merged = DailyCube.merge(*(DailyCube.build(part) for part in parts))
+        pd.testing.assert_frame_equal(merged.query(), whole.query())
+    assert whole.query().set_index('BDM Name')['unique_merchants'].to_dict() == {'A': 5, 'B': 1}
+
+
+def test_exact_bitmap_and_sorted_paths_agree():
+    rng = np.random.default_rng(2)
+    for pairs, members in [(50000, 300), (200, 100000)]:
+        groups = rng.integers(0, 7, pairs)
+        shops = rng.integers(0, members, pairs)
+        expected = pd.Series(shops).groupby(groups).nunique().reindex(range(7), fill_value=0)
+        assert count_exact(groups, shops, 7, members).tolist() == expected.tolist()
+
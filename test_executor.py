@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+from executor import QueryExecutor, QueryTimeout
+
+
+def test_identical_queries_in_flight_run_once():
+    executor = QueryExecutor(max_workers=2, timeout=5)
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return 'march'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(executor.run('march', compute)))
+               for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 5
+    while executor.in_flight() == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [('march', False)] * 10
+    assert executor.in_flight() == 0
+
+
+def test_timeout_serves_last_known_result():
+    executor = QueryExecutor(max_workers=1, timeout=0.05)
+    assert executor.run(('v1', 'march'), lambda: 'old', stale_key='march') == ('old', False)
+
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return 'new'
+
+    assert executor.run(('v2', 'march'), slow, stale_key='march') == ('old', True)
+    with pytest.raises(QueryTimeout):
+        executor.run(('v2', 'april'), slow, stale_key='april')
+
+    # The timed-out computation still finishes and becomes the result to fall back on
+    release.set()
+    deadline = time.time() + 5
+    while executor.in_flight() and time.time() < deadline:
+        time.sleep(0.01)
+    blocked = threading.Event()
+    assert executor.run(('v3', 'march'), lambda: blocked.wait(5), stale_key='march') == ('new', True)
+    blocked.set()
+
+
+def test_inline_mode_runs_in_caller():
+    executor = QueryExecutor(max_workers=0)
+    assert executor.run('key', threading.current_thread) == (threading.current_thread(), False)
@@ -0,0 +1,81 @@
+import io
+import zipfile
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import pandas as pd
+
+import app
+from export import csv_stream, export_chunks, export_columns, xlsx_stream
+
+MARCH_GUJARAT = {'time_filter': 'monthly', 'month': 'March', 'year': '2025', 'state': 'GUJARAT'}
+
+
+def _frame():
+    return pd.DataFrame({
+        'Timestamp': pd.date_range('2025-03-01', periods=7, freq='h'),
+        'Shop Name': ['A & B', 'C', None, 'D', 'E <F>', 'G', 'H'],
+        'BDM Name': pd.Categorical(['X', 'Y', 'X', 'X', 'Y', 'X', 'Y']),
+        'RocketPay Registered Number': [9737256525.0, np.nan, 7990036324.0, np.nan, np.nan, np.nan, np.nan],
+        'Key Amount': [500.0, 0.0, 0.0, 1000.0, 0.0, 0.0, 250.5],
+        'Month': 'March',
+    })
+
+
+def test_chunks_follow_positions_and_bdm():
+    frame = _frame()
+    for positions in [slice(1, 6), np.array([1, 2, 3, 4, 5])]:
+        chunks = list(export_chunks(frame, positions, bdm='X', chunk_rows=2))
+        assert [len(chunk) for chunk in chunks] == [1, 1, 1]
+        assert pd.concat(chunks)['Shop Name'].tolist() == [None, 'D', 'G']
+        assert 'Month' not in chunks[0]
+    assert list(export_chunks(frame, slice(0, 7), bdm='nobody')) == []
+
+    columns = export_columns(frame)
+    text = ''.join(csv_stream(export_chunks(frame, slice(0, 7), chunk_rows=3), columns))
+    assert text.splitlines()[1] == '01/03/2025 00:00:00,A & B,9737256525,X,500.0'
+    assert len(text.splitlines()) == 8
+    # Nothing matched: the same header all the same
+    empty = ''.join(csv_stream(export_chunks(frame, slice(0, 7), bdm='nobody'), columns))
+    assert empty == text.splitlines(keepends=True)[0]
+
+
+def test_number_columns_are_typed_once_per_export():
+    frame = _frame().assign(**{'Current Key Balance': [6.0, 2.0, 5.0, 4.5, 1.0, np.inf, 3.0]})
+    # The fraction and the infinity are in later chunks than the whole numbers
+    for bdm, first in [(None, '6.0'), ('X', '6.0'), ('Y', '2')]:
+        text = ''.join(csv_stream(export_chunks(frame, slice(0, 7), bdm=bdm, chunk_rows=2), export_columns(frame)))
+        assert text.splitlines()[1].split(',')[-1] == first
+    text = ''.join(csv_stream(export_chunks(frame, slice(0, 3), chunk_rows=1), export_columns(frame)))
+    assert [line.split(',')[-1] for line in text.splitlines()[1:]] == ['6', '2', '5']
+
+
+def test_xlsx_stream_is_a_valid_workbook():
+    frame = _frame()
+    parts = list(xlsx_stream(export_chunks(frame, slice(0, 7), chunk_rows=3), export_columns(frame)))
+    assert len(parts) > 2
+    workbook = zipfile.ZipFile(io.BytesIO(b''.join(parts)))
+    assert workbook.testzip() is None
+    sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+    rows = sheet.findall('.//{http://schemas.openxmlformats.org/spreadsheetml/2006/main}row')
+    assert len(rows) == 8
+    assert ''.join(rows[1].itertext()).startswith('01/03/2025 00:00:00A & B')
+
+
+def test_export_endpoint_matches_filtered_visits():
+    client = app.app.test_client()
+    response = client.get('/export', query_string=MARCH_GUJARAT)
+    assert response.headers['Content-Disposition'] == 'attachment; filename="bdm_visits.csv"'
+    exported = pd.read_csv(io.BytesIO(response.data))
+    performance = client.post('/filter-data', data=MARCH_GUJARAT).get_json()
+    if isinstance(performance, list):
+        assert exported.groupby('BDM Name').size().to_dict() == {row['BDM Name']: row['# Visits']
+                                                                  for row in performance}
+        bdm = performance[0]['BDM Name']
+        one = pd.read_csv(io.BytesIO(client.get('/export', query_string={**MARCH_GUJARAT, 'bdm': bdm}).data))
+        assert len(one) == performance[0]['# Visits']
+        # Filter values are matched the way names are cleaned
+        loose = {**MARCH_GUJARAT, 'state': MARCH_GUJARAT['state'].lower(), 'bdm': f' {bdm.lower()} '}
+        assert len(pd.read_csv(io.BytesIO(client.get('/export', query_string=loose).data))) == len(one)
+        assert client.post('/filter-data', data=loose).get_json() == performance
+    assert client.get('/export?format=pdf').status_code == 400
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from cube import to_day_number
+from dataset import Dataset
+from geo import LEVELS, haversine_km, level_for_span, tile_bbox
+
+
+def _dataset(rows=4000, seed=13):
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(20.0, 24.0, rows)
+    lon = rng.uniform(69.0, 74.0, rows)
+    # Some visits were logged without a usable location
+    lat[rng.random(rows) < 0.05] = np.nan
+    lon[:10] = lat[:10] = 0.0
+    df = pd.DataFrame({
+        'Timestamp': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 60 * 24, rows), unit='h'),
+        'BDM Name': rng.choice(['A', 'B', 'C'], rows),
+        'Shop Name': rng.choice([f'Shop {i}' for i in range(200)], rows),
+        'State': rng.choice(['GUJARAT', 'RAJASTHAN'], rows),
+        'Latitude': lat,
+        'Longitude': lon,
+        'Keys Sold': rng.integers(0, 4, rows),
+        'Key Amount': rng.integers(0, 900, rows).astype(float),
+    })
+    return Dataset(df, version=1)
+
+
+def _window_mask(frame, start_day, end_day, state):
+    days = frame['Timestamp'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    mask = (days >= start_day) & (days <= end_day)
+    if state is not None:
+        mask &= (frame['State'] == state).to_numpy()
+    return mask
+
+
+def test_bbox_and_radius_match_brute_force():
+    dataset = _dataset()
+    frame = dataset.frame
+    lat, lon = frame['Latitude'].to_numpy(), frame['Longitude'].to_numpy()
+    start, end = to_day_number(pd.Timestamp('2025-01-10')), to_day_number(pd.Timestamp('2025-02-05'))
+
+    for state in [None, 'GUJARAT']:
+        window = _window_mask(frame, start, end, state)
+        box = (21.03, 70.51, 22.97, 72.2)
+        expected = np.flatnonzero(window & (lat >= box[0]) & (lat <= box[2]) & (lon >= box[1]) & (lon <= box[3]))
+        assert dataset.geo.bbox_rows(*box, start, end, state).tolist() == expected.tolist()
+
+        distances = haversine_km(22.0, 71.5, lat, lon)
+        expected = np.flatnonzero(window & (distances <= 60))
+        rows, found = dataset.geo.radius_rows(22.0, 71.5, 60, start, end, state)
+        assert sorted(rows.tolist()) == expected.tolist()
+        assert np.all(np.diff(found) >= 0)
+
+    assert len(dataset.geo.bbox_rows(21, 70, 23, 72, state='NOWHERE')) == 0
+    # Visits at (0, 0) or without coordinates are not indexed
+    assert len(dataset.geo) == int((np.isfinite(lat) & (lat != 0)).sum())
+
+
+def test_heatmap_bins_match_row_totals():
+    dataset = _dataset()
+    frame = dataset.frame
+    start, end = to_day_number(pd.Timestamp('2025-01-05')), to_day_number(pd.Timestamp('2025-01-25'))
+    box = (20.0, 69.0, 24.0, 74.0)
+    inside = dataset.geo.bbox_rows(*box, start, end, 'RAJASTHAN')
+
+    for level, size in enumerate(LEVELS):
+        heatmap = dataset.geo.heatmap(level, *box, start, end, 'RAJASTHAN')
+        assert sum(heatmap['visits']) == len(inside)
+        assert sum(heatmap['keys_sold']) == frame['Keys Sold'].iloc[inside].sum()
+        assert np.isclose(sum(heatmap['key_amount']), frame['Key Amount'].iloc[inside].sum())
+        # Every bin centre sits inside the cell its visits fall in
+        rows = frame.iloc[inside]
+        cells = set(zip(np.floor(rows['Latitude'] / size), np.floor(rows['Longitude'] / size)))
+        assert set(zip(np.floor(np.array(heatmap['lat']) / size), np.floor(np.array(heatmap['lon']) / size))) == cells
+
+
+def test_tile_bbox_and_level_choice():
+    min_lat, min_lon, max_lat, max_lon = tile_bbox(1, 1, 0)
+    assert (min_lat, min_lon, max_lon) == (0.0, 0.0, 180.0)
+    assert np.isclose(max_lat, 85.0511287798)
+    assert level_for_span(360) == 0
+    assert level_for_span(10) == 1
+    assert level_for_span(0.5) == len(LEVELS) - 1
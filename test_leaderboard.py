@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from cube import DailyCube, to_day_number
+from leaderboard import previous_window, rank_entries, top_k
+
+
+def _frame(rows=3000, seed=21):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Timestamp': pd.Timestamp('2025-03-01') + pd.to_timedelta(rng.integers(0, 28 * 24, rows), unit='h'),
+        'BDM Name': rng.choice([f'BDM {i:02d}' for i in range(40)], rows),
+        'Shop Name': rng.choice([f'Shop {i}' for i in range(300)], rows),
+        'State': rng.choice(['GUJARAT', 'BIHAR'], rows),
+        'Visit Status': rng.choice(['Key Purchased', 'Not Interested', 'Revisit', None], rows),
+        'Keys Sold': rng.integers(0, 3, rows),
+        'Key Amount': rng.integers(0, 5, rows) * 500.0,
+    })
+
+
+def test_top_k_matches_full_sort_with_ties():
+    rng = np.random.default_rng(1)
+    values = rng.integers(0, 20, 500).astype(float)
+    for k in [1, 7, 50, 500, 900]:
+        assert top_k(values, k).tolist() == np.lexsort((np.arange(500), -values))[:k].tolist()
+        assert top_k(values, k, largest=False).tolist() == np.lexsort((np.arange(500), values))[:k].tolist()
+
+
+def test_rank_entries_match_pandas_ranks():
+    df = _frame()
+    cube = DailyCube.build(df)
+    start, end = to_day_number(pd.Timestamp('2025-03-15')), to_day_number(pd.Timestamp('2025-03-21'))
+    days = df['Timestamp'].dt.normalize().map(to_day_number)
+
+    def expected(first, last):
+        window = df[(days >= first) & (days <= last)]
+        grouped = window.groupby('BDM Name')
+        rate = grouped['Visit Status'].apply(lambda status: (status == 'Not Interested').sum()) / grouped.size()
+        return rate, rate.rank(method='min', ascending=False).astype(int), rate.rank(pct=True) * 100
+
+    rate, ranks, percentiles = expected(start, end)
+    _, previous_ranks, _ = expected(start - 7, start - 1)
+    result = rank_entries(cube, 'not_interested_rate', 5, 'both', start, end)
+    assert result['bdms'] == len(rate)
+    assert [entry['value'] for entry in result['top']] == sorted(rate.round(4), reverse=True)[:5]
+    assert [entry['value'] for entry in result['bottom']] == sorted(rate.round(4))[:5]
+    for entry in result['top'] + result['bottom']:
+        assert entry['rank'] == ranks[entry['bdm']]
+        # pandas averages tied ranks; half the ties below plus half a slot matches that
+        assert abs(entry['percentile'] - (percentiles[entry['bdm']] - 50 / len(rate))) < 0.1
+        assert entry['previous_rank'] == previous_ranks.get(entry['bdm'])
+        assert entry['rank_change'] == (None if entry['previous_rank'] is None
+                                        else entry['previous_rank'] - entry['rank'])
+
+
+def test_status_counts_survive_merge():
+    df = _frame()
+    # The appended part has no Visit Status column at all
+    merged = DailyCube.merge(DailyCube.build(df.iloc[:2000]), DailyCube.build(df.iloc[2000:].drop(columns='Visit Status')))
+    head = df.iloc[:2000]
+    for state in [None, 'BIHAR']:
+        subset = head if state is None else head[head['State'] == state]
+        expected = pd.crosstab(subset['BDM Name'], subset['Visit Status']).reindex(merged.bdm_names, fill_value=0)
+        assert merged.statuses.tolist() == expected.columns.tolist()
+        assert (merged.status_counts(state=state) == expected.to_numpy()).all()
+
+
+def test_monthly_rank_change_uses_previous_calendar_month():
+    rng = np.random.default_rng(8)
+    rows = 4000
+    df = pd.DataFrame({
+        'Timestamp': pd.Timestamp('2025-01-20') + pd.to_timedelta(rng.integers(0, 71 * 24, rows), unit='h'),
+        'BDM Name': rng.choice([f'BDM {i:02d}' for i in range(15)], rows),
+        'Shop Name': rng.choice([f'Shop {i}' for i in range(100)], rows),
+        'State': 'GUJARAT',
+        'Keys Sold': rng.integers(0, 4, rows),
+        'Key Amount': 0.0,
+    })
+    cube = DailyCube.build(df)
+    march = to_day_number(pd.Timestamp('2025-03-01')), to_day_number(pd.Timestamp('2025-03-31'))
+    february = to_day_number(pd.Timestamp('2025-02-01')), to_day_number(pd.Timestamp('2025-02-28'))
+    assert previous_window(*march, monthly=True) == february
+    # A 31-day month before a 28-day one, and across a year boundary
+    assert previous_window(*february, monthly=True) == (to_day_number(pd.Timestamp('2025-01-01')), february[0] - 1)
+    assert previous_window(to_day_number(pd.Timestamp('2025-01-01')), to_day_number(pd.Timestamp('2025-01-31')),
+                           monthly=True)[0] == to_day_number(pd.Timestamp('2024-12-01'))
+    # Daily and weekly windows keep the span of the same length
+    assert previous_window(*march) == (march[0] - 31, march[0] - 1)
+
+    result = rank_entries(cube, 'keys_sold', 15, 'top', *march, monthly=True)
+    assert result['previous_window'] == ['2025-02-01', '2025-02-28']
+    in_february = df[df['Timestamp'].dt.month == 2].groupby('BDM Name')['Keys Sold'].sum()
+    expected = in_february.rank(method='min', ascending=False).astype(int)
+    for entry in result['top']:
+        assert entry['previous_rank'] == expected[entry['bdm']]
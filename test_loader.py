@@ -0,0 +1,59 @@
+import pandas as pd
+
+from dataset import Dataset
+from loader import (clean_data, detect_encoding, load_csv_streaming, parse_fixed_width, parse_timestamps,
+                    read_csv_with_fallback)
+
+CSV = (
+    'Timestamp,Shop Name,City,State,BDM Name,Keys Sold,Key Amount\n'
+    '24/03/2025 17:41:41,Keval mobile,RAJKOT,GUJARAT,HARDIK GOHIL,1,500\n'
+    '25/03/2025 10:02:00,Shiv mobile,,GUJARAT,HARDIK GOHIL,,\n'
+    '22/03/2025 11:00,New shop,PATNA,BIHAR,Vinay Kumar,2,1000\n'
+    ',Keval mobile,RAJKOT,GUJARAT,HARDIK GOHIL,1,500\n'
+    '26/03/2025 09:30,Café Mobile,PATNA,BIHAR,Vinay Kumar,0,0\n'
+)
+
+
+def test_streaming_matches_whole_file_load(tmp_path):
+    file_path = tmp_path / 'bdm_data.csv'
+    file_path.write_text(CSV, encoding='utf-8')
+
+    whole = Dataset(clean_data(read_csv_with_fallback(str(file_path))), version=1)
+    frame, cube = load_csv_streaming(str(file_path), chunk_rows=2)
+    streamed = Dataset(frame, version=2, cube=cube)
+
+    assert len(streamed) == len(whole) == 5
+    pd.testing.assert_frame_equal(streamed.cube.query(), whole.cube.query())
+    pd.testing.assert_frame_equal(streamed.cube.query(state='BIHAR'), whole.cube.query(state='BIHAR'))
+    assert streamed.states == whole.states
+
+
+def test_detect_encoding_falls_back_to_latin1(tmp_path):
+    file_path = tmp_path / 'bdm_data.csv'
+    file_path.write_bytes(CSV.encode('latin-1'))
+    assert detect_encoding(str(file_path)) == 'latin-1'
+    frame, _ = load_csv_streaming(str(file_path), chunk_rows=2)
+    assert 'Café Mobile' in frame['Shop Name'].tolist()
+
+
+def test_parse_timestamps_by_format_group():
+    raw = pd.Series(['24/03/2025 17:41:41', '25/03/2025 10:02', '1/4/2025 9:05', '29/02/2025 10:00:00',
+                     '2025-03-01 10:00:00', 'March 3 2025', None, 'not a date'])
+    parsed, counts = parse_timestamps(raw)
+    expected = pd.to_datetime(['2025-03-24 17:41:41', '2025-03-25 10:02', '2025-04-01 09:05', None,
+                               '2025-03-01 10:00:00', '2025-03-03', None, None], format='ISO8601')
+    pd.testing.assert_series_equal(parsed, pd.Series(expected), check_names=False)
+    assert counts['fixed %d/%m/%Y %H:%M:%S'] == 1
+    assert counts['fixed %d/%m/%Y %H:%M'] == 1
+    assert counts['strptime %d/%m/%Y %H:%M'] == 1
+    assert counts['fallback'] == 1
+    assert counts['missing'] == 1
+    assert counts['unparsed'] == 2
+
+
+def test_parse_fixed_width_rejects_years_outside_nanosecond_range():
+    raw = ['01/01/1677 00:00:00', '01/01/1678 00:00:00', '31/12/2261 23:59:59', '01/01/2262 00:00:00',
+           '01/01/9999 00:00:00']
+    parsed = parse_fixed_width(raw, '%d/%m/%Y %H:%M:%S')
+    expected = pd.to_datetime([None, '1678-01-01 00:00:00', '2261-12-31 23:59:59', None, None])
+    assert pd.Series(parsed).equals(pd.Series(expected))
@@ -0,0 +1,35 @@
+from metrics import Histogram, Counter
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('t_seconds', 'test', ['stage'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, 'aggregate')
+
+    lines = histogram.render()
+    assert 't_seconds_bucket{stage="aggregate",le="0.1"} 2' in lines
+    assert 't_seconds_bucket{stage="aggregate",le="1.0"} 3' in lines
+    assert 't_seconds_bucket{stage="aggregate",le="+Inf"} 4' in lines
+    assert 't_seconds_count{stage="aggregate"} 4' in lines
+
+
+def test_counter_labels_are_escaped():
+    counter = Counter('t_total', 'test', ['event'])
+    counter.inc('say "hi"', amount=2)
+    assert counter.render() == ['t_total{event="say \\"hi\\""} 2']
+
+
+def test_metrics_endpoint_reports_filter_stages():
+    import app
+
+    client = app.app.test_client()
+    assert client.post('/filter-data', data={'time_filter': 'monthly', 'state': 'All'}).status_code == 200
+    body = client.get('/metrics').get_data(as_text=True)
+
+    for stage in ('parse', 'load', 'filter', 'serialize'):
+        assert f'bdm_stage_duration_seconds_count{{endpoint="filter_data",stage="{stage}"}}' in body
+    assert 'bdm_request_duration_seconds_count{endpoint="filter_data",method="POST",status="200"}' in body
+    assert 'bdm_dataset_rows ' in body
+    assert 'bdm_query_cache_entries{cache="store"}' in body
+    assert 'bdm_query_cache_removals_total{cache="performance",reason="eviction"}' in body
+    assert 'hits' in client.get('/cache-stats').get_json()['store']
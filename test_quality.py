@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from loader import DEFAULT_TIMESTAMP, clean_data, load_csv_streaming, read_csv_with_fallback
+
+CSV = (
+    'Timestamp,Shop Name,State,BDM Name,Latitude,Longitude,Keys Sold,Key Amount\n'
+    '24/03/2025 17:41:41,Keval mobile,GUJARAT,HARDIK GOHIL,22.31,70.75,1,500\n'
+    '24/03/2025 17:41:41,Keval mobile,GUJARAT,HARDIK GOHIL,22.31,70.75,1,500\n'
+    '25/03/2025 10:02:00,Shiv mobile, gujarat ,Hardik  Gohil,0,0,x,\n'
+    '22/03/2025 11:00,New shop,Bihar,vinay kumar,95.2,85.1,0,1000\n'
+    ',,,,,,-1,-50\n'
+)
+
+
+def test_rules_clean_in_one_pass_and_report_counts(tmp_path):
+    file_path = tmp_path / 'bdm_data.csv'
+    file_path.write_text(CSV, encoding='utf-8')
+    df = clean_data(read_csv_with_fallback(str(file_path)))
+
+    assert len(df) == 4
+    assert sorted(df['State'].unique()) == ['BIHAR', 'GUJARAT', 'Unknown']
+    assert sorted(df['BDM Name'].unique()) == ['HARDIK GOHIL', 'Unknown', 'VINAY KUMAR']
+    assert df['Timestamp'].min() == DEFAULT_TIMESTAMP
+    assert df['Latitude'].notna().sum() == 1
+
+    report = df.attrs['quality']
+    assert (report['rows_in'], report['rows_out']) == (5, 4)
+    counts = {name: entry['rows'] for name, entry in report['rules'].items()}
+    assert counts == {'parse_timestamps': 1, 'normalize_names': 2, 'fill_missing_text': 1, 'coerce_numbers': 1,
+                      'check_coordinates': 2, 'drop_duplicate_submissions': 1, 'flag_impossible_amounts': 2}
+    assert all(entry['seconds'] >= 0 for entry in report['rules'].values())
+
+
+def test_duplicates_are_dropped_across_chunks(tmp_path):
+    file_path = tmp_path / 'bdm_data.csv'
+    file_path.write_text(CSV, encoding='utf-8')
+    whole = clean_data(read_csv_with_fallback(str(file_path)))
+    # The repeated submission lands in a chunk of its own
+    streamed, _ = load_csv_streaming(str(file_path), chunk_rows=1)
+    pd.testing.assert_frame_equal(streamed, whole, check_categorical=False)
+    assert streamed.attrs['quality']['rules']['drop_duplicate_submissions']['rows'] == 1
+
+
+def test_streamed_report_adds_up_chunks(tmp_path):
+    rng = np.random.default_rng(3)
+    rows = 900
+    file_path = tmp_path / 'bdm_data.csv'
+    pd.DataFrame({
+        'Timestamp': (pd.Timestamp('2025-03-01') + pd.to_timedelta(rng.integers(0, 10**6, rows), unit='s'))
+        .strftime('%d/%m/%Y %H:%M:%S'),
+        'Shop Name': rng.choice(['Shop A', 'Shop B'], rows),
+        'State': rng.choice(['Bihar', 'BIHAR', ' Gujarat'], rows),
+        'BDM Name': rng.choice(['A', 'b '], rows),
+        'Keys Sold': rng.integers(-1, 3, rows),
+        'Key Amount': rng.integers(0, 3, rows) * 500.0,
+    }).to_csv(file_path, index=False)
+
+    whole = clean_data(read_csv_with_fallback(str(file_path))).attrs['quality']
+    streamed, _ = load_csv_streaming(str(file_path), chunk_rows=200)
+    assert streamed.attrs['quality']['rows_in'] == whole['rows_in'] == rows
+    for name, entry in whole['rules'].items():
+        assert streamed.attrs['quality']['rules'][name]['rows'] == entry['rows']
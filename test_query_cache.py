@@ -0,0 +1,35 @@
+import time
+
+from query_cache import QueryCache
+
+
+def test_lru_eviction_and_counters():
+    cache = QueryCache(maxsize=2, ttl=None)
+    cache.put(1, 'a', [1])
+    cache.put(1, 'b', [2])
+    assert cache.get(1, 'a') == [1]
+    cache.put(1, 'c', [3])
+
+    # 'b' was the least recently used entry
+    assert cache.get(1, 'b') is None
+    assert cache.get(1, 'c') == [3]
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 1, 1)
+
+
+def test_new_dataset_version_invalidates():
+    cache = QueryCache(maxsize=8, ttl=None)
+    cache.put(1, 'a', [1])
+    assert cache.get(2, 'a') is None
+    # A late result computed from the old version must not be stored
+    cache.put(1, 'a', [1])
+    assert cache.get(2, 'a') is None
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_ttl_expiry():
+    cache = QueryCache(maxsize=8, ttl=0.01)
+    cache.put(1, 'a', [1])
+    time.sleep(0.02)
+    assert cache.get(1, 'a') is None
+    assert cache.stats()['expirations'] == 1
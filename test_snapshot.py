@@ -0,0 +1,97 @@
+import os
+import numpy as np
+import pandas as pd
+
+from dataset import file_signature
+from snapshot import read_snapshot_parts, write_snapshot, snapshot_root
+
+
+def test_snapshot_round_trip(tmp_path):
+    data_file = tmp_path / 'bdm_data.csv'
+    data_file.write_text('placeholder\n')
+    signature = file_signature(str(data_file))
+
+    timestamps = pd.to_datetime(['2025-03-24 17:41:41', '2025-03-25 09:00:00', '2025-04-01 12:30:00'])
+    df = pd.DataFrame({
+        'Timestamp': timestamps,
+        'BDM Name': ['A', 'B', 'A'],
+        'City': ['RAJKOT', np.nan, 'VALSAD'],
+        'Keys Sold': [1, 0, 3],
+        'Key Amount': [100.0, 0.0, 250.5],
+    })
+    df['Week'] = df['Timestamp'].dt.isocalendar().week
+    df['Date'] = df['Timestamp'].dt.date
+    df['State'] = pd.Categorical(['GUJARAT', 'BIHAR', 'GUJARAT'])
+
+    assert write_snapshot(df, str(data_file), signature)
+    loaded = read_snapshot_parts(str(data_file))[0]
+    pd.testing.assert_frame_equal(loaded, df)
+
+
+def test_snapshot_ignored_after_file_change(tmp_path):
+    data_file = tmp_path / 'bdm_data.csv'
+    data_file.write_text('placeholder\n')
+    df = pd.DataFrame({'Keys Sold': [1, 2]})
+    assert write_snapshot(df, str(data_file), file_signature(str(data_file)))
+
+    data_file.write_text('placeholder\nmore rows\n')
+    assert read_snapshot_parts(str(data_file)) is None
+    assert os.path.isdir(snapshot_root(str(data_file)))
+
+
+def test_snapshot_maps_cube_and_row_index(tmp_path):
+    from dataset import Dataset
+    from snapshot import read_snapshot_parts
+
+    data_file = tmp_path / 'bdm_data.csv'
+    data_file.write_text('placeholder\n')
+    rng = np.random.default_rng(5)
+    df = pd.DataFrame({
+        'Timestamp': pd.Timestamp('2025-03-01') + pd.to_timedelta(rng.integers(0, 24 * 40, 300), unit='h'),
+        'BDM Name': rng.choice(['A', 'B', 'C'], 300),
+        'Shop Name': rng.choice(['X', 'Y', 'Z', 'W'], 300),
+        'State': rng.choice(['GUJARAT', 'BIHAR'], 300),
+        'Latitude': rng.uniform(21, 24, 300),
+        'Longitude': rng.uniform(70, 86, 300),
+        'Keys Sold': rng.integers(0, 3, 300),
+        'Key Amount': rng.random(300) * 100,
+    })
+    built = Dataset(df, version=1)
+    assert write_snapshot(built.frame, str(data_file), file_signature(str(data_file)),
+                          cube=built.cube, row_index=built.index, geo_index=built.geo)
+
+    frame, cube, index, geo = read_snapshot_parts(str(data_file))
+    assert isinstance(cube.cell_visits, np.memmap)
+    assert isinstance(cube.pair_index.order, np.memmap)
+    assert isinstance(geo.order, np.memmap)
+    mapped = Dataset(frame, version=2, cube=cube, index=index, geo=geo)
+    assert mapped.cube is cube and mapped.index is index and mapped.geo is geo
+    assert mapped.geo.heatmap(1, 21, 70, 24, 86, 20150, 20165) == built.geo.heatmap(1, 21, 70, 24, 86, 20150, 20165)
+    for state in [None, 'BIHAR', 'NOWHERE']:
+        pd.testing.assert_frame_equal(mapped.cube.query(20150, 20165, state), built.cube.query(20150, 20165, state))
+        pd.testing.assert_frame_equal(mapped.rows(20150, 20165, state), built.rows(20150, 20165, state))
+
+
+def test_cleaned_frame_is_mapped_except_for_id_columns(tmp_path):
+    from loader import clean_data
+
+    data_file = tmp_path / 'bdm_data.csv'
+    data_file.write_text('placeholder\n')
+    df = clean_data(pd.DataFrame({
+        'Timestamp': ['24/03/2025 17:41:41', '25/03/2025 09:00:00', '01/04/2025 12:30:00'],
+        'Shop Name': ['X', 'Y', 'X'],
+        'State': ['GUJARAT', 'BIHAR', 'GUJARAT'],
+        'BDM Name': ['A', 'B', 'A'],
+        'Visit Status': [None, 'Revisit', 'Not Interested'],
+        'Keys Sold': [1, 0, 0],
+        'Key Amount': [500.0, 0.0, 0.0],
+        # Missing as read_csv leaves them
+        'Wallet Transaction ID': ['txn-1', np.nan, np.nan],
+    }))
+    assert write_snapshot(df, str(data_file), file_signature(str(data_file)))
+    loaded = read_snapshot_parts(str(data_file))[0]
+    pd.testing.assert_frame_equal(loaded, df)
+    # Every column but the transaction IDs is mapped codes or values, so worker processes share them
+    # rather than rebuilding them; the IDs are dictionary encoded
+    assert [column for column in loaded if loaded[column].dtype == object] == ['Wallet Transaction ID']
+    assert isinstance(loaded['Date'].to_numpy().base, np.memmap)
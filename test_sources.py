@@ -0,0 +1,109 @@
+import os
+import numpy as np
+import pandas as pd
+
+import app
+import sources
+from cube import DailyCube
+from dataset import DatasetStore
+from query_cache import QueryCache
+from snapshot import read_snapshot_parts
+from loader import load_csv_streaming
+from sources import data_signature, load_sources, source_files
+
+
+def _write_source(file_path, rows, seed, states):
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Timestamp('2025-03-01') + pd.to_timedelta(rng.integers(0, 40 * 86400, rows), unit='s')
+    pd.DataFrame({
+        'Timestamp': timestamps.strftime('%d/%m/%Y %H:%M:%S'),
+        'Shop Name': rng.choice([f'Shop {i}' for i in range(30)], rows),
+        'State': rng.choice(states, rows),
+        'BDM Name': rng.choice(['A', 'B', 'C'], rows),
+        'Keys Sold': rng.integers(0, 3, rows),
+        'Key Amount': rng.integers(0, 4, rows) * 500.0,
+    }).to_csv(file_path, index=False)
+
+
+def _sources(tmp_path):
+    _write_source(tmp_path / 'north.csv', 300, 1, ['BIHAR', 'PUNJAB'])
+    _write_source(tmp_path / 'west.csv', 200, 2, ['GUJARAT', 'BIHAR'])
+    (tmp_path / 'notes.txt').write_text('not a source\n')
+
+
+def test_parallel_load_merges_sources_with_shared_codes(tmp_path, monkeypatch):
+    _sources(tmp_path)
+    assert list(source_files(str(tmp_path))) == ['north.csv', 'west.csv']
+    frame, cube, cubes = load_sources(str(tmp_path), processes=2)
+
+    assert frame['Source'].value_counts().to_dict() == {'north.csv': 300, 'west.csv': 200}
+    assert sorted(frame['State'].cat.categories) == ['BIHAR', 'GUJARAT', 'PUNJAB']
+    pd.testing.assert_frame_equal(cube.query(), DailyCube.build(frame).query())
+    west = cubes['west.csv'].query(state='BIHAR')
+    expected = DailyCube.build(frame[(frame['Source'] == 'west.csv').to_numpy()]).query(state='BIHAR')
+    pd.testing.assert_frame_equal(west, expected)
+
+    # Every file now has a snapshot, so nothing is parsed again
+    monkeypatch.setattr(sources, 'load_csv_streaming', None)
+    again, _, _ = load_sources(str(tmp_path), processes=2)
+    assert again['Source'].tolist() == frame['Source'].tolist()
+
+    # The snapshots are shared with single-file mode, which has no Source column
+    assert 'Source' not in read_snapshot_parts(str(tmp_path / 'north.csv'))[0]
+
+
+def test_single_file_snapshot_is_tagged_when_merged(tmp_path, monkeypatch):
+    _sources(tmp_path)
+    monkeypatch.setitem(app.app.config, 'DATA_FILE', str(tmp_path / 'north.csv'))
+    single = app._load_dataset_parts()[0]
+    assert 'Source' not in single
+
+    def parse(path, **kwargs):
+        # north.csv has a snapshot and must be mapped, not parsed
+        assert not path.endswith('north.csv')
+        return load_csv_streaming(path, **kwargs)
+    monkeypatch.setattr(sources, 'load_csv_streaming', parse)
+    frame, _, _ = load_sources(str(tmp_path / '*.csv'), processes=1)
+    assert frame['Source'].isna().sum() == 0
+    assert (frame['Source'] == 'north.csv').sum() == len(single)
+
+
+def test_only_changed_files_are_reparsed(tmp_path, monkeypatch):
+    _sources(tmp_path)
+    parsed = []
+    monkeypatch.setattr(sources, 'load_csv_streaming',
+                        lambda path, **kwargs: parsed.append(os.path.basename(path)) or load_csv_streaming(path, **kwargs))
+    pattern = str(tmp_path / '*.csv')
+    signature = data_signature(pattern)
+    load_sources(pattern, processes=1)
+    assert sorted(parsed) == ['north.csv', 'west.csv']
+
+    _write_source(tmp_path / 'west.csv', 250, 3, ['GUJARAT'])
+    assert data_signature(pattern) != signature
+    parsed.clear()
+    frame, _, cubes = load_sources(pattern, processes=1)
+    assert parsed == ['west.csv']
+    assert len(frame) == 550
+    assert cubes['west.csv'].query()['visits'].sum() == 250
+
+
+def test_filter_data_by_source(tmp_path, monkeypatch):
+    _sources(tmp_path)
+    monkeypatch.setitem(app.app.config, 'DATA_FILE', str(tmp_path))
+    monkeypatch.setitem(app.app.config, 'DATA_LOAD_PROCESSES', 1)
+    monkeypatch.setattr(app, 'data_store', DatasetStore(str(tmp_path), app.load_dataset_parts,
+                                                        signature=data_signature))
+    monkeypatch.setattr(app, 'performance_cache', QueryCache())
+    client = app.app.test_client()
+    assert b'north.csv' in client.get('/').data
+
+    everything = client.get('/filter-data').get_json()
+    north = client.get('/filter-data', query_string={'source': 'north.csv'}).get_json()
+    west = client.get('/filter-data', query_string={'source': 'west.csv'}).get_json()
+    assert sum(row['# Visits'] for row in everything) == 500
+    assert sum(row['# Visits'] for row in north) == 300
+    assert sum(row['# Visits'] for row in west) == 200
+    assert client.get('/filter-data', query_string={'source': 'east.csv'}).status_code == 400
+
+    series = client.get('/timeseries', query_string={'group_by': 'source'}).get_json()['series']
+    assert {entry['name']: sum(entry['visits']) for entry in series} == {'north.csv': 300, 'west.csv': 200}
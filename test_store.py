@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+import app
+from cube import DailyCube
+from loader import clean_data
+from store import AnalyticsSource, AnalyticsStore
+
+
+def _rows(rows, seed=5):
+    rng = np.random.default_rng(seed)
+    timestamps = pd.Timestamp('2025-03-01') + pd.to_timedelta(rng.integers(0, 40 * 86400, rows), unit='s')
+    return pd.DataFrame({
+        'Timestamp': timestamps.strftime('%d/%m/%Y %H:%M:%S'),
+        'Shop Name': rng.choice([f'Shop {i}' for i in range(80)], rows),
+        'State': rng.choice(['GUJARAT', 'BIHAR'], rows),
+        'BDM Name': rng.choice(['A', 'B', 'C', 'D'], rows),
+        'Keys Sold': rng.integers(0, 3, rows),
+        'Key Amount': rng.integers(0, 4, rows) * 500.0,
+        'Wallet Transaction ID': np.where(rng.random(rows) < 0.2, [f'txn-{i}' for i in range(rows)], None),
+    })
+
+
+def _assert_matches_cube(store, df):
+    cube = DailyCube.build(clean_data(df.copy()))
+    for start_day, end_day in [(None, None), (20155, 20160), (20170, None)]:
+        for state in [None, 'BIHAR', 'NOWHERE']:
+            pd.testing.assert_frame_equal(store.query(start_day, end_day, state),
+                                          cube.query(start_day, end_day, state).reset_index(drop=True),
+                                          check_index_type=False)
+
+
+def test_sync_upserts_idempotently_and_appends(tmp_path):
+    data_file = tmp_path / 'bdm_data.csv'
+    df = _rows(2000)
+    df.iloc[:1500].to_csv(data_file, index=False)
+    store = AnalyticsStore(str(tmp_path / 'visits.sqlite'))
+    assert store.sync(str(data_file), app.load_appended_data, chunk_rows=400)
+    assert not store.sync(str(data_file), app.load_appended_data)
+    _assert_matches_cube(store, df.iloc[:1500])
+
+    # Appended rows are parsed on their own and land next to the earlier ones
+    with open(data_file, 'a') as f:
+        df.iloc[1500:].to_csv(f, index=False, header=False)
+    generation = store.generation()
+    assert store.sync(str(data_file), app.load_appended_data)
+    assert store.generation() == generation + 1
+    _assert_matches_cube(store, df)
+
+    # The in-memory dataset's appends are skipped once a sync has stored the same rows
+    assert store.append(clean_data(df.iloc[1500:].copy())) == 0
+    _assert_matches_cube(store, df)
+
+    # Re-ingesting the same rows changes nothing
+    store.upsert(clean_data(df.copy()))
+    _assert_matches_cube(store, df)
+
+
+def test_rewritten_file_keeps_history_and_updates_rows(tmp_path):
+    data_file = tmp_path / 'bdm_data.csv'
+    df = _rows(600)
+    df.to_csv(data_file, index=False)
+    store = AnalyticsStore(str(tmp_path / 'visits.sqlite'))
+    store.sync(str(data_file))
+
+    # The new export drops the first 100 visits and corrects the amount of the rest
+    rewritten = df.iloc[100:].assign(**{'Key Amount': df['Key Amount'].iloc[100:] + 1})
+    rewritten.to_csv(data_file, index=False)
+    store.sync(str(data_file))
+    _assert_matches_cube(store, pd.concat([df.iloc[:100], rewritten]))
+
+
+def test_filter_data_pushdown_matches_in_memory(tmp_path, monkeypatch):
+    client = app.app.test_client()
+    forms = [{'time_filter': 'monthly', 'state': 'All'},
+             {'time_filter': 'monthly', 'month': 'March', 'year': '2025', 'state': 'UTTAR PRADESH'},
+             {'time_filter': 'weekly', 'start_date': '03/17/2025', 'end_date': '03/23/2025', 'state': 'GUJARAT'}]
+    expected = [client.post('/filter-data', data=form).get_json() for form in forms]
+
+    store = AnalyticsStore(str(tmp_path / 'visits.sqlite'))
+    monkeypatch.setattr(app, 'analytics_source', AnalyticsSource(store, app.app.config['DATA_FILE'], check_interval=0))
+    assert [client.post('/filter-data', data=form).get_json() for form in forms] == expected
+    assert client.get('/').status_code == 200
+
+
+def test_repeated_visits_survive_chunks_and_appends(tmp_path):
+    # Visits to one shop by one BDM within the same second, differing only in what was sold
+    def visits(keys):
+        return pd.DataFrame({'Timestamp': '05/03/2025 10:00:00', 'Shop Name': 'Shop 1', 'State': 'BIHAR',
+                             'BDM Name': 'A', 'Keys Sold': keys, 'Key Amount': [500.0 * k for k in keys]})
+
+    data_file = tmp_path / 'bdm_data.csv'
+    visits([1, 2, 3]).to_csv(data_file, index=False)
+    store = AnalyticsStore(str(tmp_path / 'visits.sqlite'))
+    store.sync(str(data_file), app.load_appended_data, chunk_rows=1)
+    assert store.summary()[0] == 3
+
+    # Appended repeats are numbered after the stored ones
+    with open(data_file, 'a') as f:
+        visits([4, 5]).to_csv(f, index=False, header=False)
+    store.sync(str(data_file), app.load_appended_data)
+    assert store.query()['keys_sold'].sum() == 15
+    store.append(clean_data(visits([6])))
+    assert store.summary()[0] == 6
+
+    # Re-ingesting the whole file keeps the numbering it had
+    store.upsert(clean_data(pd.read_csv(data_file)))
+    assert store.query()['visits'].sum() == 6
+
+
+def test_summary_is_kept_per_generation(tmp_path):
+    store = AnalyticsStore(str(tmp_path / 'visits.sqlite'))
+    store.upsert(clean_data(_rows(300)))
+    generation = store.generation()
+    summary = store.summary(generation)
+    assert summary[:2] == (300, ['BIHAR', 'GUJARAT'])
+    assert summary[2] == ['April', 'March']
+
+    store.upsert(clean_data(_rows(50, seed=6).assign(State='PUNJAB')))
+    assert store.summary(generation) == summary
+    assert store.summary(store.generation())[:2] == (350, ['BIHAR', 'GUJARAT', 'PUNJAB'])
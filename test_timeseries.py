@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+from cube import to_day_number
+from dataset import Dataset
+from timeseries import cube_rollup, day_bounds, row_rollup, period_labels, period_numbers
+
+
+def _frame(rows=3000, seed=11):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Timestamp': pd.Timestamp('2024-12-20') + pd.to_timedelta(rng.integers(0, 120 * 24, rows), unit='h'),
+        'BDM Name': rng.choice([f'BDM {i}' for i in range(8)], rows),
+        'Shop Name': rng.choice([f'Shop {i}' for i in range(90)], rows),
+        'State': rng.choice(['GUJARAT', 'BIHAR'], rows),
+        'City': rng.choice(['RAJKOT', 'PATNA', None], rows),
+        'Keys Sold': rng.integers(0, 4, rows),
+        'Key Amount': rng.integers(0, 900, rows).astype(float),
+    })
+    return Dataset(df, version=1)
+
+
+def _expected(frame, column, period):
+    grouped = frame.assign(period=period, **{column: frame[column].astype(object)}).groupby([column, 'period'])
+    return grouped.agg(visits=('Timestamp', 'count'), unique_merchants=('Shop Name', 'nunique'),
+                       keys_sold=('Keys Sold', 'sum'), key_amount=('Key Amount', 'sum'))
+
+
+def _as_frame(result):
+    records = []
+    for series in result['series']:
+        for label, *values in zip(result['periods'], series['visits'], series['unique_merchants'],
+                                  series['keys_sold'], series['key_amount']):
+            if values[0]:
+                records.append((series['name'], label, *values))
+    columns = ['name', 'period', 'visits', 'unique_merchants', 'keys_sold', 'key_amount']
+    return pd.DataFrame.from_records(records, columns=columns).set_index(['name', 'period'])
+
+
+def test_iso_week_and_month_labels():
+    days = [to_day_number(pd.Timestamp(day)) for day in ['2024-12-29', '2024-12-30', '2025-01-05', '2025-03-31']]
+    assert period_labels(period_numbers(days, 'week'), 'week') == ['2024-W52', '2025-W01', '2025-W01', '2025-W14']
+    assert period_labels(period_numbers(days, 'month'), 'month') == ['2024-12', '2024-12', '2025-01', '2025-03']
+
+
+def test_cube_rollup_matches_groupby():
+    dataset = _frame()
+    frame = dataset.frame
+    start, end = to_day_number(pd.Timestamp('2025-01-06')), to_day_number(pd.Timestamp('2025-03-02'))
+    window = frame[(frame['Timestamp'] >= '2025-01-06') & (frame['Timestamp'] < '2025-03-03')
+                   & (frame['State'] == 'BIHAR')]
+
+    result = cube_rollup(dataset.cube, 'bdm', 'week', start, end, 'BIHAR')
+    assert len(result['periods']) == 8
+    iso = window['Timestamp'].dt.isocalendar()
+    labels = iso['year'].astype(str) + '-W' + iso['week'].astype(str).str.zfill(2)
+    expected = _expected(window, 'BDM Name', labels)
+    pd.testing.assert_frame_equal(_as_frame(result), expected.rename_axis(['name', 'period']), check_dtype=False)
+
+
+def test_city_rollup_reports_missing_cities_as_unknown():
+    dataset = _frame()
+    frame = dataset.frame
+    result = row_rollup(dataset.rows(), 'City', 'month')
+    assert [series['name'] for series in result['series']] == ['PATNA', 'RAJKOT', 'Unknown']
+    assert result['periods'] == ['2024-12', '2025-01', '2025-02', '2025-03', '2025-04']
+
+    cities = frame['City'].astype(object).fillna('Unknown')
+    expected = _expected(frame.assign(City=cities), 'City', frame['Timestamp'].dt.strftime('%Y-%m'))
+    pd.testing.assert_frame_equal(_as_frame(result), expected.rename_axis(['name', 'period']), check_dtype=False)
+
+
+def test_rollup_window_is_clipped_to_the_data():
+    dataset = _frame()
+    start, end = to_day_number(pd.Timestamp('1700-01-01')), to_day_number(pd.Timestamp('2200-12-31'))
+    whole = cube_rollup(dataset.cube, 'bdm', 'day')
+    assert cube_rollup(dataset.cube, 'bdm', 'day', start, end) == whole
+    assert len(whole['periods']) == 120
+    rows = row_rollup(dataset.rows(), 'City', 'day', start, end, bounds=day_bounds(dataset.cube))
+    assert rows['periods'] == whole['periods']
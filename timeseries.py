@@ -0,0 +1,142 @@
+import datetime
+import numpy as np
+import pandas as pd
+
+from indexes import NS_PER_DAY
+from distinct import shop_keys
+
+GRANULARITIES = ['day', 'week', 'month']
+GROUPINGS = ['bdm', 'state', 'city', 'source']
+METRICS = ['visits', 'unique_merchants', 'keys_sold', 'key_amount']
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def period_numbers(days, granularity):
+    """Map day numbers (days since epoch) to consecutive period numbers at a granularity
+
+    Weeks are ISO weeks, like the Week column: 1970-01-01 was a Thursday, so (day + 3) // 7
+    counts Mondays since 1969-12-29. Months are counted since January 1970.
+    """
+    days = np.asarray(days, dtype=np.int64)
+    if granularity == 'day':
+        return days
+    if granularity == 'week':
+        return (days + 3) // 7
+    if len(days) > 1024:
+        # Calendar conversion is slow per element; convert the (short) day span once and gather
+        first = int(days.min())
+        table = period_numbers(np.arange(first, int(days.max()) + 1), granularity)
+        return table[days - first]
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+def period_labels(periods, granularity):
+    """Readable labels for period numbers: 2025-03-24, 2025-W13 or 2025-03"""
+    if granularity == 'day':
+        return [(EPOCH + datetime.timedelta(days=int(period))).isoformat() for period in periods]
+    if granularity == 'week':
+        labels = []
+        for period in periods:
+            year, week, _ = (EPOCH + datetime.timedelta(days=int(period) * 7 - 3)).isocalendar()
+            labels.append(f'{year}-W{week:02d}')
+        return labels
+    return [f'{1970 + int(period) // 12}-{int(period) % 12 + 1:02d}' for period in periods]
+
+
+def rollup(day, group, names, visits, keys, amount, pair_day, pair_group, pair_shop, shop_count,
+           granularity, start_day=None, end_day=None, bounds=None):
+    """Per-group metric series over dense periods, from cell (or row) arrays and (group, shop) pairs
+
+    Additive metrics are one bincount over group * n_periods + period. Unique merchants are
+    distinct (period, group, shop) keys counted per (group, period). Groups with no visits
+    in the window are dropped; the rest are ordered by name. bounds is the (first, last) day
+    the dataset covers; the requested window is clipped to it, so a wide date range cannot
+    allocate periods that hold no data.
+    """
+    if bounds is not None:
+        start_day = bounds[0] if start_day is None else max(start_day, bounds[0])
+        end_day = bounds[1] if end_day is None else min(end_day, bounds[1])
+    period = period_numbers(day, granularity)
+    pair_period = period_numbers(pair_day, granularity)
+    if start_day is not None:
+        first = int(period_numbers([start_day], granularity)[0])
+    else:
+        first = int(period.min()) if len(period) else 0
+    if end_day is not None:
+        last = int(period_numbers([end_day], granularity)[0])
+    else:
+        last = int(period.max()) if len(period) else -1
+    n_periods = max(last - first + 1, 0)
+    n_groups = len(names)
+    size = n_groups * n_periods
+
+    cell_key = group.astype(np.int64) * n_periods + (period - first)
+    totals = {
+        'visits': np.bincount(cell_key, weights=visits, minlength=size).round().astype(np.int64),
+        'keys_sold': np.bincount(cell_key, weights=keys, minlength=size).round().astype(np.int64),
+        'key_amount': np.bincount(cell_key, weights=amount, minlength=size).round(2),
+    }
+    pair_key = (pair_group.astype(np.int64) * n_periods + (pair_period - first)) * shop_count + pair_shop
+    totals['unique_merchants'] = np.bincount(np.unique(pair_key) // shop_count, minlength=size)
+    totals = {metric: values.reshape(n_groups, n_periods) for metric, values in totals.items()}
+
+    present = sorted(np.flatnonzero(totals['visits'].sum(axis=1) > 0), key=lambda code: str(names[code]))
+    series = [{'name': str(names[code]), **{metric: totals[metric][code].tolist() for metric in METRICS}}
+              for code in present]
+    periods = np.arange(first, last + 1)
+    return {'granularity': granularity, 'periods': period_labels(periods, granularity), 'series': series}
+
+
+def cube_rollup(cube, by, granularity, start_day=None, end_day=None, state=None):
+    """Series per BDM or per state straight from the daily cube's cells"""
+    cells, pairs = cube.select(start_day, end_day, state)
+    if cells is None or not len(cube.cell_day):
+        return {'granularity': granularity, 'periods': [], 'series': []}
+    if by == 'bdm':
+        names, group, pair_group = cube.bdm_names, cube.cell_bdm[cells], cube.pair_bdm[pairs]
+    else:
+        names, group, pair_group = cube.states, cube.cell_state[cells], cube.pair_state[pairs]
+    return rollup(cube.cell_day[cells], group, names, cube.cell_visits[cells], cube.cell_keys[cells],
+                  cube.cell_amount[cells], cube.pair_day[pairs], pair_group, cube.pair_shop[pairs],
+                  cube.shop_count, granularity, start_day, end_day, day_bounds(cube))
+
+
+def day_bounds(cube):
+    """First and last day the cube has cells for, or None when it is empty"""
+    if not len(cube.cell_day):
+        return None
+    return int(cube.cell_day.min()), int(cube.cell_day.max())
+
+
+def row_rollup(rows, column, granularity, start_day=None, end_day=None, resolved=None, bounds=None):
+    """Series per value of a column the cube does not aggregate (e.g. City), from indexed raw rows
+
+    resolved is the dataset's resolve_aliases() (see DailyCube.resolved_aliases), so shops
+    are keyed as they are over the whole dataset rather than over just these rows. bounds
+    clips the window as in rollup() (see day_bounds).
+    """
+    # Indexed rows always have a timestamp, and they are after the epoch
+    day = rows['Timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64) // NS_PER_DAY
+    group, names = _codes(rows[column])
+    if (group < 0).any():
+        # Rows without a value are reported as 'Unknown' instead of being dropped
+        unknown = np.flatnonzero(names == 'Unknown')
+        if len(unknown):
+            code = unknown[0]
+        else:
+            code, names = len(names), np.append(names, 'Unknown')
+        group = np.where(group < 0, code, group)
+    # Shop codes only need to be distinct, so a missing shop (-1) just becomes one more code
+    shop, shops = _codes(shop_keys(rows, resolved))
+    return rollup(day, group, names, np.ones(len(day)), rows['Keys Sold'].to_numpy(),
+                  rows['Key Amount'].to_numpy(dtype=np.float64), day, group, shop + 1, len(shops) + 1,
+                  granularity, start_day, end_day, bounds)
+
+
+def _codes(series):
+    """Integer codes (-1 for missing) and their values, in no particular order"""
+    if hasattr(series, 'cat'):
+        return series.cat.codes.to_numpy(), np.asarray(series.cat.categories, dtype=object)
+    codes, uniques = pd.factorize(series)
+    return codes, np.asarray(uniques, dtype=object)